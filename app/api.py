@@ -1,24 +1,55 @@
 import asyncio
+import hashlib
+import json
 import logging
-import time
-import requests
 import os
+import time
+from contextlib import asynccontextmanager
 from typing import Dict
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Query, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from pydantic import BaseModel, Field
 import uvicorn
 
 from dotenv import load_dotenv
-from database import fetch_unread_messages, insert_message, mark_message_as_processed
+from database import (advance_device_cursor, close_pool, fetch_messages_since, get_device_cursor, insert_message,
+                      iter_backlog, mark_messages_as_processed, mark_user_messages_as_processed, max_user_message_id,
+                      open_pool, record_delivery_attempt, start_batcher, stop_batcher, table_sizes, write_stats)
+from delivery import AckScheduler
+from hub import create_hub
+from maintenance import maintenance
+from metrics import CONTENT_TYPE, registry
+from telegram_client import TelegramClient
 
 load_dotenv()
 
-TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Держит пул соединений с БД и групповую запись открытыми всё время работы сервера"""
+    await open_pool()
+    await start_batcher()
+    await telegram.start()
+    ack_scheduler.start()
+    await hub.start(deliver_message)
+    maintenance.start()
+    try:
+        yield
+    finally:
+        await maintenance.stop()
+        await hub.stop()
+        await ack_scheduler.stop()
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+        await telegram.close()
+        await stop_batcher()
+        await close_pool()
+
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -26,65 +57,215 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(GZipMiddleware, minimum_size=1024)  # Только HTTP; WebSocket сжимается permessage-deflate
 
-active_connections: Dict[str, WebSocket] = {}
-pending_acks: Dict[str, Dict] = {}
+telegram = TelegramClient()
+hub = create_hub()
+
+active_connections: Dict[str, Dict[str, "DeviceConnection"]] = {}  # telegram_user_id -> device_id -> соединение
+background_tasks: set = set()
 
 PING_INTERVAL = 30
 PING_TIMEOUT = 10
-ACK_TIMEOUT = 5
+MAX_DELIVERY_ATTEMPTS = int(os.getenv("MAX_DELIVERY_ATTEMPTS", "8"))
+REPLAY_WINDOW = int(os.getenv("REPLAY_WINDOW", "10"))  # Сколько сообщений бэклога можно держать без ACK
+REPLAY_PAGE_SIZE = int(os.getenv("REPLAY_PAGE_SIZE", "100"))
+DEFAULT_DEVICE_ID = "default"  # Для клиентов, которые не передают device_id
+
+# Протокол v2 (клиент подключается с ?protocol=2): пачки сообщений и накопительные ACK
+REPLAY_WINDOW_V2 = int(os.getenv("REPLAY_WINDOW_V2", "200"))
+V2_BATCH_WINDOW = float(os.getenv("V2_BATCH_WINDOW_MS", "10")) / 1000
+V2_BATCH_MAX = int(os.getenv("V2_BATCH_MAX", "100"))
+
+# HTTP-синхронизация для клиентов без открытого сокета: GET /messages/sync и POST /messages/ack
+SYNC_PAGE_SIZE = int(os.getenv("SYNC_PAGE_SIZE", "100"))
+SYNC_MAX_PAGE_SIZE = int(os.getenv("SYNC_MAX_PAGE_SIZE", "1000"))
+ACK_BATCH_MAX = int(os.getenv("ACK_BATCH_MAX", "1000"))
+
+DB_INSERT_SECONDS = registry.histogram("db_insert_seconds", "Запись нового сообщения в БД")
+WS_SEND_SECONDS = {protocol: registry.histogram("ws_send_seconds", "Отправка кадра клиенту Obsidian",
+                                                {"protocol": protocol}) for protocol in (1, 2)}
+ACK_ROUND_TRIP_SECONDS = registry.histogram("ack_round_trip_seconds", "От отправки сообщения до ACK устройства")
+
+
+@registry.collector
+def _collect_connections():
+    devices = [connection for connections in active_connections.values() for connection in connections.values()]
+    yield "ws_active_connections", "gauge", "Подключённые устройства Obsidian", {}, len(devices)
+    yield "ws_pending_acks", "gauge", "Отправленные сообщения без ACK", {}, \
+        sum(len(connection.pending) for connection in devices)
+    yield "ack_timers", "gauge", "Таймеры ожидания ACK", {}, len(ack_scheduler)
+
+class MessageIn(BaseModel):
+    telegram_user_id: str
+    text: str
+    model_text: str
+    progress_message_id: int
+    chat_id: int
+    plan_date: str
+    trace_id: str | None = None  # Сквозной id плана из бота
+
+class AckIn(BaseModel):
+    telegram_user_id: str
+    device_id: str = DEFAULT_DEVICE_ID
+    ids: list[int] = Field(min_length=1, max_length=ACK_BATCH_MAX)
 
 @app.post("/messages")
-async def add_message(telegram_user_id: str, text: str, model_text: str, progress_message_id: int, chat_id: int, plan_date: str):
+async def add_message(telegram_user_id: str, text: str, model_text: str, progress_message_id: int, chat_id: int, plan_date: str,
+                      trace_id: str | None = None):
+    """Добавляет сообщение в БД и отправляет клиенту по WebSocket (параметры в query, старый формат)"""
+    return await store_and_deliver(MessageIn(
+        telegram_user_id=telegram_user_id, text=text, model_text=model_text,
+        progress_message_id=progress_message_id, chat_id=chat_id, plan_date=plan_date, trace_id=trace_id
+    ))
+
+@app.post("/messages/json")
+async def add_message_json(message: MessageIn):
+    """То же, что POST /messages, но данные передаются JSON-телом"""
+    return await store_and_deliver(message)
+
+async def store_and_deliver(message: MessageIn):
     """Добавляет сообщение в БД и отправляет клиенту по WebSocket"""
-    db_message_id = await insert_message(telegram_user_id, text, model_text, chat_id, progress_message_id, plan_date)
-    print({"progress_message_id": progress_message_id, "chat_id": chat_id})
-
-    logger.info(f"Новое сообщение {db_message_id} от {telegram_user_id}: {text}")
-
-    if telegram_user_id in active_connections:
-        websocket = active_connections[telegram_user_id]
-        data_to_send = {
-            "db_message_id": db_message_id,
-            "type": "new_message",
-            "text": text,
-            "model_text": model_text,
-            "chat_id": chat_id,
-            "progress_message_id": progress_message_id,
-            "plan_date": plan_date
-        }
-        await send_with_ack(websocket, telegram_user_id, data_to_send)
+    telegram_user_id = message.telegram_user_id
+    started = time.perf_counter()
+    db_message_id = await insert_message(telegram_user_id, message.text, message.model_text, message.chat_id,
+                                         message.progress_message_id, message.plan_date, message.trace_id)
+    DB_INSERT_SECONDS.observe(time.perf_counter() - started)
+
+    logger.info(f"[{message.trace_id}] Новое сообщение {db_message_id} от {telegram_user_id}: {message.text}")
+
+    # Сокет пользователя может быть открыт в другом воркере — доставку выполняет хаб
+    await hub.publish(telegram_user_id, {
+        "db_message_id": db_message_id,
+        "type": "new_message",
+        "text": message.text,
+        "model_text": message.model_text,
+        "chat_id": message.chat_id,
+        "progress_message_id": message.progress_message_id,
+        "plan_date": message.plan_date,
+        "trace_id": message.trace_id
+    })
 
     return {"status": "ok", "message": "✅ Сообщение отредактировано моделью!"}
 
+@app.get("/messages/sync")
+async def sync_messages(request: Request, telegram_user_id: str, since: int = 0,
+                        limit: int = Query(SYNC_PAGE_SIZE, ge=1, le=SYNC_MAX_PAGE_SIZE), unread_only: bool = False):
+    """
+    Сообщения пользователя после id since страницами по возрастанию id (keyset, без OFFSET).
+    Следующая страница — с since=next_since, пока has_more. Повторный запрос с If-None-Match
+    получает 304 без тела, если страница не изменилась (нет новых сообщений и подтверждений).
+    """
+    messages, has_more = await fetch_messages_since(telegram_user_id, since, limit, unread_only)
+    body = json.dumps({
+        "messages": [{
+            "db_message_id": m["id"],
+            "text": m["text"],
+            "model_text": m["model_text"],
+            "chat_id": m["chat_id"],
+            "progress_message_id": m["progress_message_id"],
+            "plan_date": m["plan_date"],
+            "created_at": m["created_at"],
+            "processed": m["processed"],
+            "trace_id": m["trace_id"]
+        } for m in messages],
+        "next_since": messages[-1]["id"] if messages else since,
+        "has_more": has_more
+    }, ensure_ascii=False, separators=(",", ":")).encode()
+
+    # Слабый ETag: одинаков для сжатого и несжатого ответа
+    etag = f'W/"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+@app.post("/messages/ack")
+async def ack_messages(ack: AckIn):
+    """
+    Подтверждает пачку сообщений одним запросом: отмечает их обработанными, двигает курсор устройства
+    и снимает с ожидания ACK в его WebSocket, если он открыт. Правка в Telegram — для впервые обработанных.
+    """
+    ids = sorted(set(ack.ids))
+    processed = await mark_user_messages_as_processed(ack.telegram_user_id, ids)
+    # Курсор — только до своих id: чужой или несуществующий id не должен перескочить реальные сообщения
+    last_id = await max_user_message_id(ack.telegram_user_id, ids)
+    if last_id is not None:
+        await advance_device_cursor(ack.telegram_user_id, ack.device_id, last_id)
+    for _, chat_id, progress_message_id, _ in processed:
+        edit_telegram_message(chat_id, progress_message_id, '🚀 Сообщение успешно отправлено!')
+
+    connection = active_connections.get(ack.telegram_user_id, {}).get(ack.device_id)
+    if connection is not None:
+        for db_message_id in ids:
+            if db_message_id in connection.pending:
+                connection.release(db_message_id)
+
+    if processed:
+        traces = ", ".join(str(trace_id) for *_, trace_id in processed)
+        logger.info(f"✅ Сообщения {[row[0] for row in processed]} подтверждены по HTTP "
+                    f"{ack.telegram_user_id}/{ack.device_id} (trace: {traces})")
+    return {"status": "ok", "processed": [row[0] for row in processed]}
+
+async def deliver_message(telegram_user_id: str, message: dict):
+    """Рассылает новое сообщение всем устройствам пользователя, подключённым к этому процессу"""
+    db_message_id = message["db_message_id"]
+    # Пропускаем устройства, которым сообщение уже отправлено (например, досылкой бэклога)
+    targets = [
+        connection for connection in active_connections.get(telegram_user_id, {}).values()
+        if db_message_id not in connection.pending
+    ]
+    if not targets:
+        return
+
+    record_delivery_attempt(db_message_id)
+    results = await asyncio.gather(*(send_with_ack(connection, message) for connection in targets),
+                                   return_exceptions=True)
+    for connection, result in zip(targets, results):
+        if isinstance(result, Exception):
+            logger.error(f"Ошибка при отправке сообщения {db_message_id} -> {connection.label}: {result}")
+
+@app.get("/stats/db")
+async def db_stats():
+    """Счётчики групповой записи в БД"""
+    batches = write_stats["batches"]
+    return {
+        **write_stats,
+        "avg_batch_size": round(write_stats["rows"] / batches, 2) if batches else 0,
+        "avg_commit_ms": round(write_stats["total_commit_ms"] / batches, 3) if batches else 0,
+    }
+
+@app.get("/admin/db")
+async def db_sizes():
+    """Размеры таблиц и индексов messages.db, число строк в рабочей таблице и архиве, состояние обслуживания"""
+    return {**await table_sizes(), "maintenance": maintenance.stats}
+
+@app.get("/metrics")
+async def metrics():
+    """Метрики процесса в текстовом формате Prometheus"""
+    return Response(registry.render(), media_type=CONTENT_TYPE)
+
 @app.websocket("/ws/{telegram_user_id}")
-async def websocket_endpoint(websocket: WebSocket, telegram_user_id: str):
-    """Основной обработчик WebSocket-соединения"""
+async def websocket_endpoint(websocket: WebSocket, telegram_user_id: str, device_id: str = DEFAULT_DEVICE_ID,
+                             protocol: int = 1):
+    """
+    Основной обработчик WebSocket-соединения (одно устройство пользователя).
+
+    protocol=1 — по кадру на сообщение и по ACK на каждое.
+    protocol=2 — сообщения приходят пачками {"type": "messages", "messages": [...]},
+    а подтверждать можно всё сразу: {"type": "confirm", "up_to": N}.
+    Сжатие кадров (permessage-deflate) договаривается на уровне WebSocket-рукопожатия.
+    """
     await websocket.accept()
-    active_connections[telegram_user_id] = websocket
-    logger.info(f"📡 WebSocket подключен: {telegram_user_id}")
-
-    # Создаём событие для ожидания pong
-    pong_event = asyncio.Event()
-
-    # Запуск фоновой задачи пинга, передавая pong_event
-    asyncio.create_task(ping_loop(websocket, telegram_user_id, pong_event))
-
-    # Отправляем все непрочитанные сообщения
-    messages = await fetch_unread_messages(telegram_user_id)
-    for message in messages:
-        time.sleep(0.1)
-        data_to_send = {
-            "type": "new_message",
-            "db_message_id": message["id"],
-            "text": message["text"],
-            "created_at": message["created_at"],
-            "chat_id": message["chat_id"],
-            "progress_message_id": message["progress_message_id"],
-            "model_text": message["model_text"],
-            "plan_date": message["plan_date"]
-        }
-        await send_with_ack(websocket, telegram_user_id, data_to_send)
+    connection = DeviceConnection(websocket, telegram_user_id, device_id, 2 if protocol >= 2 else 1)
+    active_connections.setdefault(telegram_user_id, {})[device_id] = connection
+    logger.info(f"📡 WebSocket подключен: {connection.label}")
+
+    # Запуск фоновой задачи пинга
+    ping_task = asyncio.create_task(ping_loop(connection))
+
+    # Досылаем пропущенные устройством сообщения в фоне, чтобы сразу принимать ACK
+    replay_task = asyncio.create_task(replay_backlog(connection))
 
     try:
         while True:
@@ -96,105 +277,240 @@ async def websocket_endpoint(websocket: WebSocket, telegram_user_id: str):
 
             # Если получен pong, сигнализируем фоновой задаче
             if data.get("type") == "pong":
-                logger.info(f"✅ Получен pong от {telegram_user_id}")
-                pong_event.set()
+                logger.info(f"✅ Получен pong от {connection.label}")
+                connection.pong_event.set()
                 continue
 
-            # Обработка подтверждения доставки сообщений (ACK)
+            # Обработка подтверждения доставки сообщений (ACK).
+            # В v2 можно подтвердить всё отправленное этому устройству до id включительно: {"up_to": N}
             if data.get("type") == "confirm":
-                db_message_id = data.get("db_message_id")
-                progress_message_id = data.get("progress_message_id")
-                chat_id = data.get("chat_id")
-                if db_message_id in pending_acks.get(telegram_user_id, {}):
-                    del pending_acks[telegram_user_id][db_message_id]
-                    await mark_message_as_processed(db_message_id)
-                    edit_telegram_message(chat_id, progress_message_id, '🚀 Сообщение успешно отправлено!')
-                    logger.info(f"✅ Сообщение {db_message_id} подтверждено {telegram_user_id} progress_message_id - {progress_message_id} chat_id - {chat_id}")
+                ack_id = data.get("up_to", data.get("db_message_id"))
+                if not isinstance(ack_id, int) or isinstance(ack_id, bool):
+                    # Кривой кадр не должен рвать соединение: пропускаем его, неподтверждённое перешлём позже
+                    logger.warning(f"⚠️ Некорректный ACK от {connection.label}: {data}")
+                    continue
+                if "up_to" in data:
+                    message_ids = [db_message_id for db_message_id in connection.pending if db_message_id <= ack_id]
+                else:
+                    message_ids = [ack_id]
+                confirmed = {}
+                for db_message_id in message_ids:
+                    sent_at = connection.sent_at.get(db_message_id)
+                    message = connection.release(db_message_id)
+                    if message is not None:
+                        confirmed[db_message_id] = message
+                        ACK_ROUND_TRIP_SECONDS.observe(time.perf_counter() - sent_at)
+                if confirmed:
+                    # Запись в БД идёт в фоне, чтобы ACK из одного окна попали в одну транзакцию
+                    run_in_background(finish_confirm(connection, confirmed))
                 continue
 
-            logger.warning(f"⚠️ Неизвестный тип сообщения от {telegram_user_id}: {data}")
+            logger.warning(f"⚠️ Неизвестный тип сообщения от {connection.label}: {data}")
 
     except WebSocketDisconnect:
-        logger.warning(f"❌ WebSocket отключен: {telegram_user_id}")
+        logger.warning(f"❌ WebSocket отключен: {connection.label}")
     finally:
-        if telegram_user_id in active_connections:
-            del active_connections[telegram_user_id]
+        replay_task.cancel()
+        ping_task.cancel()
+        unregister_connection(connection)
+
+class DeviceConnection:
+    """Соединение одного устройства пользователя и его сообщения, ожидающие ACK"""
+
+    def __init__(self, websocket: WebSocket, telegram_user_id: str, device_id: str, protocol: int = 1):
+        self.websocket = websocket
+        self.telegram_user_id = telegram_user_id
+        self.device_id = device_id
+        self.protocol = protocol
+        self.window = REPLAY_WINDOW_V2 if protocol == 2 else REPLAY_WINDOW
+        self.pending: Dict[int, dict] = {}
+        self.sent_at: Dict[int, float] = {}  # Время последней отправки ожидающих ACK (perf_counter)
+        self.ack_event = asyncio.Event()  # Освободилось место в окне ACK
+        self.pong_event = asyncio.Event()
+        self._outbox: list[dict] = []
+        self._flush_task: asyncio.Task | None = None
+
+    async def send(self, message: dict):
+        """v1 — сразу отдельным кадром; v2 — копим до V2_BATCH_WINDOW и отправляем пачкой"""
+        if self.protocol == 1:
+            started = time.perf_counter()
+            await self.websocket.send_json(message)
+            WS_SEND_SECONDS[1].observe(time.perf_counter() - started)
+            return
+        self._outbox.append(message)
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush())
+
+    async def _flush(self):
+        try:
+            await asyncio.sleep(V2_BATCH_WINDOW)
+            while self._outbox:
+                batch, self._outbox = self._outbox[:V2_BATCH_MAX], self._outbox[V2_BATCH_MAX:]
+                started = time.perf_counter()
+                await self.websocket.send_json({"type": "messages", "messages": batch})
+                WS_SEND_SECONDS[2].observe(time.perf_counter() - started)
+        except Exception as e:
+            logger.error(f"Ошибка при отправке пачки сообщений -> {self.label}: {e}")
+        finally:
+            self._flush_task = None
+
+    def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+
+    @property
+    def label(self) -> str:
+        return f"{self.telegram_user_id}/{self.device_id}"
+
+    @property
+    def is_active(self) -> bool:
+        return active_connections.get(self.telegram_user_id, {}).get(self.device_id) is self
+
+    def ack_key(self, db_message_id: int) -> tuple:
+        return self.telegram_user_id, self.device_id, db_message_id
+
+    def release(self, db_message_id: int) -> dict | None:
+        """Снимает сообщение с ожидания ACK и будит досылку бэклога"""
+        message = self.pending.pop(db_message_id, None)
+        self.sent_at.pop(db_message_id, None)
+        ack_scheduler.cancel(self.ack_key(db_message_id))
+        self.ack_event.set()
+        return message
+
+async def finish_confirm(connection: DeviceConnection, confirmed: Dict[int, dict]):
+    """Двигает курсор устройства и отмечает сообщения обработанными одним UPDATE"""
+    try:
+        await advance_device_cursor(connection.telegram_user_id, connection.device_id, max(confirmed))
+        # Сообщение считается обработанным после ACK с любого устройства; правка в Telegram — один раз
+        for db_message_id in await mark_messages_as_processed(list(confirmed)):
+            message = confirmed[db_message_id]
+            edit_telegram_message(message["chat_id"], message["progress_message_id"], '🚀 Сообщение успешно отправлено!')
+        traces = ", ".join(str(message.get("trace_id")) for message in confirmed.values())
+        logger.info(f"✅ Сообщения {list(confirmed)} подтверждены {connection.label} (trace: {traces})")
+    except Exception as e:
+        logger.error(f"Ошибка при подтверждении сообщений {list(confirmed)} от {connection.label}: {e}")
+
+def run_in_background(coro):
+    """Запускает короткую фоновую задачу и держит на неё ссылку до завершения"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+def unregister_connection(connection: DeviceConnection):
+    if not connection.is_active:
+        return
+    devices = active_connections[connection.telegram_user_id]
+    del devices[connection.device_id]
+    if not devices:
+        del active_connections[connection.telegram_user_id]
+    # Неподтверждённые остаются в БД и будут досланы при переподключении
+    for db_message_id in list(connection.pending):
+        connection.release(db_message_id)
+    connection.close()
+
+async def replay_backlog(connection: DeviceConnection):
+    """
+    Досылает устройству сообщения после его курсора и непрочитанные до него (новому устройству — все непрочитанные).
+    Держит не больше connection.window сообщений без ACK и ждёт подтверждений вместо пауз.
+    """
+    try:
+        cursor = await get_device_cursor(connection.telegram_user_id, connection.device_id)
+        async for message in iter_backlog(connection.telegram_user_id, cursor, REPLAY_PAGE_SIZE):
+            while len(connection.pending) >= connection.window:
+                connection.ack_event.clear()
+                await connection.ack_event.wait()
+            if not connection.is_active:
+                return
+            if message["id"] in connection.pending:
+                continue
 
-async def ping_loop(websocket: WebSocket, telegram_user_id: str, pong_event: asyncio.Event):
+            data_to_send = {
+                "type": "new_message",
+                "db_message_id": message["id"],
+                "text": message["text"],
+                "created_at": message["created_at"],
+                "chat_id": message["chat_id"],
+                "progress_message_id": message["progress_message_id"],
+                "model_text": message["model_text"],
+                "plan_date": message["plan_date"],
+                "trace_id": message["trace_id"]
+            }
+            record_delivery_attempt(message["id"])
+            await send_with_ack(connection, data_to_send, message["delivery_attempts"] + 1)
+            await asyncio.sleep(0)  # Отдаём управление другим соединениям между отправками
+    except Exception as e:
+        logger.error(f"Ошибка при досылке сообщений {connection.label}: {e}")
+
+async def ping_loop(connection: DeviceConnection):
     """Фоновая задача для отправки ping и ожидания pong через событие"""
-    while telegram_user_id in active_connections:
+    while connection.is_active:
         await asyncio.sleep(PING_INTERVAL)
         try:
-            pong_event.clear()
-            await websocket.send_json({"type": "ping"})
-            logger.info(f"📤 Ping -> {telegram_user_id}")
+            connection.pong_event.clear()
+            await connection.websocket.send_json({"type": "ping"})
+            logger.info(f"📤 Ping -> {connection.label}")
             # Ждём, пока pong_event не будет установлен, или истечёт таймаут
-            await asyncio.wait_for(pong_event.wait(), timeout=PING_TIMEOUT)
+            await asyncio.wait_for(connection.pong_event.wait(), timeout=PING_TIMEOUT)
         except asyncio.TimeoutError:
-            logger.warning(f"⚠️ Pong не получен от {telegram_user_id} в течение {PING_TIMEOUT} секунд, закрываю соединение")
-            await websocket.close()
-            if telegram_user_id in active_connections:
-                del active_connections[telegram_user_id]
+            logger.warning(f"⚠️ Pong не получен от {connection.label} в течение {PING_TIMEOUT} секунд, закрываю соединение")
+            unregister_connection(connection)
+            await connection.websocket.close()
             break
         except Exception as e:
             logger.error(f"Ошибка при отправке ping: {e}")
             break
 
-async def send_with_ack(websocket: WebSocket, telegram_user_id: str, message: dict):
-    """Отправка сообщения с ожиданием подтверждения (ACK)"""
+async def send_with_ack(connection: DeviceConnection, message: dict, attempt: int = 1):
+    """Отправка сообщения с ожиданием подтверждения (ACK); попытку в БД записывает вызывающий"""
     db_message_id = message["db_message_id"]
+    connection.pending[db_message_id] = message
+    connection.sent_at[db_message_id] = time.perf_counter()
 
-    if telegram_user_id not in pending_acks:
-        pending_acks[telegram_user_id] = {}
+    await connection.send(message)
+    logger.info(f"📤 Отправлено сообщение {db_message_id} -> {connection.label} (попытка {attempt}), ждем ACK")
 
-    pending_acks[telegram_user_id][db_message_id] = message
+    ack_scheduler.schedule(connection.ack_key(db_message_id), attempt)
 
-    await websocket.send_json(message)
-    logger.info(f"📤 Отправлено сообщение {db_message_id} -> {telegram_user_id}, ждем ACK")
+async def on_ack_timeout(key: tuple, attempt: int):
+    """ACK не пришёл вовремя: переотправляем с растущей отсрочкой, пока не исчерпаны попытки"""
+    telegram_user_id, device_id, db_message_id = key
+    connection = active_connections.get(telegram_user_id, {}).get(device_id)
+    if connection is None or db_message_id not in connection.pending:
+        return
 
-    asyncio.create_task(check_ack_timeout(websocket, telegram_user_id, db_message_id))
+    if attempt >= MAX_DELIVERY_ATTEMPTS:
+        # Сообщение остаётся в БД и будет дослано при переподключении
+        logger.error(f"❌ ACK не получен для сообщения {db_message_id} от {connection.label} (попыток: {attempt})")
+        connection.release(db_message_id)
+        return
 
-async def check_ack_timeout(websocket: WebSocket, telegram_user_id: str, db_message_id: int):
-    """Проверяем, пришел ли ACK на сообщение"""
-    await asyncio.sleep(ACK_TIMEOUT)
-    if telegram_user_id in pending_acks and db_message_id in pending_acks[telegram_user_id]:
-        logger.error(f"❌ ACK не получен для сообщения {db_message_id} от {telegram_user_id}")
-        del pending_acks[telegram_user_id][db_message_id]
+    logger.warning(f"🔁 Повторная отправка сообщения {db_message_id} -> {connection.label}")
+    try:
+        record_delivery_attempt(db_message_id)
+        await send_with_ack(connection, connection.pending[db_message_id], attempt + 1)
+    except Exception as e:
+        logger.error(f"Ошибка при повторной отправке сообщения {db_message_id}: {e}")
+        connection.release(db_message_id)
 
+ack_scheduler = AckScheduler(on_ack_timeout)
 
-def edit_telegram_message(chat_id: int, message_id: int, new_text: str):
+
+def edit_telegram_message(chat_id: int, message_id: int, new_text: str) -> asyncio.Future:
     """
     Изменяет текст существующего сообщения в Telegram по его chat_id и message_id.
+    Запрос уходит в фоне через общий клиент, не блокируя цикл приёма сообщений.
 
     :param chat_id: ID чата, в котором находится сообщение
     :param message_id: ID сообщения, которое нужно изменить
     :param new_text: Новый текст сообщения
+    :return: future с результатом (True, если Telegram принял правку)
     """
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/editMessageText"
-    data = {
-        "chat_id": chat_id,
-        "message_id": message_id,
-        "text": new_text
-    }
-
-    try:
-        response = requests.post(url, data=data, timeout=5)
-        response.raise_for_status()
-        result = response.json()
-
-        if result.get("ok"):
-            return True
-        else:
-            logger.error(f"❌ Ошибка при обновлении сообщения {message_id}: {result}")
-            return False
-
-    except requests.RequestException as e:
-        logger.error(f"Ошибка при запросе к Telegram API: {e}")
-        return False
+    return telegram.edit_message_text(chat_id, message_id, new_text)
 
 def start_api():
     """Запуск FastAPI-сервера"""
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run(app, host="0.0.0.0", port=8000, ws_per_message_deflate=True)
 
 if __name__ == "__main__":
     start_api()
@@ -1,4 +1,9 @@
+import contextvars
+import logging
 import os
+import tempfile
+import time
+from dataclasses import dataclass, field
 
 import aiohttp
 import asyncio
@@ -7,19 +12,110 @@ from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from dotenv import load_dotenv
-from transcriber import transcribe_audio
-from openai_client import generate_claude_response, generate_gpt_response
+from transcriber import (TranscriptSegment, TranscriptionQueueFull, TranscriptionUnavailable, transcribe_audio,
+                         service as transcription_service)
+from fsm_storage import storage as fsm_storage
+from pipeline import PipelineScheduler
+from transcription_cache import cache as transcription_cache, file_key
+from llm_gateway import gateway as llm_gateway
+from metrics import current_trace, new_trace_id, registry, start_metrics_server
+from llm_router import ANTHROPIC_ROUTE, MODEL_ROUTES, AllProvidersFailed, router as llm_router
+from openai_client import PlanChunk, warm_up as warm_up_llm_clients
 
 load_dotenv()
 
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 FASTAPI_URL = os.getenv("FASTAPI_URL")
+VOICE_MEMORY_LIMIT = int(os.getenv("VOICE_MEMORY_LIMIT", str(20 * 1024 * 1024)))  # Крупнее — через временный файл
+STATUS_EDIT_INTERVAL = float(os.getenv("STATUS_EDIT_INTERVAL", "1.5"))  # Не чаще, чтобы не упереться в лимиты Telegram
+PLAN_TITLE = "📝 Твой план на день (после модерации):\n\n"
+SPECULATIVE_TAIL = float(os.getenv("SPECULATIVE_TAIL", "1.0"))  # Сегмент кончается не дальше стольких секунд от конца
+SPECULATIVE_MIN_LOGPROB = float(os.getenv("SPECULATIVE_MIN_LOGPROB", "-0.5"))
+
+logger = logging.getLogger(__name__)
 
 bot = Bot(token=TELEGRAM_BOT_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
+dp = Dispatcher(storage=fsm_storage)  # Закрывается самим Dispatcher при остановке
+
+_api_session: aiohttp.ClientSession | None = None  # Общая keep-alive сессия до FastAPI на всё время жизни бота
+_warm_up_task: asyncio.Task | None = None
+_metrics_runner = None  # aiohttp-сервер /metrics
+
+DOWNLOAD_SECONDS = registry.histogram("voice_download_seconds", "Скачивание голосового из Telegram")
+PLAN_SECONDS = registry.histogram("plan_seconds", "От начала составления плана до готового плана с кнопками")
+SUBMIT_SECONDS = registry.histogram("obsidian_submit_seconds", "Отправка плана в API (POST /messages/json)")
+
+
+def get_api_session() -> aiohttp.ClientSession:
+    global _api_session
+    if _api_session is None or _api_session.closed:
+        connector = aiohttp.TCPConnector(limit=20, keepalive_timeout=60, ttl_dns_cache=300)
+        _api_session = aiohttp.ClientSession(connector=connector)
+    return _api_session
+
+
+async def warm_up():
+    """Загружает модель Whisper, SDK LLM, кэш транскрипций и хранилище FSM, пока бот уже отвечает на сообщения."""
+    started = time.perf_counter()
+    steps = {
+        "whisper": transcription_service.warm_up(),
+        "llm": warm_up_llm_clients(),
+        "cache": transcription_cache.open(),
+        "fsm": fsm_storage.open(),
+    }
+    results = await asyncio.gather(*steps.values(), return_exceptions=True)
+    for name, result in zip(steps, results):
+        if isinstance(result, Exception):
+            logger.error(f"❌ Прогрев {name} не удался: {result}")
+    logger.info(f"🔥 Прогрев завершён за {time.perf_counter() - started:.2f}s")
+
+
+@dp.startup()
+async def start_warm_up():
+    """Прогрев идёт в фоне, чтобы поллинг начался сразу."""
+    global _warm_up_task
+    _warm_up_task = asyncio.create_task(warm_up())
+
+
+@dp.startup()
+async def start_metrics():
+    global _metrics_runner
+    if registry.enabled:
+        try:
+            _metrics_runner = await start_metrics_server()
+        except OSError as e:
+            logger.error(f"❌ Не удалось запустить сервер метрик: {e}")
+
+
+@dp.shutdown()
+async def stop_metrics():
+    if _metrics_runner is not None:
+        await _metrics_runner.cleanup()
+
+
+@dp.shutdown()
+async def cancel_warm_up():
+    if _warm_up_task is not None:
+        _warm_up_task.cancel()
+
+
+@dp.shutdown()
+async def close_api_session():
+    if _api_session is not None:
+        await _api_session.close()
+
+
+@dp.shutdown()
+async def close_llm_gateway():
+    await llm_gateway.close()
+
+
+@dp.shutdown()
+async def stop_transcription_service():
+    await transcription_service.stop()
+    await transcription_cache.close()
 
 
 class PlanStates(StatesGroup):
@@ -36,22 +132,110 @@ def get_plan_actions_inline_keyboard() -> InlineKeyboardBuilder:
     return kb
 
 
-async def get_moderated_text(text: str, state: FSMContext) -> str | tuple[str, str]:
+async def get_moderated_text(text: str, state: FSMContext) -> tuple[str, str]:
     """
-    Определяет, какую модель использовать (GPT или Cloud), и возвращает обработанный текст.
+    Определяет, какую модель предпочитает пользователь (GPT или Cloud), и возвращает обработанный текст.
+    Если модель медленная или недоступна, маршрутизатор дублирует запрос в другую.
     """
     state_data = await state.get_data()
     model_choice = state_data.get("model", "cloud")
-    if model_choice == "gpt":
-        return await generate_gpt_response(text)
-    return await generate_claude_response(text)
+    return await llm_router.moderate(text, MODEL_ROUTES.get(model_choice, ANTHROPIC_ROUTE))
+
+
+class LiveMessage:
+    """Сообщение, которое редактируется по мере поступления текста, но не чаще STATUS_EDIT_INTERVAL."""
+
+    def __init__(self, message: Message, interval: float = STATUS_EDIT_INTERVAL):
+        self.message = message
+        self.interval = interval
+        self._text: str | None = None
+        self._shown: str | None = None
+        self._task: asyncio.Task | None = None
+
+    def update(self, text: str):
+        self._text = text
+        if self._task is None:
+            self._task = asyncio.create_task(self._edit_loop())
+
+    async def _edit_loop(self):
+        while self._text != self._shown:
+            text = self._text
+            try:
+                await self.message.edit_text(text)
+            except Exception as e:
+                logger.warning(f"Не удалось обновить сообщение: {e}")
+            self._shown = text
+            await asyncio.sleep(self.interval)
+        self._task = None
+
+    def cancel(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def finish(self, text: str, reply_markup=None):
+        """Последняя правка — сразу, без ожидания интервала."""
+        self.cancel()
+        await self.message.edit_text(text, reply_markup=reply_markup)
+
+
+async def reply_with_plan(message: Message, text: str, state: FSMContext,
+                          moderated: tuple[str, str] | None = None):
+    """
+    Отвечает планом и переводит в plan_ready. Если результат модерации уже готов, отправляет его сразу,
+    иначе показывает план по мере генерации. Клавиатура прикрепляется, когда план готов целиком.
+    """
+    kb = get_plan_actions_inline_keyboard().as_markup()
+    if moderated is not None:
+        plan_date, moderated_text = moderated
+        await state.update_data(original_text=text, moderated_text=moderated_text, plan_date=plan_date,
+                                trace_id=current_trace.get())
+        await message.answer(text=f"{PLAN_TITLE}{moderated_text}", reply_markup=kb)
+        await state.set_state(PlanStates.plan_ready)
+        return
+
+    model_choice = (await state.get_data()).get("model", "cloud")
+    reply = await message.answer("📝 Составляю план...")
+    live = LiveMessage(reply)
+    started = time.perf_counter()
+    first_visible_s = None
+
+    def show(chunk: PlanChunk):
+        nonlocal first_visible_s
+        if first_visible_s is None:
+            first_visible_s = time.perf_counter() - started
+        live.update(f"{PLAN_TITLE}{chunk.body}")
+
+    try:
+        # Если выбранная модель молчит дольше p90, маршрутизатор параллельно запускает поток у следующей
+        plan_date, moderated_text = await llm_router.moderate_stream(
+            text, MODEL_ROUTES.get(model_choice, ANTHROPIC_ROUTE), show)
+    except asyncio.CancelledError:
+        live.cancel()  # Пришло новое сообщение: план будет составлен заново по всем сразу
+        await reply.edit_text("🔁 Получено новое сообщение — составлю общий план.")
+        raise
+    except AllProvidersFailed as e:
+        logger.error(f"❌ Не удалось получить план ни от одной модели: {e}")
+        await live.finish("❌ Не удалось составить план: модели сейчас недоступны. Попробуй ещё раз чуть позже.")
+        return
+
+    PLAN_SECONDS.observe(time.perf_counter() - started)
+    logger.info(f"[{current_trace.get()}] 📝 План: первый текст через {first_visible_s or 0:.2f}s, "
+                f"целиком через {time.perf_counter() - started:.2f}s")
+    await state.update_data(original_text=text, moderated_text=moderated_text, plan_date=plan_date,
+                            trace_id=current_trace.get())
+    await state.set_state(PlanStates.plan_ready)
+    await live.finish(f"{PLAN_TITLE}{moderated_text}", reply_markup=kb)
 
 
 @dp.message(Command("start"))
 async def cmd_start(message: Message, state: FSMContext):
     """
     При старте выдаём приветственное сообщение и переводим в состояние ожидания плана.
+    Незавершённая обработка прошлых сообщений (в том числе транскрибации в очереди) отменяется.
     """
+    for item in plan_pipeline.cancel(message.from_user.id):
+        item.close()
     await message.answer(
         "Привет! Я бот, который может принять от тебя голосовой план на день, "
         "расшифровать его и отправить в Obsidian.\n\n"
@@ -79,12 +263,215 @@ async def set_cloud(message: Message, state: FSMContext):
     await message.answer("✅ Модель обработки установлена: Cloud")
 
 
+class TranscriptionProgress:
+    """
+    Показывает частичную транскрипцию в статусном сообщении (не чаще STATUS_EDIT_INTERVAL)
+    и заранее запускает модерацию, когда уверенный сегмент доходит почти до конца записи.
+    Создаётся после current_trace.set: on_segment вызывается из цикла событий без контекста обработчика,
+    поэтому ранняя модерация запускается в сохранённом контексте — с trace id сообщения.
+    """
+
+    def __init__(self, status_message: Message, state: FSMContext):
+        self.status_message = status_message
+        self.state = state
+        self._context = contextvars.copy_context()
+        self.started = time.perf_counter()
+        self.first_segment_s: float | None = None
+        self._segments: list[str] = []
+        self._live = LiveMessage(status_message)
+        self._speculative: tuple[str, asyncio.Task] | None = None
+
+    @property
+    def text(self) -> str:
+        return " ".join(self._segments).strip()  # Так же, как склеивает _transcribe_audio_sync
+
+    def on_segment(self, segment: TranscriptSegment):
+        self._segments.append(segment.text)
+        if self.first_segment_s is None:
+            self.first_segment_s = time.perf_counter() - self.started
+        self._live.update(f"🎤 Идёт транскрибация...\n\n{self.text[-3500:]}")
+
+        if (self._speculative is None and segment.end >= segment.duration - SPECULATIVE_TAIL
+                and segment.avg_logprob >= SPECULATIVE_MIN_LOGPROB):
+            text = self.text
+            self._speculative = (text, asyncio.create_task(get_moderated_text(text, self.state),
+                                                           context=self._context.copy()))
+
+    async def take_speculative(self, transcription: str) -> tuple[str, str] | None:
+        """Результат заранее запущенной модерации, если итоговый текст с ним совпал."""
+        if self._speculative is None:
+            return None
+        text, task = self._speculative
+        self._speculative = None
+        if text != transcription:
+            task.cancel()
+            return None
+        try:
+            result = await task
+        except Exception as e:
+            logger.warning(f"Ранняя модерация не удалась: {e}")
+            return None
+        logger.info("⚡️ Модерация запущена до окончания транскрибации")
+        return result
+
+    def stop_updates(self):
+        """Транскрипция готова: частичный текст больше не показываем."""
+        self._live.cancel()
+
+    def close(self):
+        """Останавливает обновления статуса и отменяет неиспользованную модерацию."""
+        self.stop_updates()
+        if self._speculative is not None:
+            self._speculative[1].cancel()
+            self._speculative = None
+
+
+async def download_and_transcribe(message: Message, progress: TranscriptionProgress | None = None) -> str:
+    """
+    Скачивает голосовое в память (крупные — во временный каталог, который удаляется в любом случае)
+    и транскрибирует его, передавая сегменты в progress. Логирует время каждого этапа.
+    """
+    on_segment = progress.on_segment if progress is not None else None
+    voice = message.voice
+    started = time.perf_counter()
+    file_info = await bot.get_file(voice.file_id)
+    cache_keys = (file_key(voice.file_unique_id),)
+    if (voice.file_size or 0) <= VOICE_MEMORY_LIMIT:
+        audio = (await bot.download_file(file_info.file_path)).getvalue()
+        download_s = time.perf_counter() - started
+        DOWNLOAD_SECONDS.observe(download_s)
+        result = await transcribe_audio(audio, user_id=str(message.from_user.id), cache_keys=cache_keys,
+                                      on_segment=on_segment)
+    else:
+        with tempfile.TemporaryDirectory(prefix="voice_") as directory:
+            temp_file = os.path.join(directory, f"{voice.file_unique_id}.ogg")
+            await bot.download_file(file_info.file_path, destination=temp_file)
+            download_s = time.perf_counter() - started
+            DOWNLOAD_SECONDS.observe(download_s)
+            result = await transcribe_audio(temp_file, user_id=str(message.from_user.id), cache_keys=cache_keys,
+                                      on_segment=on_segment)
+
+    if result.cached:
+        logger.info(f"[{current_trace.get()}] ♻️ Голосовое {voice.file_unique_id}: скачивание {download_s:.2f}s, транскрипция из кэша по хэшу")
+    else:
+        logger.info(
+            f"[{current_trace.get()}] 🎤 Голосовое {voice.file_unique_id} ({voice.file_size or 0} байт): скачивание {download_s:.2f}s, "
+            f"очередь {result.wait_s:.2f}s, декодирование {result.decode_s:.2f}s, транскрибация {result.transcribe_s:.2f}s"
+            + (f", первый сегмент через {progress.first_segment_s:.2f}s"
+               if progress is not None and progress.first_segment_s is not None else "")
+        )
+    return result.text
+
+
+@dataclass
+class PlanInput:
+    """Сообщение пользователя в очереди на составление плана."""
+    message: Message
+    state: FSMContext
+    status_message: Message | None = None  # Для голосовых
+    progress: TranscriptionProgress | None = None
+    transcription: asyncio.Task | None = None  # Начинается сразу и переживает отмену запуска
+    trace_id: str = field(default_factory=new_trace_id)
+
+    def close(self):
+        if self.progress is not None:
+            self.progress.close()
+        if self.transcription is not None:
+            self.transcription.cancel()
+
+
+async def transcribe_voice(item: PlanInput) -> str | None:
+    """Транскрипция голосового (из кэша по file_unique_id или через пул); None — очередь полна или пул недоступен."""
+    voice = item.message.voice
+    transcription = await transcription_cache.get(file_key(voice.file_unique_id))
+    if transcription is not None:
+        logger.info(f"[{item.trace_id}] ♻️ Голосовое {voice.file_unique_id}: транскрипция из кэша")
+    else:
+        try:
+            transcription = await download_and_transcribe(item.message, item.progress)
+        except TranscriptionQueueFull:
+            await item.status_message.edit_text(
+                "⏳ Сейчас слишком много голосовых в обработке. Попробуй отправить чуть позже.")
+            return None
+        except TranscriptionUnavailable as e:
+            logger.error(f"[{item.trace_id}] ❌ Транскрибация недоступна: {e}")
+            await item.status_message.edit_text(
+                "❌ Распознавание голосовых сейчас недоступно. Отправь план текстом или попробуй позже.")
+            return None
+        finally:
+            item.progress.stop_updates()
+    await item.status_message.edit_text("✅ Транскрибация завершена.")
+    return transcription
+
+
+async def run_plan_pipeline(user_id: int, items: list[PlanInput]):
+    """
+    Один план по всем сообщениям, пришедшим подряд. Транскрипции не перезапускаются:
+    если запуск отменило новое сообщение, следующий дождётся уже начатых.
+    Trace id плана — id первого сообщения; он сохраняется в FSM и уходит в API вместе с планом.
+    """
+    current_trace.set(items[0].trace_id)
+    if len(items) > 1:
+        logger.info(f"[{items[0].trace_id}] 🔗 Объединено сообщений: {len(items)} "
+                    f"({', '.join(item.trace_id for item in items[1:])})")
+    try:
+        texts = []
+        for item in items:
+            if item.transcription is None:
+                texts.append(item.message.text.strip())
+                continue
+            text = await asyncio.shield(item.transcription)
+            if text:
+                texts.append(text)
+        text = "\n".join(texts)
+        if not text:
+            return
+
+        last = items[-1]
+        # Модерация могла начаться ещё во время транскрибации, если голосовое одно
+        moderated = await last.progress.take_speculative(text) if len(items) == 1 and last.progress else None
+        for item in items:
+            if item.progress is not None:
+                item.progress.close()
+        # Определяем и получаем обработанный текст, используя выбранную модель; план показывается по мере генерации
+        await reply_with_plan(last.message, text, last.state, moderated)
+    except asyncio.CancelledError:
+        for item in items:
+            if item.progress is not None and item.transcription.done():
+                item.progress.close()  # Ранняя модерация по неполному тексту больше не нужна
+        raise
+
+
+async def notify_queued(user_id: int, items: list[PlanInput], position: int):
+    await items[-1].message.answer(
+        f"⏳ Сейчас много запросов: ты {position}-й в очереди. План начну составлять, как только освободится место.")
+
+
+plan_pipeline = PipelineScheduler(run_plan_pipeline, notify_queued)
+
+
+@registry.collector
+def _collect_pipeline():
+    metrics = plan_pipeline.metrics()
+    for event in ("submitted", "runs", "merged", "superseded", "queued", "completed", "failed"):
+        yield "plan_pipeline_events_total", "counter", "Планировщик составления планов", {"event": event}, \
+            metrics[event]
+    yield "plan_pipeline_running", "gauge", "Составляемые сейчас планы", {}, metrics["running"]
+    yield "plan_pipeline_waiting", "gauge", "Пользователи в очереди на составление плана", {}, metrics["waiting"]
+
+
+@dp.shutdown()
+async def stop_plan_pipeline():
+    await plan_pipeline.close()
+
+
 @dp.message(F.content_type == "voice")
 async def handle_voice_plan(message: Message, state: FSMContext):
     """
     Обрабатываем голосовое сообщение.
     Если состояние не установлено, считаем, что это новый план.
     Если состояние = editing_plan, то это изменение.
+    Транскрибация начинается сразу, а план составляется вместе с сообщениями, присланными следом.
     """
     current_state = await state.get_state()
     if current_state is None:
@@ -93,35 +480,11 @@ async def handle_voice_plan(message: Message, state: FSMContext):
 
     # Сообщаем о начале обработки
     status_message = await message.answer("🎤 Получено голосовое сообщение. Идёт транскрибация...")
-
-    # Скачиваем голосовой файл
-    voice = message.voice
-    file_info = await bot.get_file(voice.file_id)
-    temp_file = f"temp_{voice.file_unique_id}.ogg"
-    await bot.download_file(file_info.file_path, destination=temp_file)
-
-    # Получаем исходный (транскрибированный) текст
-    transcription = (await transcribe_audio(temp_file)).strip()
-    os.remove(temp_file)
-
-    # Определяем и получаем обработанный текст, используя выбранную модель
-    plan_date, moderated_text = await get_moderated_text(transcription, state)
-
-    # Сохраняем оба варианта в состоянии
-    await state.update_data(original_text=transcription, moderated_text=moderated_text, plan_date=plan_date)
-
-    kb = get_plan_actions_inline_keyboard().as_markup()
-
-    await bot.edit_message_text(
-        chat_id=message.chat.id,
-        message_id=status_message.message_id,
-        text="✅ Транскрибация и модерация завершены."
-    )
-    await message.answer(
-        text=f"📝 Твой план на день (после модерации):\n\n{moderated_text}",
-        reply_markup=kb
-    )
-    await state.set_state(PlanStates.plan_ready)
+    item = PlanInput(message, state, status_message)
+    current_trace.set(item.trace_id)  # Задача транскрибации и ранняя модерация наследуют контекст
+    item.progress = TranscriptionProgress(status_message, state)
+    item.transcription = asyncio.create_task(transcribe_voice(item))
+    plan_pipeline.submit(message.from_user.id, item)
 
 
 @dp.message(F.content_type == "text")
@@ -142,18 +505,7 @@ async def handle_text_plan(message: Message, state: FSMContext):
         await message.answer("Пожалуйста, отправьте непустой текст.")
         return
 
-    # Определяем и получаем обработанный текст, используя выбранную модель
-    plan_date, moderated_text = await get_moderated_text(original_text, state)
-
-    # Сохраняем оба варианта в состоянии
-    await state.update_data(original_text=original_text, moderated_text=moderated_text, plan_date=plan_date)
-
-    kb = get_plan_actions_inline_keyboard().as_markup()
-    await message.answer(
-        text=f"📝 Твой план на день (после модерации):\n\n{moderated_text}",
-        reply_markup=kb
-    )
-    await state.set_state(PlanStates.plan_ready)
+    plan_pipeline.submit(message.from_user.id, PlanInput(message, state))
 
 
 @dp.callback_query(F.data == "send_obsidian", PlanStates.plan_ready)
@@ -168,6 +520,7 @@ async def send_to_obsidian_callback(query: CallbackQuery, state: FSMContext):
     original_text = data.get("original_text", "")
     moderated_text = data.get("moderated_text", "")
     plan_date = data.get("plan_date", "")
+    trace_id = data.get("trace_id")
     if not original_text or not moderated_text:
         await query.message.answer("Нет текста для отправки в Obsidian.")
         return
@@ -175,17 +528,20 @@ async def send_to_obsidian_callback(query: CallbackQuery, state: FSMContext):
     telegram_user_id = str(query.from_user.id)
     progress_message = await query.message.answer("Отправляю план в Obsidian...")
 
-    async with aiohttp.ClientSession() as session:
-        params = {
-            "telegram_user_id": telegram_user_id,
-            "text": original_text,
-            "model_text": moderated_text,
-            "plan_date": plan_date,
-            "progress_message_id": progress_message.message_id,
-            "chat_id": query.message.chat.id,
-        }
-        async with session.post(f"{FASTAPI_URL}/messages", params=params) as response:
-            resp_data = await response.json()
+    payload = {
+        "telegram_user_id": telegram_user_id,
+        "text": original_text,
+        "model_text": moderated_text,
+        "plan_date": plan_date,
+        "progress_message_id": progress_message.message_id,
+        "chat_id": query.message.chat.id,
+        "trace_id": trace_id,
+    }
+    started = time.perf_counter()
+    async with get_api_session().post(f"{FASTAPI_URL}/messages/json", json=payload) as response:
+        resp_data = await response.json()
+    SUBMIT_SECONDS.observe(time.perf_counter() - started)
+    logger.info(f"[{trace_id}] 📨 План передан в API за {time.perf_counter() - started:.2f}s")
 
     await query.message.edit_text("✅ План успешно отправлен в Obsidian!")
     await state.clear()
@@ -1,14 +1,237 @@
+import asyncio
 import aiosqlite
+import json
+import logging
 import os
+import sqlite3
+import time
+import zlib
+from contextlib import asynccontextmanager
+from typing import NamedTuple
 from dotenv import load_dotenv
 
+from metrics import registry
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 DATABASE_PATH = "../data/messages.db"
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+DB_BATCH_WINDOW = float(os.getenv("DB_BATCH_WINDOW_MS", "5")) / 1000
+DB_BATCH_MAX_ROWS = int(os.getenv("DB_BATCH_MAX_ROWS", "256"))
+
+_pool: asyncio.Queue | None = None  # Пул долгоживущих соединений, открывается в lifespan API
+_pool_connections: list[aiosqlite.Connection] = []  # Все соединения пула, включая выданные
+_batcher: "WriteBatcher | None" = None  # Групповая запись, запускается в lifespan API
+
+# Счётчики групповой записи (отдаются через /stats/db)
+write_stats = {
+    "batches": 0,
+    "rows": 0,
+    "last_batch_size": 0,
+    "max_batch_size": 0,
+    "last_commit_ms": 0.0,
+    "total_commit_ms": 0.0,
+}
+
+
+@registry.collector
+def _collect_write_stats():
+    yield "db_write_batches_total", "counter", "Транзакции групповой записи", {}, write_stats["batches"]
+    yield "db_write_rows_total", "counter", "Записи, зафиксированные групповой записью", {}, write_stats["rows"]
+    yield "db_write_commit_seconds_total", "counter", "Время групповых коммитов", {}, \
+        write_stats["total_commit_ms"] / 1000
+    yield "db_write_max_batch_size", "gauge", "Самая большая пачка записей", {}, write_stats["max_batch_size"]
+
+
+async def connect_db(path: str | None = None) -> aiosqlite.Connection:
+    """Открывает соединение с WAL и synchronous=NORMAL."""
+    db = await aiosqlite.connect(path or DATABASE_PATH)
+    await db.execute("PRAGMA journal_mode=WAL")
+    await db.execute("PRAGMA synchronous=NORMAL")
+    await db.execute("PRAGMA busy_timeout=5000")
+    return db
+
+
+async def open_pool(size: int = DB_POOL_SIZE):
+    """Открывает пул соединений. Подготовленные запросы кешируются внутри каждого соединения."""
+    global _pool
+    if _pool is not None:
+        return
+    pool = asyncio.Queue()
+    for _ in range(size):
+        db = await connect_db()
+        _pool_connections.append(db)
+        pool.put_nowait(db)
+    _pool = pool
+
+
+async def close_pool():
+    """Закрывает все соединения пула, в том числе не возвращённые отменёнными задачами."""
+    global _pool
+    if _pool is None:
+        return
+    _pool = None
+    while _pool_connections:
+        await _pool_connections.pop().close()
+
+
+@asynccontextmanager
+async def acquire():
+    """Берёт соединение из пула (или открывает временное, если пул не запущен)."""
+    if _pool is None:
+        db = await connect_db()
+        try:
+            yield db
+        finally:
+            await db.close()
+        return
+
+    pool = _pool
+    db = await pool.get()
+    try:
+        yield db
+    finally:
+        pool.put_nowait(db)
+
+
+class WriteResult(NamedTuple):
+    lastrowid: int
+    rowcount: int
+    rows: list  # Строки из RETURNING, если запрос их возвращает
+
+
+async def _execute_write(db: aiosqlite.Connection, sql: str, params: tuple) -> WriteResult:
+    cursor = await db.execute(sql, params)
+    rows = await cursor.fetchall() if cursor.description else []
+    return WriteResult(cursor.lastrowid, cursor.rowcount, rows)
+
+
+class WriteBatcher:
+    """
+    Собирает записи за короткое окно (или до max_rows штук) и фиксирует их одной транзакцией.
+    Каждый вызывающий получает свой WriteResult.
+    """
+
+    def __init__(self, window: float = DB_BATCH_WINDOW, max_rows: int = DB_BATCH_MAX_ROWS, path: str | None = None):
+        self.path = path
+        self.window = window
+        self.max_rows = max_rows
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._db: aiosqlite.Connection | None = None
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        self._db = await connect_db(self.path)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Дописывает всё, что уже в очереди, и закрывает соединение."""
+        if self._task is None:
+            return
+        self._queue.put_nowait(None)
+        await self._task
+        self._task = None
+        await self._db.close()
+
+    def enqueue(self, sql: str, params: tuple) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((sql, params, future))
+        return future
+
+    async def submit(self, sql: str, params: tuple) -> WriteResult:
+        return await self.enqueue(sql, params)
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            if self._queue.qsize() < self.max_rows:
+                await asyncio.sleep(self.window)  # Даём накопиться пачке
+
+            batch = [item]
+            while len(batch) < self.max_rows and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._commit(batch)
+
+    async def _commit(self, batch: list):
+        started = time.perf_counter()
+        results = []
+        for sql, params, future in batch:
+            try:
+                results.append((future, await _execute_write(self._db, sql, params)))
+            except Exception as e:
+                results.append((future, e))
+
+        try:
+            await self._db.commit()
+        except Exception as e:
+            await self._db.rollback()
+            results = [(future, e) for future, _ in results]
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        write_stats["batches"] += 1
+        write_stats["rows"] += len(batch)
+        write_stats["last_batch_size"] = len(batch)
+        write_stats["max_batch_size"] = max(write_stats["max_batch_size"], len(batch))
+        write_stats["last_commit_ms"] = round(elapsed_ms, 3)
+        write_stats["total_commit_ms"] += elapsed_ms
+
+        for future, result in results:
+            if future.done():  # Вызывающий уже отменён
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+async def start_batcher():
+    global _batcher
+    if _batcher is not None:
+        return
+    batcher = WriteBatcher()
+    await batcher.start()
+    _batcher = batcher
+
+
+async def stop_batcher():
+    global _batcher
+    if _batcher is None:
+        return
+    batcher, _batcher = _batcher, None
+    await batcher.stop()
+
+
+async def _write(sql: str, params: tuple) -> WriteResult:
+    """Запись через групповой коммит, либо отдельной транзакцией, если он не запущен."""
+    if _batcher is not None:
+        return await _batcher.submit(sql, params)
+    async with acquire() as db:
+        result = await _execute_write(db, sql, params)
+        await db.commit()
+        return result
+
+
+async def _ensure_column(db: aiosqlite.Connection, table: str, column: str, ddl: str):
+    async with db.execute(f"PRAGMA table_info({table})") as cursor:
+        columns = {row[1] for row in await cursor.fetchall()}
+    if column not in columns:
+        await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+
 
 async def init_db():
     os.makedirs(os.path.dirname(DATABASE_PATH), exist_ok=True)  # Создаем папку, если нет
     async with aiosqlite.connect(DATABASE_PATH) as db:
+        await _enable_incremental_vacuum(db)
+        await db.execute("PRAGMA journal_mode=WAL")  # Режим сохраняется в файле БД
         await db.execute("""
             CREATE TABLE IF NOT EXISTS users (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -28,46 +251,366 @@ async def init_db():
                 plan_date TEXT NOT NULL,
                 processed INTEGER DEFAULT 0,
                 created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                delivery_attempts INTEGER NOT NULL DEFAULT 0,
+                last_attempt_at DATETIME,
                 FOREIGN KEY (user_id) REFERENCES users(id)
             );
         """)
+        # Колонки, добавленные после первого релиза, для уже существующих БД
+        await _ensure_column(db, "messages", "delivery_attempts", "INTEGER NOT NULL DEFAULT 0")
+        await _ensure_column(db, "messages", "last_attempt_at", "DATETIME")
+        await _ensure_column(db, "messages", "trace_id", "TEXT")  # Сквозной id плана: бот -> API -> Obsidian
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS device_cursors (
+                telegram_user_id TEXT NOT NULL,
+                device_id TEXT NOT NULL,
+                last_id INTEGER NOT NULL DEFAULT 0,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (telegram_user_id, device_id)
+            );
+        """)
+        # Досылка устройству по его курсору
+        await db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_messages_user
+            ON messages (user_id, id);
+        """)
+        # Частичный индекс только по непрочитанным: покрывает поиск и сортировку в fetch_unread_messages
+        await db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_messages_unread
+            ON messages (user_id, id)
+            WHERE processed = 0;
+        """)
+        # Обработанные сообщения старше ARCHIVE_AFTER_DAYS (см. maintenance.py); payload — zlib от JSON {text, model_text}
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS messages_archive (
+                id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                chat_id INTEGER NOT NULL,
+                progress_message_id INTEGER NOT NULL,
+                plan_date TEXT NOT NULL,
+                created_at DATETIME,
+                delivery_attempts INTEGER NOT NULL DEFAULT 0,
+                trace_id TEXT,
+                payload BLOB NOT NULL,
+                archived_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        await db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_messages_archive_user
+            ON messages_archive (user_id, id);
+        """)
         await db.commit()
 
-async def insert_message(user_id: str, text: str, model_text: str, chat_id: int, progress_message_id: int, plan_date: str):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        cursor = await db.execute(
-            "INSERT INTO messages (user_id, text, model_text, chat_id, progress_message_id, plan_date) VALUES (?, ?, ?, ?, ?, ?)",
-            (user_id, text, model_text, chat_id, progress_message_id, plan_date)
-        )
-        await db.commit()
-        last_row_id = cursor.lastrowid
-        return last_row_id
+
+async def _enable_incremental_vacuum(db: aiosqlite.Connection):
+    """
+    auto_vacuum=INCREMENTAL, чтобы освобождённые архивацией страницы возвращались небольшими шагами.
+    Новой БД режим задаётся до создания таблиц; существующей — только после однократного VACUUM.
+    """
+    async with db.execute("PRAGMA auto_vacuum") as cursor:
+        if (await cursor.fetchone())[0] == 2:
+            return
+    await db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    async with db.execute("SELECT COUNT(*) FROM sqlite_master") as cursor:
+        if (await cursor.fetchone())[0]:
+            logger.warning("⚠️ auto_vacuum для messages.db включится после однократного VACUUM "
+                           "(при остановленном API); до этого сжатие файла не работает")
+
+async def insert_message(user_id: str, text: str, model_text: str, chat_id: int, progress_message_id: int, plan_date: str,
+                         trace_id: str | None = None):
+    result = await _write(
+        "INSERT INTO messages (user_id, text, model_text, chat_id, progress_message_id, plan_date, trace_id) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (user_id, text, model_text, chat_id, progress_message_id, plan_date, trace_id)
+    )
+    return result.lastrowid
 
 
 async def fetch_unread_messages(telegram_user_id: str):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with acquire() as db:
         # Находим user_id по telegram_user_id
         # Выбираем все сообщения, где processed = 0
         async with db.execute("""
-            SELECT id, text, created_at, chat_id, progress_message_id, model_text
-            FROM messages 
+            SELECT id, text, created_at, chat_id, progress_message_id, model_text, plan_date, trace_id
+            FROM messages
             WHERE user_id = ? AND processed = 0
             ORDER BY id ASC
         """, (telegram_user_id,)) as cursor:  # Обратите внимание на кортеж (user_id,)
             messages = await cursor.fetchall()
 
         return [
-            {"id": m[0], "text": m[1], "created_at": m[2], "chat_id": m[3], "progress_message_id": m[4], "model_text": m[5]}
+            {"id": m[0], "text": m[1], "created_at": m[2], "chat_id": m[3], "progress_message_id": m[4], "model_text": m[5],
+             "plan_date": m[6], "trace_id": m[7]}
             for m in messages
         ]
 
 
-async def mark_message_as_processed(message_id: int) -> bool:
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        async with db.execute("SELECT id FROM messages WHERE id = ? AND processed = 0", (message_id,)) as cursor:
+async def fetch_messages_since(telegram_user_id: str, since: int = 0, limit: int = 100, unread_only: bool = False):
+    """
+    Страница сообщений пользователя с id больше since по возрастанию id (keyset по idx_messages_user
+    или частичному индексу непрочитанных). Возвращает (сообщения, есть ли ещё).
+    """
+    async with acquire() as db:
+        async with db.execute(f"""
+            SELECT id, text, created_at, chat_id, progress_message_id, model_text, plan_date, trace_id, processed
+            FROM messages
+            WHERE user_id = ? AND id > ? {"AND processed = 0" if unread_only else ""}
+            ORDER BY id ASC
+            LIMIT ?
+        """, (telegram_user_id, since, limit + 1)) as cursor:
+            rows = await cursor.fetchall()
+
+    return [
+        {"id": m[0], "text": m[1], "created_at": m[2], "chat_id": m[3], "progress_message_id": m[4], "model_text": m[5],
+         "plan_date": m[6], "trace_id": m[7], "processed": bool(m[8])}
+        for m in rows[:limit]
+    ], len(rows) > limit
+
+
+async def iter_backlog(telegram_user_id: str, after_id: int | None = None, page_size: int = 100):
+    """
+    Сообщения для досылки устройству страницами по id, не держа соединение между страницами:
+    непрочитанные до курсора устройства after_id и все после него, а для нового устройства (after_id = None) —
+    все непрочитанные. ACK приходят не по порядку, поэтому курсор мог уйти дальше неподтверждённых сообщений.
+    """
+    # (после id, до id включительно, только непрочитанные): до курсора — по частичному индексу непрочитанных
+    ranges = [(0, None, True)] if after_id is None else [(0, after_id, True), (after_id, None, False)]
+    for last_id, until_id, unread_only in ranges:
+        while True:
+            async with acquire() as db:
+                async with db.execute(f"""
+                    SELECT id, text, created_at, chat_id, progress_message_id, model_text, plan_date,
+                           delivery_attempts, trace_id
+                    FROM messages
+                    WHERE user_id = ? AND id > ? {"AND processed = 0" if unread_only else ""}
+                          {"AND id <= ?" if until_id is not None else ""}
+                    ORDER BY id ASC
+                    LIMIT ?
+                """, (telegram_user_id, last_id, *(() if until_id is None else (until_id,)), page_size)) as cursor:
+                    rows = await cursor.fetchall()
+
+            for m in rows:
+                yield {"id": m[0], "text": m[1], "created_at": m[2], "chat_id": m[3], "progress_message_id": m[4],
+                       "model_text": m[5], "plan_date": m[6], "delivery_attempts": m[7], "trace_id": m[8]}
+            if len(rows) < page_size:
+                break
+            last_id = rows[-1][0]
+
+
+async def get_device_cursor(telegram_user_id: str, device_id: str) -> int | None:
+    """id последнего сообщения, подтверждённого устройством (None — устройство ещё не подключалось)"""
+    async with acquire() as db:
+        async with db.execute(
+            "SELECT last_id FROM device_cursors WHERE telegram_user_id = ? AND device_id = ?",
+            (telegram_user_id, device_id)
+        ) as cursor:
             row = await cursor.fetchone()
-            if not row:
-                return False  # Сообщение не найдено или уже обработано
-        await db.execute("UPDATE messages SET processed = 1 WHERE id = ?", (message_id,))
-        await db.commit()
-        return True
+    return row[0] if row else None
+
+
+async def advance_device_cursor(telegram_user_id: str, device_id: str, message_id: int):
+    await _write("""
+        INSERT INTO device_cursors (telegram_user_id, device_id, last_id) VALUES (?, ?, ?)
+        ON CONFLICT (telegram_user_id, device_id)
+        DO UPDATE SET last_id = MAX(last_id, excluded.last_id), updated_at = CURRENT_TIMESTAMP
+    """, (telegram_user_id, device_id, message_id))
+
+
+async def max_user_message_id(telegram_user_id: str, message_ids: list[int]) -> int | None:
+    """Наибольший из message_ids, принадлежащий пользователю (None — ни одного): до него можно двигать курсор."""
+    if not message_ids:
+        return None
+    placeholders = ",".join("?" * len(message_ids))
+    async with acquire() as db:
+        async with db.execute(
+            f"SELECT MAX(id) FROM messages WHERE user_id = ? AND id IN ({placeholders})",
+            (telegram_user_id, *message_ids)
+        ) as cursor:
+            return (await cursor.fetchone())[0]
+
+
+async def max_message_id() -> int:
+    async with acquire() as db:
+        async with db.execute("SELECT COALESCE(MAX(id), 0) FROM messages") as cursor:
+            return (await cursor.fetchone())[0]
+
+
+async def fetch_messages_after(last_id: int, limit: int = 500):
+    """Непрочитанные сообщения всех пользователей с id больше last_id (для опроса другими воркерами)."""
+    async with acquire() as db:
+        async with db.execute("""
+            SELECT id, user_id, text, created_at, chat_id, progress_message_id, model_text, plan_date, trace_id
+            FROM messages
+            WHERE id > ? AND processed = 0
+            ORDER BY id ASC
+            LIMIT ?
+        """, (last_id, limit)) as cursor:
+            rows = await cursor.fetchall()
+
+    return [
+        {"id": m[0], "user_id": m[1], "text": m[2], "created_at": m[3], "chat_id": m[4], "progress_message_id": m[5],
+         "model_text": m[6], "plan_date": m[7], "trace_id": m[8]}
+        for m in rows
+    ]
+
+
+async def mark_message_as_processed(message_id: int) -> bool:
+    result = await _write("UPDATE messages SET processed = 1 WHERE id = ? AND processed = 0", (message_id,))
+    return result.rowcount > 0  # False, если сообщение не найдено или уже обработано
+
+
+async def mark_messages_as_processed(message_ids: list[int]) -> list[int]:
+    """Отмечает пачку сообщений одним UPDATE; возвращает id тех, что были непрочитанными."""
+    if not message_ids:
+        return []
+    placeholders = ",".join("?" * len(message_ids))
+    result = await _write(
+        f"UPDATE messages SET processed = 1 WHERE id IN ({placeholders}) AND processed = 0 RETURNING id",
+        tuple(message_ids)
+    )
+    return [row[0] for row in result.rows]
+
+
+async def mark_user_messages_as_processed(telegram_user_id: str, message_ids: list[int]) -> list[tuple]:
+    """
+    Отмечает пачку сообщений пользователя одним UPDATE (чужие id пропускаются).
+    Возвращает (id, chat_id, progress_message_id, trace_id) тех, что были непрочитанными.
+    """
+    if not message_ids:
+        return []
+    placeholders = ",".join("?" * len(message_ids))
+    result = await _write(
+        f"UPDATE messages SET processed = 1 WHERE user_id = ? AND id IN ({placeholders}) AND processed = 0 "
+        "RETURNING id, chat_id, progress_message_id, trace_id",
+        (telegram_user_id, *message_ids)
+    )
+    return sorted(result.rows)
+
+
+def _archive_payload(text: str, model_text: str) -> bytes:
+    return zlib.compress(json.dumps({"text": text, "model_text": model_text}, ensure_ascii=False).encode(), 6)
+
+
+async def archive_processed_messages(older_than: float, after_id: int = 0, limit: int = 200) -> tuple[int, int | None]:
+    """
+    Переносит в messages_archive обработанные сообщения старше older_than секунд среди следующих limit строк
+    после after_id. Перенос — одна короткая транзакция, чтобы групповая запись ждала не дольше одной пачки.
+    Возвращает (перенесено, id последней просмотренной строки); None — дальше только свежие сообщения.
+    """
+    async with acquire() as db:
+        async with db.execute("""
+            SELECT id, processed, created_at < datetime('now', ?)
+            FROM messages
+            WHERE id > ?
+            ORDER BY id ASC
+            LIMIT ?
+        """, (f"-{older_than} seconds", after_id, limit)) as cursor:
+            rows = await cursor.fetchall()
+
+        # id растут вместе с created_at: первая свежая строка — конец архивируемой части
+        ids, reached_fresh = [], not rows
+        for message_id, processed, old in rows:
+            if not old:
+                reached_fresh = True
+                break
+            if processed:
+                ids.append(message_id)
+        last_id = None if reached_fresh else rows[-1][0]
+        if not ids:
+            return 0, last_id
+
+        # Обработанные строки больше не меняются: читаем и сжимаем их до транзакции, чтобы не держать блокировку
+        placeholders = ",".join("?" * len(ids))
+        async with db.execute(f"""
+            SELECT id, user_id, chat_id, progress_message_id, plan_date, created_at, delivery_attempts, trace_id,
+                   text, model_text
+            FROM messages WHERE id IN ({placeholders})
+        """, ids) as cursor:
+            rows = [(*m[:8], _archive_payload(m[8], m[9])) for m in await cursor.fetchall()]
+        try:
+            await db.execute("BEGIN IMMEDIATE")
+            await db.executemany("""
+                INSERT OR IGNORE INTO messages_archive (id, user_id, chat_id, progress_message_id, plan_date,
+                                                        created_at, delivery_attempts, trace_id, payload)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+            cursor = await db.execute(f"DELETE FROM messages WHERE id IN ({placeholders}) AND processed = 1", ids)
+            moved = cursor.rowcount
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+    return moved, last_id
+
+
+async def freelist_pages() -> int:
+    async with acquire() as db:
+        async with db.execute("PRAGMA freelist_count") as cursor:
+            return (await cursor.fetchone())[0]
+
+
+async def incremental_vacuum(pages: int) -> int:
+    """Возвращает в ОС до pages (> 0) свободных страниц; результат — сколько свободных страниц осталось."""
+    async with acquire() as db:
+        # Прагма освобождает по странице на шаг; execute делает один шаг, executescript — до конца
+        await db.executescript(f"PRAGMA incremental_vacuum({max(int(pages), 1)});")
+        # Переносит WAL в файл здесь, а не в автоматическом checkpoint при коммите групповой записи
+        await db.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        async with db.execute("PRAGMA freelist_count") as cursor:
+            return (await cursor.fetchone())[0]
+
+
+async def optimize():
+    """Обновляет статистику планировщика запросов, если она устарела."""
+    async with acquire() as db:
+        await db.execute("PRAGMA optimize")
+
+
+async def table_sizes() -> dict:
+    """
+    Размеры таблиц и индексов по dbstat (если SQLite собран с ним) и счётчики строк.
+    dbstat читает все страницы файла — это запрос для администратора, не для горячего пути.
+    """
+    async with acquire() as db:
+        pragmas = {}
+        for name in ("page_size", "page_count", "freelist_count", "auto_vacuum"):
+            async with db.execute(f"PRAGMA {name}") as cursor:
+                pragmas[name] = (await cursor.fetchone())[0]
+        try:
+            async with db.execute("""
+                SELECT name, COUNT(*), SUM(pgsize) FROM dbstat GROUP BY name ORDER BY SUM(pgsize) DESC
+            """) as cursor:
+                objects = {name: {"pages": pages, "bytes": size} for name, pages, size in await cursor.fetchall()}
+        except sqlite3.OperationalError:
+            objects = None
+        async with db.execute("""
+            SELECT (SELECT COUNT(*) FROM messages WHERE processed = 0),
+                   (SELECT COUNT(*) FROM messages),
+                   (SELECT COUNT(*) FROM messages_archive)
+        """) as cursor:
+            unread, total, archived = await cursor.fetchone()
+
+    wal_path = DATABASE_PATH + "-wal"
+    return {
+        "file_bytes": os.path.getsize(DATABASE_PATH),
+        "wal_bytes": os.path.getsize(wal_path) if os.path.exists(wal_path) else 0,
+        **pragmas,
+        "rows": {"messages": total, "messages_unread": unread, "messages_archive": archived},
+        "objects": objects,
+    }
+
+
+def record_delivery_attempt(message_id: int) -> asyncio.Future:
+    """
+    Запоминает попытку доставки, чтобы счётчик и отсрочка пережили перезапуск API.
+    Запись сразу ставится в очередь; ждать её перед отправкой не нужно.
+    """
+    sql = "UPDATE messages SET delivery_attempts = delivery_attempts + 1, last_attempt_at = CURRENT_TIMESTAMP WHERE id = ?"
+    future = _batcher.enqueue(sql, (message_id,)) if _batcher is not None else asyncio.ensure_future(_write(sql, (message_id,)))
+    future.add_done_callback(_log_write_error)
+    return future
+
+
+def _log_write_error(future: asyncio.Future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(f"Ошибка при записи в БД: {future.exception()}")
@@ -0,0 +1,93 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+from typing import Awaitable, Callable, Hashable
+
+ACK_TIMEOUT = float(os.getenv("ACK_TIMEOUT", "5"))
+MAX_ACK_BACKOFF = float(os.getenv("MAX_ACK_BACKOFF", "300"))
+
+logger = logging.getLogger(__name__)
+
+
+class AckScheduler:
+    """
+    Один фоновый таймер на все сообщения, ожидающие ACK (вместо задачи на каждое сообщение).
+    Сроки хранятся в куче; отменённые записи удаляются лениво.
+    Таймаут растёт экспоненциально с номером попытки: ACK_TIMEOUT * 2^(attempt - 1).
+    """
+
+    def __init__(self, on_timeout: Callable[[Hashable, int], Awaitable[None]],
+                 base_timeout: float = ACK_TIMEOUT, max_backoff: float = MAX_ACK_BACKOFF):
+        self.on_timeout = on_timeout
+        self.base_timeout = base_timeout
+        self.max_backoff = max_backoff
+        self._heap: list[tuple[float, int, Hashable]] = []
+        self._entries: dict[Hashable, tuple[int, int]] = {}  # key -> (seq записи в куче, попытка)
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def backoff(self, attempt: int) -> float:
+        return min(self.base_timeout * 2 ** max(attempt - 1, 0), self.max_backoff)
+
+    def schedule(self, key: Hashable, attempt: int):
+        """Ждём ACK для key; attempt — номер уже сделанной попытки доставки (с 1)."""
+        seq = next(self._seq)
+        due = asyncio.get_running_loop().time() + self.backoff(attempt)
+        self._entries[key] = (seq, attempt)
+        heapq.heappush(self._heap, (due, seq, key))
+        if self._heap[0][1] == seq:
+            self._wakeup.set()  # Новый срок раньше текущего — перезаводим таймер
+
+        if len(self._heap) > 2 * len(self._entries) + 1024:  # Слишком много отменённых записей
+            self._heap = [item for item in self._heap if self._entries.get(item[2], (None,))[0] == item[1]]
+            heapq.heapify(self._heap)
+
+    def cancel(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            delay = self._heap[0][0] - loop.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, seq, key = heapq.heappop(self._heap)
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != seq:
+                continue  # ACK уже пришёл или запись перепланирована
+            del self._entries[key]
+
+            try:
+                await self.on_timeout(key, entry[1])
+            except Exception as e:
+                logger.error(f"Ошибка при обработке таймаута ACK {key}: {e}")
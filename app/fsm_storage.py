@@ -0,0 +1,173 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any
+
+import aiosqlite
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+
+import database
+from metrics import registry
+
+FSM_STORAGE_PATH = os.getenv("FSM_STORAGE_PATH")  # По умолчанию — messages.db
+FSM_STATE_TTL = float(os.getenv("FSM_STATE_TTL", str(7 * 24 * 3600)))  # Незавершённый план старше — забывается
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))  # 0 — без кэша (несколько реплик бота)
+FSM_PURGE_INTERVAL = float(os.getenv("FSM_PURGE_INTERVAL", "3600"))
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _Record:
+    state: str | None = None
+    data: dict[str, Any] = field(default_factory=dict)
+    updated_at: float = 0.0
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище FSM aiogram в SQLite: состояние и данные пользователя (original_text, moderated_text, plan_date)
+    переживают перезапуск бота. Чтение — из LRU-кэша в памяти, запись — сквозная: кэш обновляется сразу,
+    строка фиксируется групповым коммитом (WriteBatcher) на своём соединении до возврата из set_*.
+    Записи без обновлений дольше ttl считаются пустыми и периодически удаляются.
+    """
+
+    def __init__(self, path: str | None = None, ttl: float = FSM_STATE_TTL, cache_size: int = FSM_CACHE_SIZE,
+                 purge_interval: float = FSM_PURGE_INTERVAL):
+        self.path = path
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.purge_interval = purge_interval
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "expired": 0}
+        self._cache: OrderedDict[str, _Record] = OrderedDict()
+        self._db: aiosqlite.Connection | None = None  # Чтение при промахе кэша
+        self._batcher: database.WriteBatcher | None = None
+        self._purge_task: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+
+    async def open(self):
+        async with self._lock:
+            if self._db is not None:
+                return
+            path = self.path or FSM_STORAGE_PATH or database.DATABASE_PATH
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            db = await database.connect_db(path)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS fsm_states (
+                    key TEXT PRIMARY KEY,
+                    state TEXT,
+                    data TEXT NOT NULL DEFAULT '{}',
+                    updated_at REAL NOT NULL
+                )
+            """)
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_fsm_states_updated ON fsm_states(updated_at)")
+            await db.commit()
+            batcher = database.WriteBatcher(path=path)
+            await batcher.start()
+            self._db, self._batcher = db, batcher
+            self._purge_task = asyncio.create_task(self._purge_loop())
+
+    async def close(self):
+        if self._purge_task is not None:
+            self._purge_task.cancel()
+            self._purge_task = None
+        if self._batcher is not None:
+            await self._batcher.stop()  # Дописывает всё, что уже в очереди
+            self._batcher = None
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+        self._cache.clear()
+
+    def _expired(self, record: _Record) -> bool:
+        return time.time() - record.updated_at > self.ttl
+
+    def _remember(self, key: str, record: _Record):
+        if self.cache_size <= 0:
+            return
+        self._cache[key] = record
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _load(self, key: str) -> _Record:
+        record = self._cache.get(key)
+        if record is not None:
+            self._cache.move_to_end(key)
+            self.stats["hits"] += 1
+        else:
+            self.stats["misses"] += 1
+            await self.open()
+            async with self._db.execute("SELECT state, data, updated_at FROM fsm_states WHERE key = ?",
+                                        (key,)) as cursor:
+                row = await cursor.fetchone()
+            record = _Record(row[0], json.loads(row[1]), row[2]) if row is not None else _Record()
+            self._remember(key, record)
+        if record.updated_at and self._expired(record):
+            self.stats["expired"] += 1
+            record = _Record()
+            self._remember(key, record)
+        return record
+
+    async def _save(self, key: str, record: _Record):
+        record.updated_at = time.time()
+        self._remember(key, record)
+        await self.open()
+        if record.state is None and not record.data:
+            await self._batcher.submit("DELETE FROM fsm_states WHERE key = ?", (key,))
+        else:
+            await self._batcher.submit(
+                "INSERT OR REPLACE INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?)",
+                (key, record.state, json.dumps(record.data, ensure_ascii=False), record.updated_at)
+            )
+        self.stats["writes"] += 1
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key = self.key_builder.build(key)
+        record = await self._load(storage_key)
+        state = state.state if isinstance(state, State) else state
+        await self._save(storage_key, _Record(state, record.data))
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        return (await self._load(self.key_builder.build(key))).state
+
+    async def set_data(self, key: StorageKey, data: dict[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise ValueError(f"Data must be a dict, got {type(data).__name__}")
+        storage_key = self.key_builder.build(key)
+        record = await self._load(storage_key)
+        await self._save(storage_key, _Record(record.state, data.copy()))
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        return (await self._load(self.key_builder.build(key))).data.copy()
+
+    async def purge_expired(self) -> int:
+        await self.open()
+        result = await self._batcher.submit("DELETE FROM fsm_states WHERE updated_at < ?", (time.time() - self.ttl,))
+        if result.rowcount > 0:
+            logger.info(f"🧹 Удалено устаревших состояний FSM: {result.rowcount}")
+        return result.rowcount
+
+    async def _purge_loop(self):
+        while True:
+            try:
+                await self.purge_expired()
+            except Exception as e:
+                logger.error(f"❌ Не удалось удалить устаревшие состояния FSM: {e}")
+            await asyncio.sleep(self.purge_interval)
+
+
+storage = SQLiteStorage()
+
+
+@registry.collector
+def _collect_storage():
+    for event, value in storage.stats.items():
+        yield "fsm_storage_events_total", "counter", "Хранилище состояний FSM", {"event": event}, value
+    yield "fsm_storage_cached_keys", "gauge", "Состояний в кэше", {}, len(storage._cache)
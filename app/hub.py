@@ -0,0 +1,95 @@
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable
+
+from database import fetch_messages_after, max_message_id
+
+HUB_BACKEND = os.getenv("HUB_BACKEND", "memory")  # memory — один процесс, sqlite — несколько воркеров uvicorn
+HUB_POLL_INTERVAL = float(os.getenv("HUB_POLL_INTERVAL", "0.2"))
+
+Deliver = Callable[[str, dict], Awaitable[None]]
+
+logger = logging.getLogger(__name__)
+
+
+class InProcessHub:
+    """Доставка новых сообщений сокетам текущего процесса."""
+
+    def __init__(self):
+        self._deliver: Deliver | None = None
+
+    async def start(self, deliver: Deliver):
+        self._deliver = deliver
+
+    async def stop(self):
+        pass
+
+    async def publish(self, telegram_user_id: str, message: dict):
+        await self._deliver(telegram_user_id, message)
+
+
+class SQLitePollingHub(InProcessHub):
+    """
+    Доставка между воркерами через общую БД: каждый воркер опрашивает таблицу messages
+    по возрастанию id и досылает новые сообщения своим сокетам. Свои сообщения доставляются сразу.
+    """
+
+    def __init__(self, interval: float = HUB_POLL_INTERVAL):
+        super().__init__()
+        self.interval = interval
+        self._last_id = 0
+        self._local_ids: set[int] = set()  # Уже доставленные этим воркером при публикации
+        self._task: asyncio.Task | None = None
+
+    async def start(self, deliver: Deliver):
+        await super().start(deliver)
+        self._last_id = await max_message_id()
+        self._task = asyncio.create_task(self._poll())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def publish(self, telegram_user_id: str, message: dict):
+        self._local_ids.add(message["db_message_id"])
+        await super().publish(telegram_user_id, message)
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                rows = await fetch_messages_after(self._last_id)
+            except Exception as e:
+                logger.error(f"Ошибка при опросе новых сообщений: {e}")
+                continue
+
+            for row in rows:
+                self._last_id = row["id"]
+                if row["id"] in self._local_ids:
+                    continue
+                await self._deliver(str(row["user_id"]), {
+                    "db_message_id": row["id"],
+                    "type": "new_message",
+                    "text": row["text"],
+                    "model_text": row["model_text"],
+                    "chat_id": row["chat_id"],
+                    "progress_message_id": row["progress_message_id"],
+                    "plan_date": row["plan_date"],
+                    "trace_id": row["trace_id"]
+                })
+            self._local_ids = {db_message_id for db_message_id in self._local_ids if db_message_id > self._last_id}
+
+
+def create_hub(backend: str = HUB_BACKEND) -> InProcessHub:
+    if backend == "memory":
+        return InProcessHub()
+    if backend == "sqlite":
+        return SQLitePollingHub()
+    raise ValueError(f"Неизвестный HUB_BACKEND: {backend}")
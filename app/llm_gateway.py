@@ -0,0 +1,228 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+
+from dotenv import load_dotenv
+
+from metrics import Histogram, registry
+
+load_dotenv()
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_API_URL = os.getenv("OPENAI_API_URL")
+CLAUDE_API_KEY = os.getenv("ANTHROPIC_API_KEY")
+CLAUDE_API_URL = os.getenv("ANTHROPIC_API_URL")
+
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "90"))  # Весь запрос, включая ожидание слота
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))  # На провайдера
+LLM_KEEPALIVE = float(os.getenv("LLM_KEEPALIVE", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+OPENAI_CONCURRENCY = int(os.getenv("OPENAI_CONCURRENCY", "64"))
+ANTHROPIC_CONCURRENCY = int(os.getenv("ANTHROPIC_CONCURRENCY", "64"))
+
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderStats:
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.first_token = Histogram(LATENCY_BUCKETS)  # Для потоковых ответов
+        self.prompt_tokens = Histogram(TOKEN_BUCKETS)
+        self.completion_tokens = Histogram(TOKEN_BUCKETS)
+        self.errors = 0
+        self.timeouts = 0
+        self.in_flight = 0
+
+    def snapshot(self) -> dict:
+        return {
+            "latency_s": self.latency.snapshot(),
+            "first_token_s": self.first_token.snapshot(),
+            "prompt_tokens": self.prompt_tokens.snapshot(),
+            "completion_tokens": self.completion_tokens.snapshot(),
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "in_flight": self.in_flight,
+        }
+
+
+def _http_client(sdk):
+    """Пул соединений с keep-alive. Limits берём из SDK: в разных версиях он собран на разных сборках httpx."""
+    limits = type(sdk.DEFAULT_CONNECTION_LIMITS)(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_CONNECTIONS,
+        keepalive_expiry=LLM_KEEPALIVE,
+    )
+    return sdk.DefaultAsyncHttpxClient(limits=limits, timeout=sdk.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT))
+
+
+class LLMGateway:
+    """
+    Единая точка вызова LLM: нативные асинхронные клиенты OpenAI и Anthropic со своими пулами соединений,
+    семафор на провайдера, общий таймаут запроса и гистограммы задержек и токенов.
+    Потоки исполнителя не используются, поэтому запросы к LLM не мешают transcribe_audio.
+    SDK импортируются при первом обращении (см. warm_up).
+    """
+
+    def __init__(self, openai_concurrency: int = OPENAI_CONCURRENCY,
+                 anthropic_concurrency: int = ANTHROPIC_CONCURRENCY, timeout: float = LLM_TIMEOUT):
+        self.timeout = timeout
+        self._openai = None
+        self._anthropic = None
+        self._semaphores = {
+            "openai": asyncio.Semaphore(openai_concurrency),
+            "anthropic": asyncio.Semaphore(anthropic_concurrency),
+        }
+        self.stats = {"openai": ProviderStats(), "anthropic": ProviderStats()}
+
+    @property
+    def openai(self):
+        if self._openai is None:
+            if not OPENAI_API_KEY:
+                raise ValueError("OPENAI_API_KEY не задан. Укажите ключ в .env файле.")
+            import openai
+            self._openai = openai.AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_API_URL,
+                                              max_retries=LLM_MAX_RETRIES, http_client=_http_client(openai))
+        return self._openai
+
+    @property
+    def anthropic(self):
+        if self._anthropic is None:
+            if not CLAUDE_API_KEY:
+                raise ValueError("ANTHROPIC_API_KEY не задан. Укажите ключ в .env файле.")
+            import anthropic
+            self._anthropic = anthropic.AsyncAnthropic(api_key=CLAUDE_API_KEY, base_url=CLAUDE_API_URL,
+                                                       max_retries=LLM_MAX_RETRIES, http_client=_http_client(anthropic))
+        return self._anthropic
+
+    async def warm_up(self):
+        """Импортирует SDK и создаёт клиенты в отдельном потоке, не блокируя цикл событий."""
+        await asyncio.to_thread(lambda: (self.openai, self.anthropic))
+
+    async def close(self):
+        for client in (self._openai, self._anthropic):
+            if client is not None:
+                await client.close()
+        self._openai = self._anthropic = None
+
+    async def _call(self, provider: str, request):
+        stats = self.stats[provider]
+        started = time.perf_counter()
+        stats.in_flight += 1
+        try:
+            async with asyncio.timeout(self.timeout):
+                async with self._semaphores[provider]:
+                    return await request()
+        except TimeoutError:
+            stats.timeouts += 1
+            raise
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            stats.in_flight -= 1
+            stats.latency.observe(time.perf_counter() - started)
+
+    @asynccontextmanager
+    async def _streaming(self, provider: str):
+        """Как _call, но слот семафора занят, пока потребитель читает поток."""
+        stats = self.stats[provider]
+        semaphore = self._semaphores[provider]
+        started = time.perf_counter()
+        stats.in_flight += 1
+        try:
+            async with asyncio.timeout(self.timeout):
+                await semaphore.acquire()
+        except TimeoutError:
+            stats.timeouts += 1
+            stats.in_flight -= 1
+            raise
+        try:
+            yield stats
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            semaphore.release()
+            stats.in_flight -= 1
+            stats.latency.observe(time.perf_counter() - started)
+
+    async def openai_stream(self, model: str, messages: list[dict], temperature: float):
+        """Чанки потокового ответа OpenAI; usage приходит последним чанком."""
+        async with self._streaming("openai") as stats:
+            started = time.perf_counter()
+            stream = await asyncio.wait_for(self.openai.chat.completions.create(
+                model=model, messages=messages, temperature=temperature, stream=True,
+                stream_options={"include_usage": True}), self.timeout)
+            first = True
+            async with stream:  # Закрывает ответ, даже если потребитель прервал чтение
+                async for chunk in stream:
+                    if first and chunk.choices:
+                        stats.first_token.observe(time.perf_counter() - started)
+                        first = False
+                    if chunk.usage is not None:
+                        stats.prompt_tokens.observe(chunk.usage.prompt_tokens)
+                        stats.completion_tokens.observe(chunk.usage.completion_tokens)
+                    yield chunk
+
+    async def anthropic_stream(self, model: str, system: list[dict], messages: list[dict], max_tokens: int = 4096):
+        """
+        События потокового ответа Anthropic (message_start, content_block_delta, message_delta, ...).
+        temperature не передаём: messages.create в anthropic 1.x его не принимает.
+        """
+        async with self._streaming("anthropic") as stats:
+            started = time.perf_counter()
+            stream = await asyncio.wait_for(self.anthropic.messages.create(
+                model=model, max_tokens=max_tokens, system=system, messages=messages, stream=True), self.timeout)
+            first = True
+            async with stream:
+                async for event in stream:
+                    if event.type == "message_start":
+                        stats.prompt_tokens.observe(event.message.usage.input_tokens)
+                    elif event.type == "content_block_delta" and first:
+                        stats.first_token.observe(time.perf_counter() - started)
+                        first = False
+                    elif event.type == "message_delta":
+                        stats.completion_tokens.observe(event.usage.output_tokens)
+                    yield event
+
+    async def openai_chat(self, model: str, messages: list[dict], temperature: float):
+        response = await self._call("openai", lambda: self.openai.chat.completions.create(
+            model=model, messages=messages, temperature=temperature))
+        if response.usage is not None:
+            self.stats["openai"].prompt_tokens.observe(response.usage.prompt_tokens)
+            self.stats["openai"].completion_tokens.observe(response.usage.completion_tokens)
+        return response
+
+    async def anthropic_message(self, model: str, system: list[dict], messages: list[dict], max_tokens: int = 4096):
+        response = await self._call("anthropic", lambda: self.anthropic.messages.create(
+            model=model, max_tokens=max_tokens, system=system, messages=messages))
+        if response.usage is not None:
+            self.stats["anthropic"].prompt_tokens.observe(response.usage.input_tokens)
+            self.stats["anthropic"].completion_tokens.observe(response.usage.output_tokens)
+        return response
+
+    def metrics(self) -> dict:
+        return {provider: stats.snapshot() for provider, stats in self.stats.items()}
+
+
+gateway = LLMGateway()
+
+
+@registry.collector
+def _collect_gateway():
+    for provider, stats in gateway.stats.items():
+        labels = {"provider": provider}
+        yield "llm_request_seconds", "histogram", "Запрос к LLM, включая ожидание слота", labels, stats.latency
+        yield "llm_first_token_seconds", "histogram", "Время до первого токена потокового ответа", labels, \
+            stats.first_token
+        yield "llm_prompt_tokens", "histogram", "Токенов в промте", labels, stats.prompt_tokens
+        yield "llm_completion_tokens", "histogram", "Токенов в ответе", labels, stats.completion_tokens
+        yield "llm_errors_total", "counter", "Ошибки запросов к LLM", labels, stats.errors
+        yield "llm_timeouts_total", "counter", "Запросы к LLM, превысившие LLM_TIMEOUT", labels, stats.timeouts
+        yield "llm_in_flight", "gauge", "Запросы к LLM в работе", labels, stats.in_flight
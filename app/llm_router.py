@@ -0,0 +1,218 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable
+
+from metrics import registry
+from openai_client import (
+    CLAUDE_MODEL, GPT_MODEL, PlanChunk, parse_plan, request_claude_plan, request_gpt_plan, stream_claude_response,
+    stream_gpt_response,
+)
+
+ROUTER_WINDOW = int(os.getenv("ROUTER_WINDOW", "50"))  # Последних запросов на маршрут
+ROUTER_MIN_SAMPLES = int(os.getenv("ROUTER_MIN_SAMPLES", "10"))
+ROUTER_MAX_ERROR_RATE = float(os.getenv("ROUTER_MAX_ERROR_RATE", "0.5"))  # Выше — маршрут уходит в конец очереди
+ROUTER_MAX_ATTEMPTS = int(os.getenv("ROUTER_MAX_ATTEMPTS", "3"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "2"))
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "10"))  # Пока статистики мало
+
+logger = logging.getLogger(__name__)
+
+
+class AllProvidersFailed(Exception):
+    """Ни один провайдер не вернул разбираемый план."""
+
+
+@dataclass
+class Route:
+    name: str  # provider:model
+    request: Callable[[str], Awaitable[tuple[str, str]]]
+    stream: Callable[[str], AsyncIterator[PlanChunk]] | None = None
+
+
+class RollingStats:
+    """Задержки и ошибки последних window запросов маршрута."""
+
+    def __init__(self, window: int = ROUTER_WINDOW):
+        self._samples: deque[tuple[float, bool]] = deque(maxlen=window)
+
+    def record(self, latency: float, ok: bool):
+        self._samples.append((latency, ok))
+
+    def __len__(self):
+        return len(self._samples)
+
+    def error_rate(self) -> float:
+        if not self._samples:
+            return 0.0
+        return sum(1 for _, ok in self._samples if not ok) / len(self._samples)
+
+    def p90(self) -> float | None:
+        latencies = sorted(latency for latency, ok in self._samples if ok)
+        if len(latencies) < ROUTER_MIN_SAMPLES:
+            return None
+        return latencies[int(len(latencies) * 0.9)]
+
+    def snapshot(self) -> dict:
+        p90 = self.p90()
+        return {"samples": len(self), "error_rate": round(self.error_rate(), 3),
+                "p90_s": round(p90, 3) if p90 is not None else None}
+
+
+class LLMRouter:
+    """
+    Выбор провайдера для модерации плана.
+    Сначала — выбранный пользователем маршрут, если он здоров; если ответа нет дольше p90 его задержки,
+    параллельно отправляется запрос следующему маршруту, и побеждает первый разобранный ответ.
+    В потоковом режиме (moderate_stream) «ответ» — первый фрагмент плана: начавший писать маршрут не дублируется.
+    Ошибки API и неразбираемые ответы повторяются на следующем маршруте (не больше max_attempts попыток).
+    """
+
+    def __init__(self, routes: list[Route], max_attempts: int = ROUTER_MAX_ATTEMPTS,
+                 hedge_min_delay: float = HEDGE_MIN_DELAY, hedge_default_delay: float = HEDGE_DEFAULT_DELAY):
+        self.routes = {route.name: route for route in routes}
+        self.max_attempts = max_attempts
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_default_delay = hedge_default_delay
+        self.stats = {route.name: RollingStats() for route in routes}
+        self.counters = {"requests": 0, "hedges": 0, "backup_wins": 0, "retries": 0, "failures": 0}
+
+    def healthy(self, name: str) -> bool:
+        stats = self.stats[name]
+        return len(stats) < ROUTER_MIN_SAMPLES or stats.error_rate() <= ROUTER_MAX_ERROR_RATE
+
+    def order(self, preferred: str | None = None) -> list[Route]:
+        """Предпочтительный маршрут первым, нездоровые — в конце."""
+        names = sorted(self.routes, key=lambda name: (not self.healthy(name), name != preferred))
+        return [self.routes[name] for name in names]
+
+    def hedge_delay(self, name: str) -> float:
+        p90 = self.stats[name].p90()
+        return self.hedge_default_delay if p90 is None else max(self.hedge_min_delay, p90)
+
+    def record(self, name: str, latency: float, ok: bool):
+        self.stats[name].record(latency, ok)
+
+    async def _attempt(self, route: Route, text: str,
+                       on_chunk: Callable[[PlanChunk], None] | None = None) -> tuple[str, str]:
+        started = time.perf_counter()
+        try:
+            if on_chunk is not None and route.stream is not None:
+                chunk = PlanChunk(None, "")
+                async for chunk in route.stream(text):
+                    on_chunk(chunk)
+                result = parse_plan(chunk.raw)  # Неразбираемый ответ — как ошибка маршрута
+            else:
+                result = await route.request(text)
+        except asyncio.CancelledError:
+            raise  # Проигравший хедж — не ошибка маршрута
+        except Exception:
+            self.record(route.name, time.perf_counter() - started, False)
+            raise
+        self.record(route.name, time.perf_counter() - started, True)
+        return result
+
+    async def moderate(self, text: str, preferred: str | None = None) -> tuple[str, str]:
+        return await self._race(text, preferred)
+
+    async def moderate_stream(self, text: str, preferred: str | None = None,
+                              on_chunk: Callable[[PlanChunk], None] | None = None) -> tuple[str, str]:
+        """
+        То же с потоковыми ответами. on_chunk получает фрагменты одного маршрута — первого, начавшего писать;
+        если он упал, показывается следующий. Победитель — первый разобранный план, не обязательно показанный.
+        """
+        return await self._race(text, preferred, on_chunk or (lambda chunk: None))
+
+    async def _race(self, text: str, preferred: str | None = None,
+                    on_chunk: Callable[[PlanChunk], None] | None = None) -> tuple[str, str]:
+        self.counters["requests"] += 1
+        order = self.order(preferred)
+        plan = [order[i % len(order)] for i in range(self.max_attempts)]  # Попытки по кругу маршрутов
+        pending: dict[asyncio.Task, Route] = {}
+        responded: dict[asyncio.Task, asyncio.Event] = {}  # Попытка прислала первый фрагмент
+        leader: asyncio.Event | None = None  # Чьи фрагменты показываются
+        errors = []
+
+        def launch() -> Route | None:
+            if not plan:
+                return None
+            route = plan.pop(0)
+            started = asyncio.Event()
+
+            def forward(chunk: PlanChunk):
+                nonlocal leader
+                if not chunk.body:
+                    return
+                started.set()
+                if leader is None:
+                    leader = started
+                if leader is started:
+                    on_chunk(chunk)
+
+            task = asyncio.create_task(self._attempt(route, text, forward if on_chunk is not None else None))
+            pending[task] = route
+            responded[task] = started
+            return route
+
+        launch()
+        first = next(iter(pending))
+        try:
+            while pending:
+                only = next(iter(pending))
+                can_hedge = len(pending) == 1 and plan and not responded[only].is_set()
+                timeout = self.hedge_delay(pending[only].name) if can_hedge else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if responded[only].is_set():
+                        continue  # Поток начался во время ожидания — маршрут отвечает, дублировать незачем
+                    hedge = launch()
+                    self.counters["hedges"] += 1
+                    logger.info(f"⏱ Нет ответа за {timeout:.1f}s, дублирую запрос в {hedge.name}")
+                    continue
+
+                for task in done:
+                    route = pending.pop(task)
+                    if task.exception() is None:
+                        if task is not first:  # Победил хедж или повтор
+                            self.counters["backup_wins"] += 1
+                        return task.result()
+                    errors.append(f"{route.name}: {task.exception()}")
+                    logger.warning(f"⚠️ {route.name} не вернул план: {task.exception()}")
+                    if leader is responded[task]:
+                        leader = None  # Показываем следующий начавший писать маршрут
+                if not pending and launch() is not None:
+                    self.counters["retries"] += 1
+        finally:
+            for task in pending:
+                task.cancel()
+
+        self.counters["failures"] += 1
+        raise AllProvidersFailed("; ".join(errors))
+
+    def metrics(self) -> dict:
+        return {**self.counters, "routes": {name: stats.snapshot() for name, stats in self.stats.items()}}
+
+
+OPENAI_ROUTE = f"openai:{GPT_MODEL}"
+ANTHROPIC_ROUTE = f"anthropic:{CLAUDE_MODEL}"
+MODEL_ROUTES = {"gpt": OPENAI_ROUTE, "cloud": ANTHROPIC_ROUTE}  # Выбор пользователя (/gpt, /cloud) -> маршрут
+
+router = LLMRouter([
+    Route(OPENAI_ROUTE, request_gpt_plan, stream_gpt_response),
+    Route(ANTHROPIC_ROUTE, request_claude_plan, stream_claude_response),
+])
+
+
+@registry.collector
+def _collect_router():
+    for event, value in router.counters.items():
+        yield "llm_router_events_total", "counter", "Модерации через маршрутизатор", {"event": event}, value
+    for name, stats in router.stats.items():
+        labels = {"route": name}
+        yield "llm_route_error_rate", "gauge", "Доля ошибок маршрута за окно", labels, stats.error_rate()
+        p90 = stats.p90()
+        if p90 is not None:
+            yield "llm_route_p90_seconds", "gauge", "p90 задержки маршрута за окно", labels, p90
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import os
+import time
+
+from database import archive_processed_messages, freelist_pages, incremental_vacuum, optimize
+from metrics import registry
+
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "30"))  # 0 — не архивировать
+ARCHIVE_CHUNK_ROWS = int(os.getenv("ARCHIVE_CHUNK_ROWS", "200"))  # Строк на транзакцию переноса
+VACUUM_CHUNK_PAGES = int(os.getenv("VACUUM_CHUNK_PAGES", "64"))  # Страниц за шаг incremental_vacuum (256 КБ при 4 КБ)
+MAINTENANCE_INTERVAL = float(os.getenv("MAINTENANCE_INTERVAL", "3600"))
+MAINTENANCE_PAUSE = float(os.getenv("MAINTENANCE_PAUSE_MS", "20")) / 1000  # Между пачками: запись успевает пройти
+
+logger = logging.getLogger(__name__)
+
+
+class Maintenance:
+    """
+    Фоновое обслуживание messages.db: обработанные сообщения старше archive_after переезжают в messages_archive,
+    освобождённые страницы возвращаются incremental_vacuum, затем PRAGMA optimize.
+    Всё делается короткими транзакциями с паузами, поэтому групповая запись не ждёт дольше одной пачки.
+    Непрочитанные сообщения не архивируются никогда. Устройство, не подключавшееся дольше archive_after,
+    не получит досылкой уже обработанные другими устройствами сообщения из архива.
+    """
+
+    def __init__(self, archive_after: float = ARCHIVE_AFTER_DAYS * 86400, chunk_rows: int = ARCHIVE_CHUNK_ROWS,
+                 vacuum_pages: int = VACUUM_CHUNK_PAGES, interval: float = MAINTENANCE_INTERVAL,
+                 pause: float = MAINTENANCE_PAUSE):
+        self.archive_after = archive_after
+        self.chunk_rows = chunk_rows
+        self.vacuum_pages = vacuum_pages
+        self.interval = interval
+        self.pause = pause
+        self.stats = {"runs": 0, "failed": 0, "archived": 0, "vacuumed_pages": 0,
+                      "last_run_s": 0.0, "last_run_at": None}
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.error(f"❌ Обслуживание БД не удалось: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self) -> dict:
+        started = time.perf_counter()
+        archived = await self.archive() if self.archive_after > 0 else 0
+        vacuumed = await self.vacuum()
+        await optimize()
+
+        elapsed = time.perf_counter() - started
+        self.stats["runs"] += 1
+        self.stats["archived"] += archived
+        self.stats["vacuumed_pages"] += vacuumed
+        self.stats["last_run_s"] = round(elapsed, 3)
+        self.stats["last_run_at"] = time.time()
+        if archived or vacuumed:
+            logger.info(f"🧹 Обслуживание БД: в архив {archived} сообщений, освобождено {vacuumed} страниц "
+                        f"за {elapsed:.1f}s")
+        return {"archived": archived, "vacuumed_pages": vacuumed, "seconds": round(elapsed, 3)}
+
+    async def archive(self) -> int:
+        total, after_id = 0, 0
+        while after_id is not None:
+            moved, after_id = await archive_processed_messages(self.archive_after, after_id, self.chunk_rows)
+            total += moved
+            await asyncio.sleep(self.pause)
+        return total
+
+    async def vacuum(self) -> int:
+        """Сколько страниц возвращено; без auto_vacuum=INCREMENTAL прагма ничего не делает."""
+        freed, remaining = 0, await freelist_pages()
+        while remaining > 0:
+            left = await incremental_vacuum(self.vacuum_pages)
+            if left >= remaining:  # Ничего не освободилось (режим auto_vacuum не включён)
+                break
+            freed += remaining - left
+            remaining = left
+            await asyncio.sleep(self.pause)
+        return freed
+
+
+maintenance = Maintenance()
+
+
+@registry.collector
+def _collect_maintenance():
+    for event in ("runs", "failed", "archived", "vacuumed_pages"):
+        yield "db_maintenance_total", "counter", "Обслуживание messages.db", {"event": event}, \
+            maintenance.stats[event]
+    yield "db_maintenance_last_run_seconds", "gauge", "Длительность последнего обслуживания", {}, \
+        maintenance.stats["last_run_s"]
@@ -0,0 +1,175 @@
+import bisect
+import logging
+import os
+import uuid
+from contextvars import ContextVar
+from typing import Callable, Iterable
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"  # 0 — все метрики превращаются в заглушки
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9101"))  # /metrics бота (у API — свой маршрут)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+logger = logging.getLogger(__name__)
+
+# Трассировка плана: от апдейта Telegram до подтверждения из Obsidian
+current_trace: ContextVar[str | None] = ContextVar("current_trace", default=None)
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+class Histogram:
+    """Счётчики по верхним границам корзин плюс сумма и количество наблюдений."""
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Последняя корзина — всё, что больше
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self) -> dict:
+        labels = [str(bound) for bound in self.buckets] + ["+Inf"]
+        return {"buckets": dict(zip(labels, self.counts)), "sum": round(self.sum, 3), "count": self.count}
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class Gauge(Counter):
+    def set(self, value: float):
+        self.value = value
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+
+class _Noop:
+    """Заглушка для METRICS_ENABLED=0: вызовы на горячем пути ничего не делают."""
+
+    def observe(self, value: float):
+        pass
+
+    def inc(self, amount: float = 1):
+        pass
+
+    def dec(self, amount: float = 1):
+        pass
+
+    def set(self, value: float):
+        pass
+
+
+NOOP = _Noop()
+BACKSLASH, QUOTE = "\\", '"'
+
+# (имя, тип, описание, метки, значение или Histogram)
+Sample = tuple[str, str, str, dict, "float | Histogram"]
+
+
+def _labels(labels: dict, extra: str = "") -> str:
+    parts = [f'{key}="{str(value).replace(BACKSLASH, BACKSLASH * 2).replace(QUOTE, BACKSLASH + QUOTE)}"'
+             for key, value in labels.items()]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Registry:
+    """
+    Метрики процесса в текстовом формате Prometheus.
+    Гистограммы и счётчики горячего пути регистрируются один раз и обновляются без блокировок;
+    уже существующие счётчики модулей (write_stats, stats сервисов) отдаются через коллекторы,
+    которые читаются только при запросе /metrics.
+    """
+
+    def __init__(self, enabled: bool = METRICS_ENABLED):
+        self.enabled = enabled
+        self._metrics: dict[tuple, tuple[str, str, dict, object]] = {}  # (имя, метки) -> (тип, описание, метки, метрика)
+        self._collectors: list[Callable[[], Iterable[Sample]]] = []
+
+    def _get(self, kind: str, factory, name: str, description: str, labels: dict | None):
+        if not self.enabled:
+            return NOOP
+        labels = labels or {}
+        key = (name, tuple(sorted(labels.items())))
+        if key not in self._metrics:
+            self._metrics[key] = (kind, description, labels, factory())
+        return self._metrics[key][3]
+
+    def histogram(self, name: str, description: str, labels: dict | None = None,
+                  buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._get("histogram", lambda: Histogram(buckets), name, description, labels)
+
+    def counter(self, name: str, description: str, labels: dict | None = None) -> Counter:
+        return self._get("counter", Counter, name, description, labels)
+
+    def gauge(self, name: str, description: str, labels: dict | None = None) -> Gauge:
+        return self._get("gauge", Gauge, name, description, labels)
+
+    def collector(self, collect: Callable[[], Iterable[Sample]]):
+        if self.enabled:
+            self._collectors.append(collect)
+        return collect
+
+    def samples(self) -> list[Sample]:
+        samples = [(name, kind, description, labels, metric.value if kind != "histogram" else metric)
+                   for (name, _), (kind, description, labels, metric) in self._metrics.items()]
+        for collect in self._collectors:
+            try:
+                samples.extend(collect())
+            except Exception as e:
+                logger.error(f"❌ Коллектор метрик {collect.__qualname__} упал: {e}")
+        return samples
+
+    def render(self) -> str:
+        lines = []
+        described = set()
+        for name, kind, description, labels, value in sorted(self.samples(), key=lambda sample: sample[0]):
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} {kind}")
+            if kind != "histogram":
+                lines.append(f"{name}{_labels(labels)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip([*value.buckets, "+Inf"], value.counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{name}_bucket{_labels(labels, le)} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {value.sum}")
+            lines.append(f"{name}_count{_labels(labels)} {value.count}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+async def start_metrics_server(port: int = METRICS_PORT):
+    """HTTP-сервер с /metrics для процессов без FastAPI (бот). Возвращает runner для остановки."""
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(body=registry.render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", port).start()
+    logger.info(f"📈 Метрики доступны на :{port}/metrics")
+    return runner
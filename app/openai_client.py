@@ -1,131 +1,159 @@
-import datetime
+import logging
 import os
+from dataclasses import dataclass
+from typing import AsyncIterator
 
-import openai
 import asyncio
-import anthropic
 from dotenv import load_dotenv
-from zoneinfo import ZoneInfo
+
+from llm_gateway import gateway
+from metrics import registry
+from plan_parser import PLAN_MARKER, parse_plan_response
+from prompts import prompts
 
 # Загружаем переменные окружения
 load_dotenv()
 
-# Получаем API-ключ и URL OpenAI
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-OPENAI_API_URL = os.getenv("OPENAI_API_URL")
-PROMT_PATH = os.getenv("PROMT_PATH")
+logger = logging.getLogger(__name__)
 
-if not OPENAI_API_KEY:
-    raise ValueError("OPENAI_API_KEY не задан. Укажите ключ в .env файле.")
+# Расход токенов, в том числе прочитанных из кэша промта у провайдера
+usage_stats = {
+    "openai": {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0},
+    "anthropic": {"requests": 0, "input_tokens": 0, "cache_read_tokens": 0, "cache_write_tokens": 0},
+}
 
-# Настраиваем OpenAI-клиент
-client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_API_URL)
 
-# Получаем API-ключ и URL для Anthropic (Claude)
-CLAUDE_API_KEY = os.getenv("ANTHROPIC_API_KEY")
-CLAUDE_API_URL = os.getenv("ANTHROPIC_API_URL")
+@registry.collector
+def _collect_usage():
+    for provider, stats in usage_stats.items():
+        for kind, value in stats.items():
+            name = "llm_usage_requests_total" if kind == "requests" else "llm_usage_tokens_total"
+            labels = {"provider": provider} if kind == "requests" else {"provider": provider, "kind": kind}
+            yield name, "counter", "Расход токенов LLM, в том числе из кэша промта", labels, value
 
-if not CLAUDE_API_KEY:
-    raise ValueError("ANTHROPIC_API_KEY не задан. Укажите ключ в .env файле.")
 
-# Настраиваем клиент для Anthropic (Claude)
-claude_client = anthropic.Anthropic(api_key=CLAUDE_API_KEY, base_url=CLAUDE_API_URL)
+GPT_MODEL = os.getenv("GPT_MODEL", "gpt-4o")
+CLAUDE_MODEL = os.getenv("CLAUDE_MODEL", "claude-3-5-sonnet-20240620")
 
 
-def read_prompt_from_file(filename: str) -> str:
-    """Читает текстовый файл и возвращает его содержимое."""
-    try:
-        with open(filename, "r", encoding="utf-8") as file:
-            return file.read()
-    except FileNotFoundError:
-        return "Ошибка: файл с промтом не найден."
-    except Exception as e:
-        return f"Ошибка при чтении файла: {str(e)}"
+@dataclass
+class PlanChunk:
+    """Состояние потокового ответа: дата появляется, как только пришёл заголовок {{дата}}//."""
+    date: str | None
+    body: str
+    raw: str = ""  # Весь ответ на текущий момент; в конце потока разбирается parse_plan
+
+
+def split_partial_plan(raw: str) -> PlanChunk:
+    """Дата и план для показа по ходу генерации; проверка и исправление — в parse_plan по готовому ответу."""
+    marker = raw.find(PLAN_MARKER)
+    idx = raw.rfind("//", 0, marker) if marker != -1 else raw.find("//")
+    if idx == -1:
+        return PlanChunk(None, raw[marker:] if marker != -1 else "", raw)
+    date = raw[:idx].replace('{{', '').replace('}}', '').strip()
+    return PlanChunk(date, raw[marker:] if marker != -1 else raw[idx + 2:], raw)
+
+
+async def warm_up():
+    """Клиенты, пулы соединений и лимиты живут в llm_gateway."""
+    await gateway.warm_up()
+
+
+def record_openai_usage(usage):
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = (getattr(details, "cached_tokens", 0) or 0) if details is not None else 0
+    stats = usage_stats["openai"]
+    stats["requests"] += 1
+    stats["prompt_tokens"] += usage.prompt_tokens
+    stats["cached_tokens"] += cached
+    logger.info(f"🧾 OpenAI: промт {usage.prompt_tokens} токенов, из кэша {cached}")
+
+
+def record_anthropic_usage(usage):
+    if usage is None:
+        return
+    read = getattr(usage, "cache_read_input_tokens", 0) or 0
+    written = getattr(usage, "cache_creation_input_tokens", 0) or 0
+    stats = usage_stats["anthropic"]
+    stats["requests"] += 1
+    stats["input_tokens"] += usage.input_tokens
+    stats["cache_read_tokens"] += read
+    stats["cache_write_tokens"] += written
+    logger.info(f"🧾 Anthropic: промт {usage.input_tokens} токенов, из кэша {read}, записано в кэш {written}")
+
+
+def parse_plan(result: str) -> tuple[str, str]:
+    """Разбирает ответ вида {{дата}}//📅 Дневной план... в (ISO-дата, план), исправляя мелкие огрехи формата."""
+    plan = parse_plan_response(result)
+    if plan.repairs:
+        logger.info(f"🩹 Ответ модели исправлен локально: {', '.join(plan.repairs)}")
+    return plan.plan_date, plan.body
 
 
-def generate_week_dates() -> dict:
-    """Создает словарь с датами на неделю вперёд."""
-    now = datetime.datetime.now(ZoneInfo("Europe/Moscow"))
-    week_dates = {}
-    for i in range(7):
-        future_date = now + datetime.timedelta(days=i)
-        week_dates[future_date.strftime("%A")] = {
-            "day": future_date.strftime("%d"),
-            "month": future_date.strftime("%B"),
-            "year": future_date.strftime("%Y"),
-        }
-    return week_dates
+async def request_gpt_plan(text, model: str = GPT_MODEL, temperature: float = 0.7) -> tuple[str, str]:
+    """Запрос к OpenAI; ошибки API и разбора не перехватываются — их обрабатывает маршрутизатор."""
+    response = await gateway.openai_chat(model, prompts.openai_messages(text), temperature)
+    record_openai_usage(response.usage)
+    return parse_plan(response.choices[0].message.content)
 
 
-async def generate_gpt_response(text, model: str = "gpt-4o", temperature: float = 0.7) -> str | tuple[str, str]:
+async def request_claude_plan(text, model: str = CLAUDE_MODEL) -> tuple[str, str]:
+    """Запрос к Anthropic (Claude); ошибки API и разбора не перехватываются."""
+    response = await gateway.anthropic_message(model, prompts.anthropic_system(), [{"role": "user", "content": text}])
+    record_anthropic_usage(response.usage)
+    return parse_plan(response.content[0].text)
+
+
+async def generate_gpt_response(text, model: str = GPT_MODEL, temperature: float = 0.7) -> str | tuple[str, str]:
     """
     Отправляет асинхронный запрос в OpenAI API и получает ответ.
     """
-    prompt = read_prompt_from_file(PROMT_PATH)
-    now_moscow = datetime.datetime.now(ZoneInfo("Europe/Moscow"))
-    formatted_date = now_moscow.strftime("%A, %d-%ое %B %Y, %H:%M по Москве")
-    week_dates = generate_week_dates()
+    import openai
 
     try:
-        response = await client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": f"Сегодня {formatted_date}\nДаты на неделю: {week_dates}\n{prompt}"},
-                {"role": "user", "content": text}
-            ],
-            temperature=temperature
-        )
-
-        result = response.choices[0].message.content
-        date, result = result.split('//')
-        marker = "📅 Дневной план"
-        date = date.replace('{{', '').replace('}}', '')
-        idx = result.find(marker)
-        if idx != -1:
-            result = result[idx:]
-        return date, result
+        return await request_gpt_plan(text, model, temperature)
     except openai.OpenAIError as e:
         return f"Ошибка OpenAI API: {str(e)}"
     except Exception as e:
         return f"Ошибка обработки сообщения: {str(e)}"
 
 
-async def generate_claude_response(text, model: str = "claude-3-5-sonnet-20240620", temperature: float = 0.7) -> tuple[
-    str, str]:
+async def generate_claude_response(text, model: str = CLAUDE_MODEL) -> str | tuple[str, str]:
     """
     Отправляет асинхронный запрос в API Anthropic (Claude) и получает ответ.
     """
-    prompt = read_prompt_from_file(PROMT_PATH)
-    now_moscow = datetime.datetime.now(ZoneInfo("Europe/Moscow"))
-    formatted_date = now_moscow.strftime("%A, %d-%ое %B %Y, %H:%M по Москве")
-    week_dates = generate_week_dates()
-
-    conversation = (
-        f"Human: Сегодня {formatted_date}\nДаты на неделю: {week_dates}\n{prompt}\n\n"
-        f"Human: {text}\n\n"
-        "Assistant:"
-    )
-
-    def claude_request():
-        try:
-            response = claude_client.messages.create(
-                model=model,
-                max_tokens=4096,
-                temperature=temperature,
-                messages=[{"role": "user", "content": conversation}]
-            )
-            return response.content[0].text
-        except Exception as e:
-            return f"Ошибка Anthropic API: {str(e)}"
-
-    result = await asyncio.to_thread(claude_request)
-    date, result = result.split("//")
-    marker = "📅 Дневной план"
-    date = date.replace('{{', '').replace('}}', '')
-    idx = result.find(marker)
-    if idx != -1:
-        result = result[idx:]
-    return date, result
+    try:
+        return await request_claude_plan(text, model)
+    except Exception as e:
+        return f"Ошибка Anthropic API: {str(e)}"
+
+
+async def stream_gpt_response(text, model: str = GPT_MODEL, temperature: float = 0.7) -> AsyncIterator[PlanChunk]:
+    """
+    Потоковый ответ OpenAI: после каждого фрагмента отдаёт разобранные на текущий момент дату и план.
+    """
+    raw = ""
+    async for chunk in gateway.openai_stream(model, prompts.openai_messages(text), temperature):
+        if chunk.usage is not None:
+            record_openai_usage(chunk.usage)
+        if chunk.choices and chunk.choices[0].delta.content:
+            raw += chunk.choices[0].delta.content
+            yield split_partial_plan(raw)
+
+
+async def stream_claude_response(text, model: str = CLAUDE_MODEL) -> AsyncIterator[PlanChunk]:
+    """
+    Потоковый ответ Anthropic (Claude): после каждого фрагмента отдаёт разобранные на текущий момент дату и план.
+    """
+    raw = ""
+    async for event in gateway.anthropic_stream(model, prompts.anthropic_system(), [{"role": "user", "content": text}]):
+        if event.type == "message_start":
+            record_anthropic_usage(event.message.usage)
+        elif event.type == "content_block_delta" and event.delta.type == "text_delta":
+            raw += event.delta.text
+            yield split_partial_plan(raw)
 
 
 async def main():
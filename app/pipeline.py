@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Hashable
+
+PIPELINE_DEBOUNCE = float(os.getenv("PIPELINE_DEBOUNCE", "1.0"))  # Ждём ещё сообщений от пользователя
+PIPELINE_CONCURRENCY = int(os.getenv("PIPELINE_CONCURRENCY", "16"))  # Одновременно составляемых планов
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _UserPipeline:
+    items: list = field(default_factory=list)  # Входы, ещё не получившие ответа
+    task: asyncio.Task | None = None
+    slot: asyncio.Future | None = None  # Место в очереди; переходит от отменённого запуска к следующему
+    position: int | None = None  # Последнее сообщённое место
+
+
+class PipelineScheduler:
+    """
+    Планировщик обработки по пользователям.
+    Сообщения, пришедшие с паузой меньше debounce, объединяются в один запуск run(key, items).
+    Новое сообщение отменяет уже идущий запуск этого пользователя, а его входы переходят в следующий.
+    Одновременно выполняется не больше concurrency запусков; остальные ждут в порядке очереди,
+    и on_queued(key, items, position) сообщает им место в ней. Если ждущий запуск заменило новое
+    сообщение, пользователь сохраняет место, а on_queued вызывается снова, только если оно изменилось.
+    """
+
+    def __init__(self, run: Callable[[Hashable, list], Awaitable[Any]],
+                 on_queued: Callable[[Hashable, list, int], Awaitable[Any]] | None = None,
+                 debounce: float = PIPELINE_DEBOUNCE, concurrency: int = PIPELINE_CONCURRENCY):
+        self.run = run
+        self.on_queued = on_queued
+        self.debounce = debounce
+        self.concurrency = concurrency
+        self._users: dict[Hashable, _UserPipeline] = {}
+        self._running = 0
+        self._waiting: OrderedDict[Hashable, asyncio.Future] = OrderedDict()
+        self.stats = {"submitted": 0, "runs": 0, "merged": 0, "superseded": 0, "queued": 0,
+                      "completed": 0, "failed": 0}
+
+    def submit(self, key: Hashable, item):
+        pipeline = self._users.setdefault(key, _UserPipeline())
+        self.stats["submitted"] += 1
+        if pipeline.task is not None:
+            pipeline.task.cancel()
+            self.stats["superseded"] += 1
+        pipeline.items.append(item)
+        pipeline.task = asyncio.create_task(self._process(key, pipeline))
+
+    def cancel(self, key: Hashable) -> list:
+        """Отменяет запуск пользователя и возвращает его необработанные входы."""
+        pipeline = self._users.pop(key, None)
+        if pipeline is None:
+            return []
+        if pipeline.task is not None:
+            pipeline.task.cancel()
+        self._drop_slot(key, pipeline)
+        return pipeline.items
+
+    def position(self, key: Hashable) -> int | None:
+        for position, waiting in enumerate(self._waiting, 1):
+            if waiting == key:
+                return position
+        return None
+
+    async def close(self):
+        tasks = [pipeline.task for pipeline in self._users.values() if pipeline.task is not None]
+        for key, pipeline in self._users.items():
+            self._drop_slot(key, pipeline)
+        self._users.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _process(self, key: Hashable, pipeline: _UserPipeline):
+        await asyncio.sleep(self.debounce)
+        items = list(pipeline.items)  # Новое сообщение отменит этот запуск, так что список уже не изменится
+        await self._acquire(key, pipeline, items)
+        try:
+            self.stats["runs"] += 1
+            await self.run(key, items)
+            self.stats["completed"] += 1
+        except asyncio.CancelledError:
+            raise  # Входы остаются в pipeline.items для следующего запуска
+        except Exception as e:
+            self.stats["failed"] += 1
+            logger.exception(f"❌ Обработка сообщений пользователя {key} не удалась: {e}")
+        finally:
+            self._release()
+            if self._users.get(key) is pipeline and pipeline.task is asyncio.current_task():
+                del self._users[key]
+        self.stats["merged"] += len(items) - 1  # Только завершённые запуски: отменённый передаёт входы следующему
+
+    async def _acquire(self, key: Hashable, pipeline: _UserPipeline, items: list):
+        future = pipeline.slot
+        if future is None:
+            if self._running < self.concurrency and not self._waiting:
+                self._running += 1
+                return
+            future = pipeline.slot = asyncio.get_running_loop().create_future()
+            self._waiting[key] = future
+            self.stats["queued"] += 1
+        try:
+            if not future.done():
+                position = self.position(key)
+                if position != pipeline.position:
+                    pipeline.position = position
+                    if self.on_queued is not None:
+                        try:
+                            await self.on_queued(key, items, position)
+                        except Exception as e:
+                            logger.warning(f"Не удалось сообщить место в очереди пользователю {key}: {e}")
+                await asyncio.shield(future)  # Отмена запуска не должна отменять место в очереди
+        except asyncio.CancelledError:
+            if self._users.get(key) is not pipeline or pipeline.task is asyncio.current_task():
+                self._drop_slot(key, pipeline)
+            # Иначе запуск заменён новым сообщением: место (или уже выданный слот) ждёт следующий запуск
+            raise
+        pipeline.slot = pipeline.position = None
+
+    def _drop_slot(self, key: Hashable, pipeline: _UserPipeline):
+        """Снимает пользователя с очереди; выданный, но не занятый слот отдаёт следующему."""
+        future, pipeline.slot = pipeline.slot, None
+        if future is None:
+            return
+        if future.done():
+            self._release()
+        else:
+            future.cancel()
+            if self._waiting.get(key) is future:
+                del self._waiting[key]
+
+    def _release(self):
+        """Передаёт слот первому ожидающему или освобождает его."""
+        while self._waiting:
+            _, future = self._waiting.popitem(last=False)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._running -= 1
+
+    def metrics(self) -> dict:
+        return {**self.stats, "running": self._running, "waiting": len(self._waiting), "users": len(self._users)}
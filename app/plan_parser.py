@@ -0,0 +1,108 @@
+import datetime
+import re
+from dataclasses import dataclass, field
+from zoneinfo import ZoneInfo
+
+MOSCOW = ZoneInfo("Europe/Moscow")
+PLAN_MARKER = "📅 Дневной план"
+SUMMARY_MARKER = "🔄 Итоги дня"
+
+MONTHS = {
+    "января": 1, "февраля": 2, "марта": 3, "апреля": 4, "мая": 5, "июня": 6,
+    "июля": 7, "августа": 8, "сентября": 9, "октября": 10, "ноября": 11, "декабря": 12,
+}
+
+# «24 марта 2024 г.», «24-ое марта 2024 года», «1-го мая 2025»
+RUSSIAN_DATE = re.compile(r"(\d{1,2})(?:-?[а-я]{1,3})?\s+(" + "|".join(MONTHS) + r")\s+(\d{4})", re.IGNORECASE)
+ISO_DATE = re.compile(r"(\d{4})-(\d{2})-(\d{2})")
+DOTTED_DATE = re.compile(r"(\d{1,2})\.(\d{1,2})\.(\d{4})")
+RELATIVE_DAYS = (("послезавтра", 2), ("завтра", 1), ("сегодня", 0))
+TASK_LINE = re.compile(r"^\s*[-*]\s*\[[ xх]?\]", re.MULTILINE)
+
+
+class PlanParseError(ValueError):
+    """Ответ модели не удалось разобрать на дату и план даже после исправлений."""
+
+
+@dataclass
+class ParsedPlan:
+    plan_date: str  # ISO, YYYY-MM-DD
+    body: str  # Начинается с «📅 Дневной план»
+    repairs: list[str] = field(default_factory=list)  # Что пришлось исправить локально
+
+
+def parse_date(text: str, today: datetime.date | None = None) -> datetime.date | None:
+    """Первая дата в тексте: русская запись, ISO, дд.мм.гггг или «сегодня/завтра/послезавтра»."""
+    candidates = []
+    for pattern, order in ((RUSSIAN_DATE, "dmy"), (ISO_DATE, "ymd"), (DOTTED_DATE, "dmy")):
+        match = pattern.search(text)
+        if match:
+            candidates.append((match.start(), match, order))
+    for _, match, order in sorted(candidates, key=lambda candidate: candidate[0]):
+        if order == "ymd":
+            year, month, day = (int(part) for part in match.groups())
+        else:
+            day, month, year = match.groups()
+            day, year = int(day), int(year)
+            month = MONTHS[month.lower()] if not month.isdigit() else int(month)
+        try:
+            return datetime.date(year, month, day)
+        except ValueError:
+            continue
+
+    lowered = text.lower()
+    for word, offset in RELATIVE_DAYS:
+        if word in lowered:
+            return (today or datetime.datetime.now(MOSCOW).date()) + datetime.timedelta(days=offset)
+    return None
+
+
+def parse_plan_response(raw: str, today: datetime.date | None = None) -> ParsedPlan:
+    """
+    Разбор ответа вида «{{дата}}//📅 Дневной план ...» за один проход с локальным исправлением:
+    снимает обёртку ``` , ищет «//» только до начала плана (в задачах могут быть ссылки),
+    берёт дату из заголовка, строки «📅 Дневной план на ...» или относительных слов,
+    восстанавливает маркер плана и отрезает текст после «🔄 Итоги дня».
+    """
+    today = today or datetime.datetime.now(MOSCOW).date()
+    repairs = []
+    text = raw.strip()
+    if text.startswith("```"):
+        text = text.strip("`").removeprefix("markdown").removeprefix("text").strip()
+        repairs.append("code_fence")
+
+    marker = text.find(PLAN_MARKER)
+    first_task = TASK_LINE.search(text)
+    body_start = marker if marker != -1 else (first_task.start() if first_task else -1)
+    if body_start == -1:
+        raise PlanParseError(f"В ответе нет плана: {raw[:100]!r}")
+
+    separator = text.rfind("//", 0, body_start)
+    if separator != -1:
+        header = text[:separator]
+    else:
+        header = text[:body_start]
+        repairs.append("missing_separator")
+
+    body = text[body_start:].strip()
+    if marker == -1:
+        body = f"{PLAN_MARKER}\n{body}"
+        repairs.append("missing_marker")
+
+    summary = body.find(SUMMARY_MARKER)
+    if summary != -1:
+        tail = body[summary + len(SUMMARY_MARKER):]
+        if tail.strip():
+            body = body[:summary + len(SUMMARY_MARKER)]
+            repairs.append("trailing_text")
+
+    plan_date = parse_date(header.replace("{", "").replace("}", ""), today)
+    if plan_date is None:
+        first_line = body.split("\n", 1)[0]
+        plan_date = parse_date(first_line, today)
+        repairs.append("date_from_title" if plan_date else "date_defaulted_to_today")
+        plan_date = plan_date or today
+
+    if not TASK_LINE.search(body):
+        raise PlanParseError(f"В плане нет ни одной задачи: {raw[:100]!r}")
+    return ParsedPlan(plan_date.isoformat(), body, repairs)
@@ -0,0 +1,87 @@
+import datetime
+import logging
+import os
+from zoneinfo import ZoneInfo
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PROMT_PATH = os.getenv("PROMT_PATH")
+MOSCOW = ZoneInfo("Europe/Moscow")
+
+logger = logging.getLogger(__name__)
+
+
+def generate_week_dates(now: datetime.datetime | None = None) -> dict:
+    """Создает словарь с датами на неделю вперёд."""
+    now = now or datetime.datetime.now(MOSCOW)
+    week_dates = {}
+    for i in range(7):
+        future_date = now + datetime.timedelta(days=i)
+        week_dates[future_date.strftime("%A")] = {
+            "day": future_date.strftime("%d"),
+            "month": future_date.strftime("%B"),
+            "year": future_date.strftime("%Y"),
+        }
+    return week_dates
+
+
+class PromptManager:
+    """
+    Системный промт для обоих провайдеров.
+    Статическая часть (файл PROMT_PATH) читается один раз и перечитывается только при смене mtime;
+    блок с датами на неделю пересчитывается раз в московские сутки.
+    Статическая часть всегда идёт первой и не меняется между запросами — так её кэширует провайдер.
+    """
+
+    def __init__(self, path: str | None = PROMT_PATH):
+        self.path = path
+        self._prompt = ""
+        self._mtime: float | None = None
+        self._day: datetime.date | None = None
+        self._week_block = ""
+        self.reloads = 0
+
+    def static_prompt(self) -> str:
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return "Ошибка: файл с промтом не найден."
+        except Exception as e:
+            return f"Ошибка при чтении файла: {str(e)}"
+
+        if mtime != self._mtime:
+            with open(self.path, "r", encoding="utf-8") as file:
+                self._prompt = file.read()
+            self._mtime = mtime
+            self.reloads += 1
+            logger.info(f"📄 Промт загружен из {self.path}")
+        return self._prompt
+
+    def dynamic_prompt(self, now: datetime.datetime | None = None) -> str:
+        """Текущие дата и время (меняются каждую минуту) и даты на неделю (раз в сутки)."""
+        now = now or datetime.datetime.now(MOSCOW)
+        if now.date() != self._day:
+            self._week_block = f"Даты на неделю: {generate_week_dates(now)}"
+            self._day = now.date()
+        formatted_date = now.strftime("%A, %d-%ое %B %Y, %H:%M по Москве")
+        return f"Сегодня {formatted_date}\n{self._week_block}"
+
+    def openai_messages(self, text: str) -> list[dict]:
+        """Статический промт первым сообщением, чтобы префикс запроса совпадал между вызовами."""
+        return [
+            {"role": "system", "content": self.static_prompt()},
+            {"role": "system", "content": self.dynamic_prompt()},
+            {"role": "user", "content": text},
+        ]
+
+    def anthropic_system(self) -> list[dict]:
+        """Системные блоки Anthropic: статический помечен cache_control, динамический идёт после него."""
+        return [
+            {"type": "text", "text": self.static_prompt(), "cache_control": {"type": "ephemeral"}},
+            {"type": "text", "text": self.dynamic_prompt()},
+        ]
+
+
+prompts = PromptManager()
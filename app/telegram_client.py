@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import os
+
+import aiohttp
+from dotenv import load_dotenv
+
+load_dotenv()
+
+TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+
+# Лимиты Telegram: не чаще ~1 сообщения в секунду в один чат и ~30 в секунду на бота
+PER_CHAT_INTERVAL = 1.0
+GLOBAL_INTERVAL = 1 / 30
+MAX_RETRIES = 3
+REQUEST_TIMEOUT = 5
+
+logger = logging.getLogger(__name__)
+
+
+class TelegramClient:
+    """
+    Асинхронный клиент Telegram Bot API с общим keep-alive пулом соединений.
+    Повторные правки одного и того же сообщения склеиваются: уходит только последний текст.
+    """
+
+    def __init__(self, token: str = TELEGRAM_BOT_TOKEN, base_url: str = TELEGRAM_API_URL,
+                 per_chat_interval: float = PER_CHAT_INTERVAL, global_interval: float = GLOBAL_INTERVAL):
+        self.token = token
+        self.base_url = base_url.rstrip("/")
+        self.per_chat_interval = per_chat_interval
+        self.global_interval = global_interval
+        self._session: aiohttp.ClientSession | None = None
+        self._chat_next: dict[int, float] = {}
+        self._global_next = 0.0
+        self._pending_edits: dict[tuple[int, int], tuple[str, list[asyncio.Future]]] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    async def start(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=100, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+            )
+
+    async def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def edit_message_text(self, chat_id: int, message_id: int, text: str) -> asyncio.Future:
+        """
+        Ставит правку сообщения в очередь и возвращает future с результатом (True/False).
+        Результат можно не ждать: правка отправится в фоне с учётом лимитов.
+        """
+        future = asyncio.get_running_loop().create_future()
+        key = (chat_id, message_id)
+        if key in self._pending_edits:
+            _, waiters = self._pending_edits[key]
+            self._pending_edits[key] = (text, waiters + [future])
+            return future
+
+        self._pending_edits[key] = (text, [future])
+        task = asyncio.create_task(self._flush_edit(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return future
+
+    async def _flush_edit(self, key: tuple[int, int]):
+        chat_id, message_id = key
+        try:
+            await self._throttle(chat_id)
+        finally:
+            # Пока ждали слот, текст мог обновиться — берём последний
+            text, waiters = self._pending_edits.pop(key)
+
+        try:
+            result = await self.call("editMessageText", chat_id=chat_id, message_id=message_id, text=text)
+            ok = bool(result.get("ok"))
+            if not ok:
+                logger.error(f"❌ Ошибка при обновлении сообщения {message_id}: {result}")
+        except Exception as e:
+            logger.error(f"Ошибка при запросе к Telegram API: {e}")
+            ok = False
+
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(ok)
+
+    async def _throttle(self, chat_id: int):
+        """Резервирует ближайший слот отправки с учётом лимита чата и общего лимита бота."""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        slot = max(now, self._chat_next.get(chat_id, 0.0), self._global_next)
+        self._chat_next[chat_id] = slot + self.per_chat_interval
+        self._global_next = slot + self.global_interval
+
+        if len(self._chat_next) > 10_000:  # Чистим давно неактивные чаты
+            self._chat_next = {chat: ts for chat, ts in self._chat_next.items() if ts > now}
+
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def call(self, method: str, **params) -> dict:
+        """Вызов метода Bot API с повтором после 429 по retry_after."""
+        await self.start()
+        url = f"{self.base_url}/bot{self.token}/{method}"
+        for attempt in range(MAX_RETRIES + 1):
+            async with self._session.post(url, json=params) as response:
+                result = await response.json(content_type=None)
+            if response.status != 429 or attempt == MAX_RETRIES:
+                return result
+            retry_after = result.get("parameters", {}).get("retry_after", 1)
+            logger.warning(f"⚠️ Telegram 429 для {method}, повтор через {retry_after} с")
+            await asyncio.sleep(retry_after)
+        return result
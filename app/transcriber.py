@@ -1,35 +1,380 @@
-import os
-import torch
 import asyncio
-from faster_whisper import WhisperModel
+import io
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Callable
+
+from metrics import registry
+from transcription_cache import audio_file_key, audio_key, cache
+
+# Процессы-воркеры, у каждого своя модель; потоки делим между ними (лучше 14-20 всего для Xeon E5-2690 v4)
+TRANSCRIBE_WORKERS = int(os.getenv("TRANSCRIBE_WORKERS", "1"))
+TRANSCRIBE_THREADS = int(os.getenv("TRANSCRIBE_THREADS", str(max(1, min(os.cpu_count(), 20) // TRANSCRIBE_WORKERS))))
+TRANSCRIBE_QUEUE_SIZE = int(os.getenv("TRANSCRIBE_QUEUE_SIZE", "50"))
+WHISPER_MODEL_SIZE = os.getenv("WHISPER_MODEL_SIZE", "medium")  # Оптимальный баланс точности и скорости
+TRANSCRIBE_RESTART_BACKOFF = float(os.getenv("TRANSCRIBE_RESTART_BACKOFF", "1"))  # Первая пауза перед перезапуском, дальше ×2
+TRANSCRIBE_RESTART_BACKOFF_MAX = float(os.getenv("TRANSCRIBE_RESTART_BACKOFF_MAX", "60"))
+TRANSCRIBE_MAX_RESTARTS = int(os.getenv("TRANSCRIBE_MAX_RESTARTS", "5"))  # Падений подряд без "ready", после — отказ
+TRANSCRIBE_RETRY_AFTER = float(os.getenv("TRANSCRIBE_RETRY_AFTER", "300"))  # Через сколько секунд пробовать пул снова
+
+logger = logging.getLogger(__name__)
+
+_model = None  # Модель воркера (у каждого процесса своя)
+
 
-# Устанавливаем оптимальное количество потоков (лучше 14-20 для Xeon E5-2690 v4)
-num_threads = min(os.cpu_count(), 20)
-torch.set_num_threads(num_threads)
+class TranscriptionQueueFull(Exception):
+    """Очередь транскрибации заполнена — новые задачи не принимаются."""
 
-_model = None  # Глобальная переменная для кеширования модели
 
+class TranscriptionUnavailable(Exception):
+    """Ни один воркер не смог запуститься (ошибка импорта, загрузки модели, нехватка памяти)."""
 
-def get_model():
+
+@dataclass
+class Transcription:
+    text: str
+    decode_s: float  # Декодирование ogg/opus в PCM
+    transcribe_s: float  # Работа модели
+    wait_s: float = 0.0  # Ожидание в очереди
+    cached: bool = False
+
+
+@dataclass
+class TranscriptSegment:
+    text: str
+    end: float  # Конец сегмента в секундах от начала записи
+    duration: float  # Длительность всей записи
+    avg_logprob: float  # Уверенность модели в сегменте
+
+
+def get_model(model_size: str = WHISPER_MODEL_SIZE, threads: int = TRANSCRIBE_THREADS):
     global _model
     if _model is None:
-        model_size = "medium"  # Оптимальный баланс точности и скорости
-        _model = WhisperModel(model_size, device="cpu", compute_type="int8")  # float16 быстрее int8
+        from faster_whisper import WhisperModel
+        _model = WhisperModel(model_size, device="cpu", compute_type="int8", cpu_threads=threads)  # float16 быстрее int8
     return _model
 
 
-def _transcribe_audio_sync(audio_path: str) -> str:
+def _transcribe_audio_sync(audio: str | bytes, on_segment: Callable[[TranscriptSegment], None] | None = None
+                           ) -> tuple[str, float, float]:
     """
     Оптимизированная транскрибация с уменьшенным beam_size.
+    Принимает путь к файлу или содержимое файла в памяти; возвращает (текст, время декодирования, время модели).
+    on_segment получает сегменты по мере того, как их выдаёт модель.
     """
+    from faster_whisper import decode_audio
+
     model = get_model()
-    segments, info = model.transcribe(audio_path, beam_size=2)  # Уменьшенный beam_size для скорости
-    transcription = " ".join(segment.text for segment in segments)
-    return transcription.strip()  # Убираем лишние пробелы
+    started = time.perf_counter()
+    samples = decode_audio(io.BytesIO(audio) if isinstance(audio, bytes) else audio, sampling_rate=16000)
+    decoded = time.perf_counter()
+    segments, info = model.transcribe(samples, beam_size=2)  # Уменьшенный beam_size для скорости
+    texts = []
+    for segment in segments:  # Генератор: модель декодирует следующий сегмент только по запросу
+        texts.append(segment.text)
+        if on_segment is not None:
+            on_segment(TranscriptSegment(segment.text, segment.end, info.duration, segment.avg_logprob))
+    transcription = " ".join(texts)
+    return transcription.strip(), decoded - started, time.perf_counter() - decoded  # Убираем лишние пробелы
+
+
+def _worker_main(conn, model_size: str, threads: int):
+    """
+    Цикл процесса-воркера: получает (job_id, audio, stream), отвечает (job_id, "done" | "error", результат).
+    При stream=True до результата приходят (job_id, "segment", TranscriptSegment).
+    """
+    import torch
+    torch.set_num_threads(threads)
+    get_model(model_size, threads)
+    conn.send((None, "ready", None))
+
+    while True:
+        job = conn.recv()
+        if job is None:
+            break
+        job_id, audio, stream = job
+        on_segment = (lambda segment: conn.send((job_id, "segment", segment))) if stream else None
+        try:
+            conn.send((job_id, "done", _transcribe_audio_sync(audio, on_segment)))
+        except Exception as e:
+            conn.send((job_id, "error", f"{type(e).__name__}: {e}"))
+
+
+@dataclass
+class TranscriptionJob:
+    id: int
+    user_id: str | None
+    audio: str | bytes
+    future: asyncio.Future
+    on_segment: Callable[[TranscriptSegment], None] | None = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+    started_at: float | None = None
+
+
+class TranscriptionWorker:
+    """Процесс с моделью и поток, который читает его ответы и передаёт их в цикл событий."""
+
+    def __init__(self, service: "TranscriptionService", index: int):
+        self.service = service
+        self.index = index
+        self.job: TranscriptionJob | None = None
+        self.ready = False
+        context = multiprocessing.get_context("spawn")
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main, args=(child_conn, service.model_size, service.threads),
+            name=f"transcriber-{index}", daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        threading.Thread(target=self._read, args=(asyncio.get_running_loop(),), daemon=True).start()
+
+    def _read(self, loop: asyncio.AbstractEventLoop):
+        while True:
+            try:
+                message = self.conn.recv()
+            except (EOFError, OSError):
+                loop.call_soon_threadsafe(self.service._on_worker_exit, self)
+                return
+            loop.call_soon_threadsafe(self.service._on_message, self, message)
+
+    def submit(self, job: TranscriptionJob):
+        self.job = job
+        self.conn.send((job.id, job.audio, job.on_segment is not None))
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+
 
+class TranscriptionService:
+    """
+    Пул процессов транскрибации с ограниченной очередью.
+    Задачи выбираются по кругу между пользователями, чтобы один пользователь не занимал все воркеры.
+    """
+
+    def __init__(self, workers: int = TRANSCRIBE_WORKERS, threads: int = TRANSCRIBE_THREADS,
+                 queue_size: int = TRANSCRIBE_QUEUE_SIZE, model_size: str = WHISPER_MODEL_SIZE):
+        self.workers_count = workers
+        self.threads = threads
+        self.queue_size = queue_size
+        self.model_size = model_size
+        self._workers: list[TranscriptionWorker] = []
+        self._queues: OrderedDict[str | None, deque[TranscriptionJob]] = OrderedDict()
+        self._queued = 0
+        self._ids = itertools.count(1)
+        self._started = False
+        self._ready: asyncio.Event | None = None  # Все воркеры загрузили модель (или пул отказался запускаться)
+        self._restarts: dict[int, int] = {}  # Падений подряд по слоту воркера, сбрасывается на "ready"
+        self._unavailable: str | None = None  # Причина отказа пула
+        self._unavailable_at = 0.0
+        self.stats = {"completed": 0, "failed": 0, "rejected": 0, "total_wait_s": 0.0, "max_wait_s": 0.0,
+                      "total_run_s": 0.0}
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queued
+
+    async def start(self):
+        if self._unavailable is not None and time.monotonic() - self._unavailable_at >= TRANSCRIBE_RETRY_AFTER:
+            await self.stop()  # Пробуем снова: причина могла быть временной (сеть при скачивании модели)
+        if self._started:
+            return
+        self._started = True
+        self._unavailable = None
+        self._restarts = {}
+        self._ready = asyncio.Event()
+        self._workers = [TranscriptionWorker(self, i) for i in range(self.workers_count)]
+        logger.info(f"🎙 Запущено воркеров транскрибации: {self.workers_count} × {self.threads} потоков")
+
+    async def warm_up(self):
+        """Запускает воркеры и ждёт, пока каждый загрузит модель."""
+        await self.start()
+        await self._ready.wait()
+        if self._unavailable is not None:
+            raise TranscriptionUnavailable(self._unavailable)
+
+    async def stop(self):
+        workers, self._workers = self._workers, []
+        self._started = False
+        await asyncio.gather(*(asyncio.to_thread(worker.stop) for worker in workers))
+
+    async def transcribe(self, audio: str | bytes, user_id: str | None = None,
+                         on_segment: Callable[[TranscriptSegment], None] | None = None) -> Transcription:
+        await self.start()
+        if self._unavailable is not None:
+            self.stats["rejected"] += 1
+            raise TranscriptionUnavailable(self._unavailable)
+        if self._queued >= self.queue_size:
+            self.stats["rejected"] += 1
+            raise TranscriptionQueueFull(f"В очереди уже {self._queued} задач")
+
+        job = TranscriptionJob(next(self._ids), user_id, audio, asyncio.get_running_loop().create_future(), on_segment)
+        self._queues.setdefault(user_id, deque()).append(job)
+        self._queued += 1
+        self._dispatch()
+        try:
+            return await job.future
+        except asyncio.CancelledError:
+            self._discard(job)
+            raise
+
+    def _discard(self, job: TranscriptionJob):
+        """Убирает отменённую задачу из очереди, если она ещё не ушла воркеру."""
+        queue = self._queues.get(job.user_id)
+        if queue is not None and job in queue:
+            queue.remove(job)
+            self._queued -= 1
+            if not queue:
+                del self._queues[job.user_id]
+
+    def _next_job(self) -> TranscriptionJob | None:
+        """Берёт задачу следующего по кругу пользователя."""
+        while self._queues:
+            user_id, queue = self._queues.popitem(last=False)
+            job = queue.popleft()
+            if queue:
+                self._queues[user_id] = queue  # В конец круга
+            self._queued -= 1
+            if not job.future.done():
+                return job
+        return None
+
+    def _dispatch(self):
+        for worker in self._workers:
+            if not worker.ready or worker.job is not None:
+                continue
+            job = self._next_job()
+            if job is None:
+                return
+            job.started_at = time.monotonic()
+            wait = job.started_at - job.enqueued_at
+            self.stats["total_wait_s"] += wait
+            self.stats["max_wait_s"] = max(self.stats["max_wait_s"], wait)
+            worker.submit(job)
+
+    def _on_message(self, worker: TranscriptionWorker, message: tuple):
+        job_id, kind, payload = message
+        if kind == "ready":
+            worker.ready = True
+            self._restarts.pop(worker.index, None)
+            if all(w.ready for w in self._workers):
+                self._ready.set()
+            self._dispatch()
+            return
+        if kind == "segment":
+            job = worker.job
+            if job is not None and job.id == job_id and job.on_segment is not None and not job.future.done():
+                try:
+                    job.on_segment(payload)
+                except Exception as e:
+                    logger.error(f"Ошибка в обработчике сегмента: {e}")
+            return
+
+        job, worker.job = worker.job, None
+        if job is not None and job.id == job_id:
+            self.stats["total_run_s"] += time.monotonic() - job.started_at
+            if kind == "done":
+                self.stats["completed"] += 1
+                if not job.future.done():
+                    job.future.set_result(Transcription(*payload, wait_s=job.started_at - job.enqueued_at))
+            else:
+                self.stats["failed"] += 1
+                if not job.future.done():
+                    job.future.set_exception(RuntimeError(payload))
+        self._dispatch()
 
-async def transcribe_audio(audio_path: str) -> str:
+    def _on_worker_exit(self, worker: TranscriptionWorker):
+        if worker not in self._workers:
+            return  # Штатная остановка
+        worker.ready = False
+        if worker.job is not None and not worker.job.future.done():
+            self.stats["failed"] += 1
+            worker.job.future.set_exception(RuntimeError("Воркер транскрибации завершился аварийно"))
+        worker.job = None
+
+        failures = self._restarts[worker.index] = self._restarts.get(worker.index, 0) + 1
+        if failures > TRANSCRIBE_MAX_RESTARTS:
+            logger.error(f"❌ Воркер транскрибации {worker.index} упал после {failures - 1} перезапусков подряд, слот отключён")
+            self._workers.remove(worker)
+            if not self._workers:
+                self._give_up("ни один воркер транскрибации не запускается, подробности в логе воркеров")
+            elif all(w.ready for w in self._workers):
+                self._ready.set()
+            return
+
+        delay = min(TRANSCRIBE_RESTART_BACKOFF * 2 ** (failures - 1), TRANSCRIBE_RESTART_BACKOFF_MAX)
+        logger.error(f"❌ Воркер транскрибации {worker.index} завершился, перезапуск через {delay:.1f}s")
+        asyncio.get_running_loop().call_later(delay, self._respawn, worker)
+
+    def _respawn(self, worker: TranscriptionWorker):
+        if worker in self._workers:  # Пул не остановлен и слот не отключён за время паузы
+            self._workers[self._workers.index(worker)] = TranscriptionWorker(self, worker.index)
+
+    def _give_up(self, reason: str):
+        """Ни одного живого воркера: задачи в очереди и прогрев получают ошибку вместо вечного ожидания."""
+        self._unavailable = reason
+        self._unavailable_at = time.monotonic()
+        logger.error(f"❌ Транскрибация недоступна: {reason}")
+        while (job := self._next_job()) is not None:
+            self.stats["failed"] += 1
+            job.future.set_exception(TranscriptionUnavailable(reason))
+        self._ready.set()
+
+    def metrics(self) -> dict:
+        started = self.stats["completed"] + self.stats["failed"]
+        return {
+            **self.stats,
+            "queue_depth": self._queued,
+            "busy_workers": sum(1 for worker in self._workers if worker.job is not None),
+            "avg_wait_s": round(self.stats["total_wait_s"] / started, 3) if started else 0,
+        }
+
+
+service = TranscriptionService()
+
+STAGE_SECONDS = {stage: registry.histogram("transcription_stage_seconds", "Этапы транскрибации голосового",
+                                           {"stage": stage}) for stage in ("queue", "decode", "transcribe")}
+
+
+@registry.collector
+def _collect_service():
+    metrics = service.metrics()
+    for result in ("completed", "failed", "rejected"):
+        yield "transcription_jobs_total", "counter", "Задачи транскрибации", {"result": result}, metrics[result]
+    yield "transcription_queue_depth", "gauge", "Задачи в очереди транскрибации", {}, metrics["queue_depth"]
+    yield "transcription_busy_workers", "gauge", "Занятые воркеры транскрибации", {}, metrics["busy_workers"]
+
+
+async def transcribe_audio(audio: str | bytes, user_id: str | None = None, cache_keys: tuple[str, ...] = (),
+                           on_segment: Callable[[TranscriptSegment], None] | None = None) -> Transcription:
     """
-    Асинхронная обёртка для транскрибации аудио.
+    Асинхронная транскрибация аудио (путь к файлу или байты) в пуле воркеров.
+    on_segment вызывается в цикле событий для каждого готового сегмента (кроме попаданий в кэш).
+    Сначала ищем готовый текст в кэше по хэшу содержимого — при попадании пул и модель не запускаются.
+    Результат сохраняется под хэшем и дополнительными ключами cache_keys (например, file_unique_id).
     """
-    return await asyncio.to_thread(_transcribe_audio_sync, audio_path)
+    # Крупные голосовые лежат во временном файле как раз чтобы не держать их в памяти: хэшируем кусками
+    key = audio_key(audio) if isinstance(audio, bytes) else await asyncio.to_thread(audio_file_key, audio)
+    text = await cache.get(key)
+    if text is not None:
+        await cache.put(text, *cache_keys)
+        return Transcription(text, 0.0, 0.0, cached=True)
+
+    result = await service.transcribe(audio, user_id, on_segment)
+    STAGE_SECONDS["queue"].observe(result.wait_s)
+    STAGE_SECONDS["decode"].observe(result.decode_s)
+    STAGE_SECONDS["transcribe"].observe(result.transcribe_s)
+    await cache.put(result.text, key, *cache_keys)
+    return result
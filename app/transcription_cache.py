@@ -0,0 +1,119 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+
+import aiosqlite
+
+import database
+from metrics import registry
+
+# Хранится рядом с messages.db, но в отдельном файле: кэш можно удалить без потери сообщений
+TRANSCRIPTION_CACHE_PATH = os.getenv("TRANSCRIPTION_CACHE_PATH")
+TRANSCRIPTION_CACHE_MAX_BYTES = int(os.getenv("TRANSCRIPTION_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+logger = logging.getLogger(__name__)
+
+
+def audio_key(audio: bytes) -> str:
+    return "sha256:" + hashlib.sha256(audio).hexdigest()
+
+
+def audio_file_key(path: str) -> str:
+    """Тот же ключ, что audio_key, но файл хэшируется кусками, не читаясь в память целиком."""
+    with open(path, "rb") as file:
+        return "sha256:" + hashlib.file_digest(file, "sha256").hexdigest()
+
+
+def file_key(file_unique_id: str) -> str:
+    return "file:" + file_unique_id
+
+
+class TranscriptionCache:
+    """
+    Кэш готовых транскрипций в SQLite. Ключ — file_unique_id из Telegram (известен до скачивания),
+    запасной ключ — sha256 содержимого (пересланные и повторно загруженные голосовые).
+    При превышении max_bytes вытесняются давно не использованные записи.
+    """
+
+    def __init__(self, path: str | None = None, max_bytes: int = TRANSCRIPTION_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evicted": 0}
+        self._db: aiosqlite.Connection | None = None
+        self._lock = asyncio.Lock()
+
+    async def _connection(self) -> aiosqlite.Connection:
+        async with self._lock:
+            if self._db is None:
+                path = self.path or TRANSCRIPTION_CACHE_PATH or os.path.join(
+                    os.path.dirname(database.DATABASE_PATH), "transcriptions.db")
+                db = await database.connect_db(path)
+                await db.execute("""
+                    CREATE TABLE IF NOT EXISTS transcriptions (
+                        key TEXT PRIMARY KEY,
+                        text TEXT NOT NULL,
+                        size INTEGER NOT NULL,
+                        last_used_at REAL NOT NULL
+                    )
+                """)
+                await db.execute("CREATE INDEX IF NOT EXISTS idx_transcriptions_lru ON transcriptions(last_used_at)")
+                await db.commit()
+                self._db = db
+            return self._db
+
+    async def open(self):
+        await self._connection()
+
+    async def close(self):
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+    async def get(self, *keys: str) -> str | None:
+        """Возвращает текст по первому найденному ключу и отмечает запись как свежую."""
+        db = await self._connection()
+        for key in keys:
+            async with db.execute("SELECT text FROM transcriptions WHERE key = ?", (key,)) as cursor:
+                row = await cursor.fetchone()
+            if row is not None:
+                await db.execute("UPDATE transcriptions SET last_used_at = ? WHERE key = ?", (time.time(), key))
+                await db.commit()
+                self.stats["hits"] += 1
+                return row[0]
+        self.stats["misses"] += 1
+        return None
+
+    async def put(self, text: str, *keys: str):
+        """Сохраняет текст под всеми ключами и вытесняет старые записи сверх лимита."""
+        if not keys:
+            return
+        db = await self._connection()
+        now = time.time()
+        size = len(text.encode())
+        await db.executemany(
+            "INSERT OR REPLACE INTO transcriptions (key, text, size, last_used_at) VALUES (?, ?, ?, ?)",
+            [(key, text, size, now) for key in keys]
+        )
+        cursor = await db.execute("""
+            DELETE FROM transcriptions WHERE key IN (
+                SELECT key FROM (
+                    SELECT key, SUM(size) OVER (ORDER BY last_used_at DESC, key) AS total FROM transcriptions
+                ) WHERE total > ?
+            )
+        """, (self.max_bytes,))
+        await db.commit()
+        self.stats["stores"] += 1
+        if cursor.rowcount > 0:
+            self.stats["evicted"] += cursor.rowcount
+            logger.info(f"🧹 Из кэша транскрипций вытеснено записей: {cursor.rowcount}")
+
+
+cache = TranscriptionCache()
+
+
+@registry.collector
+def _collect_cache():
+    for event, value in cache.stats.items():
+        yield "transcription_cache_events_total", "counter", "Кэш транскрипций", {"event": event}, value
@@ -0,0 +1,71 @@
+"""
+10k сообщений в ожидании ACK: число задач asyncio и память планировщика.
+
+Половина сообщений подтверждается сразу, остальные переотправляются с отсрочкой
+до MAX_ATTEMPTS раз. Раньше на каждое сообщение заводилась своя задача asyncio.
+Скрипт падает (AssertionError), если переотправок не столько, сколько ожидается, задач asyncio
+больше MAX_TASKS или память растёт больше чем на MAX_BYTES_PER_MESSAGE на сообщение.
+
+Запуск: python bench/ack_scheduler.py [messages]
+"""
+import asyncio
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+from delivery import AckScheduler  # noqa: E402
+
+MAX_ATTEMPTS = 3
+MAX_TASKS = 4  # main, цикл планировщика и служебные — не зависит от числа сообщений
+MAX_BYTES_PER_MESSAGE = 1024
+
+
+async def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    resends = 0
+    peak_tasks = 0
+
+    async def on_timeout(key, attempt):
+        nonlocal resends
+        if attempt < MAX_ATTEMPTS:
+            resends += 1
+            scheduler.schedule(key, attempt + 1)
+
+    scheduler = AckScheduler(on_timeout, base_timeout=0.05, max_backoff=1)
+    scheduler.start()
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    for i in range(total):
+        scheduler.schedule(("user", i), 1)
+    for i in range(0, total, 2):
+        scheduler.cancel(("user", i))
+
+    while len(scheduler):
+        peak_tasks = max(peak_tasks, len(asyncio.all_tasks()))
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    await scheduler.stop()
+
+    expected_resends = (total // 2) * (MAX_ATTEMPTS - 1)
+    print(json.dumps({
+        "messages": total,
+        "resends": resends,
+        "expected_resends": expected_resends,
+        "peak_asyncio_tasks": peak_tasks,
+        "peak_traced_memory_kb": round(peak_memory / 1024, 1),
+        "elapsed_s": round(elapsed, 3),
+    }, indent=2))
+
+    assert resends == expected_resends, f"переотправок {resends}, ожидалось {expected_resends}"
+    assert peak_tasks <= MAX_TASKS, f"пик задач asyncio {peak_tasks} — похоже, снова задача на сообщение"
+    assert peak_memory <= total * MAX_BYTES_PER_MESSAGE, f"память {peak_memory} байт на {total} сообщений"
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,95 @@
+"""
+Запросов в секунду от бота к API в двух режимах:
+
+"per_request_session" — новая aiohttp.ClientSession на каждый запрос, план в query (как раньше);
+"shared_session_json" — общая keep-alive сессия, план JSON-телом в POST /messages/json.
+
+Запуск: python bench/bot_to_api.py [requests] [concurrency]
+"""
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import aiohttp
+import uvicorn
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+import database  # noqa: E402
+import api  # noqa: E402
+
+logging.disable(logging.INFO)
+
+PORT = 8765
+URL = f"http://127.0.0.1:{PORT}"
+PLAN = "📅 Дневной план\n" + "- [ ] Задача\n" * 40
+
+
+def build_payload(i: int) -> dict:
+    return {
+        "telegram_user_id": str(i % 100),
+        "text": PLAN,
+        "model_text": PLAN,
+        "plan_date": "24 марта 2024 г.",
+        "progress_message_id": i,
+        "chat_id": i,
+    }
+
+
+async def per_request_session(i: int):
+    async with aiohttp.ClientSession() as session:
+        async with session.post(f"{URL}/messages", params=build_payload(i)) as response:
+            await response.json()
+
+
+async def run_mode(name: str, total: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency, keepalive_timeout=60))
+
+    async def shared_session_json(i: int):
+        async with session.post(f"{URL}/messages/json", json=build_payload(i)) as response:
+            await response.json()
+
+    send = per_request_session if name == "per_request_session" else shared_session_json
+
+    async def guarded(i: int):
+        async with semaphore:
+            await send(i)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(guarded(i) for i in range(total)))
+    elapsed = time.perf_counter() - started
+    await session.close()
+    return {"mode": name, "requests": total, "requests_per_s": round(total / elapsed, 1)}
+
+
+async def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    database.DATABASE_PATH = os.path.join(tempfile.mkdtemp(), "messages.db")
+    await database.init_db()
+
+    server = uvicorn.Server(uvicorn.Config(api.app, host="127.0.0.1", port=PORT, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    try:
+        results = [
+            await run_mode("per_request_session", total, concurrency),
+            await run_mode("shared_session_json", total, concurrency),
+        ]
+    finally:
+        server.should_exit = True
+        await server_task
+
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,65 @@
+"""
+Попадание в кэш транскрипций не запускает пул воркеров и не загружает модель.
+
+Заполняет TranscriptionCache готовым текстом по хэшу содержимого, затем вызывает transcribe_audio
+с тем же голосовым в памяти и во временном файле (крупные голосовые). Проверяется, что текст взят
+из кэша, service._started остался False (ни одного процесса с моделью), stats["hits"] вырос
+на число вызовов, а текст сохранён и под file_unique_id. Плюс задержка попадания — для сравнения
+с секундами загрузки модели. Любое нарушение — AssertionError; faster-whisper для прогона не нужен.
+
+Запуск: python bench/cache_hit.py [calls]
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+import database  # noqa: E402
+from transcriber import service, transcribe_audio  # noqa: E402
+from transcription_cache import audio_key, cache, file_key  # noqa: E402
+
+TEXT = "Утром отправить отчёт руководителю и зайти в аптеку"
+
+
+async def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    directory = tempfile.mkdtemp(prefix="cache_hit_")
+    database.DATABASE_PATH = os.path.join(directory, "messages.db")
+    cache.path = os.path.join(directory, "transcriptions.db")
+
+    audio = os.urandom(256 * 1024)
+    audio_path = os.path.join(directory, "voice.ogg")
+    Path(audio_path).write_bytes(audio)
+    await cache.put(TEXT, audio_key(audio))
+    hits_before = cache.stats["hits"]
+
+    latencies = {"bytes": [], "file": []}
+    for i in range(calls):
+        for kind, source in (("bytes", audio), ("file", audio_path)):
+            started = time.perf_counter()
+            result = await transcribe_audio(source, user_id="bench", cache_keys=(file_key(f"{kind}-{i}"),))
+            latencies[kind].append(time.perf_counter() - started)
+            assert result.cached and result.text == TEXT, result
+
+    hits = cache.stats["hits"] - hits_before
+    stored_by_file_id = await cache.get(file_key(f"file-{calls - 1}"))
+    await cache.close()
+
+    report = {"calls": 2 * calls, "cache_hits": hits, "pool_started": service._started,
+              "worker_processes": len(service._workers), **{
+                  f"{kind}_hit_ms": {"p50": round(sorted(values)[len(values) // 2] * 1000, 3),
+                                     "max": round(max(values) * 1000, 3)} for kind, values in latencies.items()}}
+    print(json.dumps(report, indent=2))
+
+    assert not service._started, "попадание в кэш запустило пул транскрибации"
+    assert not service._workers, "запущены процессы с моделью"
+    assert hits == 2 * calls, f"попаданий {hits} из {2 * calls}"
+    assert stored_by_file_id == TEXT, "текст не сохранён под file_unique_id"
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,158 @@
+"""
+Чтение непрочитанных при большом messages.db до и после обслуживания (архивация + incremental_vacuum).
+
+База заполняется rows строками (по умолчанию 1M): USERS пользователей, у каждого несколько свежих
+непрочитанных, остальные обработаны и старше ARCHIVE_AFTER. Замеряются fetch_unread_messages и досылка
+новому устройству (iter_backlog) на случайных пользователях — с холодным кэшем страниц SQLite (новый пул)
+и с прогретым; затем Maintenance.run_once() под постоянной записью через групповой коммит —
+задержка insert_message во время обслуживания показывает, насколько оно мешает писателям.
+
+Запуск: python bench/db_maintenance.py [rows]
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+import database  # noqa: E402
+from maintenance import Maintenance  # noqa: E402
+
+logging.disable(logging.WARNING)
+
+USERS = 1000
+UNREAD_PER_USER = 5
+RECENT_SHARE = 0.1  # Обработанные, но свежее ARCHIVE_AFTER — остаются в рабочей таблице
+ARCHIVE_AFTER = 30 * 86400
+FETCHES = 2000
+TEXT = "Утром отправить отчёт руководителю и зайти в аптеку, после обеда позвонить маме. " * 3
+MODEL_TEXT = "📅 Дневной план\n" + "- [ ] Задача на день с описанием\n" * 12
+
+
+def fill(path: str, rows: int):
+    """Синхронная массовая вставка: старые обработанные, свежие обработанные, свежие непрочитанные."""
+    unread = USERS * UNREAD_PER_USER
+    recent = int((rows - unread) * RECENT_SHARE)
+    old = rows - unread - recent
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA synchronous=OFF")
+
+    def generate():
+        for index in range(rows):
+            if index < old:
+                age_days, processed = 90 - 59 * index / old, 1  # От 90 до 31 дня назад
+            elif index < old + recent:
+                age_days, processed = 29 * (1 - (index - old) / recent) + 1, 1
+            else:
+                age_days, processed = 0.5, 0
+            yield (index % USERS, TEXT, MODEL_TEXT, index % USERS, index, "2024-03-24", processed,
+                   f"-{age_days * 86400:.0f} seconds")
+
+    db.executemany("""
+        INSERT INTO messages (user_id, text, model_text, chat_id, progress_message_id, plan_date, processed, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, datetime('now', ?))
+    """, generate())
+    db.commit()
+    db.close()
+
+
+def percentiles(values: list[float]) -> dict:
+    values = sorted(values)
+    return {"p50_ms": round(values[len(values) // 2] * 1000, 3),
+            "p95_ms": round(values[int(len(values) * 0.95)] * 1000, 3),
+            "p99_ms": round(values[int(len(values) * 0.99)] * 1000, 3),
+            "max_ms": round(values[-1] * 1000, 3)}
+
+
+async def measure_reads() -> dict:
+    """Холодный кэш страниц (новый пул) на первом проходе, прогретый — на втором."""
+    await database.close_pool()
+    await database.open_pool()
+    result = {}
+    random.seed(1)
+    for phase in ("cold", "warm"):
+        users = [str(random.randrange(USERS)) for _ in range(FETCHES)]
+        unread, backlog = [], []
+        for user in users:
+            started = time.perf_counter()
+            messages = await database.fetch_unread_messages(user)
+            unread.append(time.perf_counter() - started)
+            assert len(messages) == UNREAD_PER_USER, len(messages)
+            started = time.perf_counter()
+            async for _ in database.iter_backlog(user):
+                pass
+            backlog.append(time.perf_counter() - started)
+        result[phase] = {"fetch_unread": percentiles(unread), "backlog_new_device": percentiles(backlog)}
+    return result
+
+
+async def write_load(stop: asyncio.Event, latencies: list[float]):
+    """Поток вставок ~500 в секунду через групповой коммит."""
+    index = 0
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.gather(*(database.insert_message(str(USERS + index + i), "план", "план", 0, 0, "2024-03-24")
+                               for i in range(10)))
+        latencies.append(time.perf_counter() - started)
+        index += 10
+        await asyncio.sleep(0.02)
+
+
+async def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    database.DATABASE_PATH = os.path.join(tempfile.mkdtemp(), "messages.db")
+    await database.init_db()
+
+    started = time.perf_counter()
+    fill(database.DATABASE_PATH, rows)
+    fill_s = time.perf_counter() - started
+
+    await database.open_pool()
+    await database.start_batcher()
+    before = await database.table_sizes()
+    reads_before = await measure_reads()
+
+    baseline_writes: list[float] = []
+    stop = asyncio.Event()
+    writer = asyncio.create_task(write_load(stop, baseline_writes))
+    await asyncio.sleep(3)
+    stop.set()
+    await writer
+
+    writes: list[float] = []
+    stop = asyncio.Event()
+    writer = asyncio.create_task(write_load(stop, writes))
+    report = await Maintenance(archive_after=ARCHIVE_AFTER).run_once()
+    stop.set()
+    await writer
+
+    after = await database.table_sizes()
+    reads_after = await measure_reads()
+    await database.stop_batcher()
+    await database.close_pool()
+
+    def summary(sizes: dict) -> dict:
+        objects = sizes["objects"] or {}
+        return {"file_mb": round(sizes["file_bytes"] / 2 ** 20, 1), "free_pages": sizes["freelist_count"],
+                "rows": sizes["rows"],
+                "messages_mb": round(objects.get("messages", {}).get("bytes", 0) / 2 ** 20, 1),
+                "archive_mb": round(objects.get("messages_archive", {}).get("bytes", 0) / 2 ** 20, 1)}
+
+    print(json.dumps({
+        "rows": rows,
+        "fill_s": round(fill_s, 1),
+        "before": {**summary(before), "reads": reads_before},
+        "maintenance": report,
+        "insert_batch_of_10": {"idle": percentiles(baseline_writes), "during_maintenance": percentiles(writes)},
+        "after": {**summary(after), "reads": reads_after},
+    }, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
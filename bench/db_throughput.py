@@ -0,0 +1,111 @@
+"""
+Пропускная способность insert / fetch / mark до и после пула соединений.
+
+"before" — прежняя схема: новое соединение на каждый вызов, журнал по умолчанию, без индекса.
+"after"  — пул из database.py: WAL, synchronous=NORMAL, частичный индекс по непрочитанным.
+
+Запуск: python bench/db_throughput.py [rows]
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import aiosqlite
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+import database  # noqa: E402
+
+USERS = 100
+CONCURRENCY = 50
+
+
+async def legacy_insert(path, user_id, text, model_text, chat_id, progress_message_id, plan_date):
+    async with aiosqlite.connect(path) as db:
+        cursor = await db.execute(
+            "INSERT INTO messages (user_id, text, model_text, chat_id, progress_message_id, plan_date) VALUES (?, ?, ?, ?, ?, ?)",
+            (user_id, text, model_text, chat_id, progress_message_id, plan_date)
+        )
+        await db.commit()
+        return cursor.lastrowid
+
+
+async def legacy_fetch(path, telegram_user_id):
+    async with aiosqlite.connect(path) as db:
+        async with db.execute(
+            "SELECT id, text, created_at, chat_id, progress_message_id, model_text "
+            "FROM messages WHERE user_id = ? AND processed = 0 ORDER BY id ASC",
+            (telegram_user_id,)
+        ) as cursor:
+            return await cursor.fetchall()
+
+
+async def legacy_mark(path, message_id):
+    async with aiosqlite.connect(path) as db:
+        async with db.execute("SELECT id FROM messages WHERE id = ? AND processed = 0", (message_id,)) as cursor:
+            if not await cursor.fetchone():
+                return False
+        await db.execute("UPDATE messages SET processed = 1 WHERE id = ?", (message_id,))
+        await db.commit()
+        return True
+
+
+async def run_concurrently(calls):
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def guarded(factory):
+        async with semaphore:
+            return await factory()
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(guarded(factory) for factory in calls))
+    return results, time.perf_counter() - start
+
+
+async def run_mode(mode: str, rows: int) -> dict:
+    path = os.path.join(tempfile.mkdtemp(), "messages.db")
+    database.DATABASE_PATH = path
+    await database.init_db()
+
+    if mode == "before":
+        async with aiosqlite.connect(path) as db:
+            await db.execute("DROP INDEX IF EXISTS idx_messages_unread")
+            await db.commit()
+            await db.execute("PRAGMA journal_mode=DELETE")
+        insert = lambda *args: legacy_insert(path, *args)  # noqa: E731
+        fetch = lambda user: legacy_fetch(path, user)  # noqa: E731
+        mark = lambda message_id: legacy_mark(path, message_id)  # noqa: E731
+    else:
+        await database.open_pool()
+        insert, fetch, mark = database.insert_message, database.fetch_unread_messages, database.mark_message_as_processed
+
+    try:
+        ids, insert_time = await run_concurrently([
+            (lambda i=i: insert(str(i % USERS), f"план {i}", f"📅 Дневной план {i}", i, i, "24 марта 2024 г."))
+            for i in range(rows)
+        ])
+        _, fetch_time = await run_concurrently([(lambda u=u: fetch(str(u))) for u in range(USERS)])
+        _, mark_time = await run_concurrently([(lambda m=m: mark(m)) for m in ids[::2]])
+    finally:
+        await database.close_pool()
+
+    return {
+        "mode": mode,
+        "rows": rows,
+        "insert_per_s": round(rows / insert_time, 1),
+        "fetch_per_s": round(USERS / fetch_time, 1),
+        "mark_per_s": round(len(ids[::2]) / mark_time, 1),
+    }
+
+
+async def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    results = [await run_mode("before", rows), await run_mode("after", rows)]
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
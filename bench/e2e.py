@@ -0,0 +1,432 @@
+"""
+Сквозной нагрузочный прогон: Telegram -> бот -> LLM -> API -> WebSocket Obsidian -> ACK -> правка в Telegram.
+
+В одном процессе поднимаются заглушка Telegram Bot API и мок OpenAI/Anthropic (bench/stubs.py),
+API (uvicorn) и бот (aiogram, поллинг заглушки). Симулируемые пользователи отправляют план текстом
+или голосовым и нажимают «Отправить в Obsidian», как только появилась кнопка; их устройства Obsidian
+и множество «фоновых» клиентов держат WebSocket к API и подтверждают доставку.
+
+Для каждого плана фиксируются моменты по вызовам бота и API к заглушке Telegram и по кадрам WebSocket:
+  first_reply  — от апдейта до первого ответа бота;
+  plan_ready   — от апдейта до плана с кнопками;
+  submit       — от нажатия кнопки до «✅ План успешно отправлен» (POST в API);
+  ws_delivery  — от нажатия кнопки до получения плана первым устройством;
+  confirm      — от доставки до правки «🚀» (ACK, запись в БД, лимиты TelegramClient);
+  end_to_end   — от апдейта до «🚀».
+Отчёт — JSON: p50/p95/p99 по этапам, пропускная способность, память, гистограммы /metrics и коммит,
+чтобы прогоны разных коммитов можно было сравнивать (--out, --baseline).
+
+Транскрибация по умолчанию заменена заглушкой с задержкой --transcribe-seconds и пулом --transcribe-workers;
+с --whisper tiny работает настоящий пул faster-whisper, а голосовое берётся из --voice-file.
+По умолчанию пользователи выбирают /gpt (OpenAI-совместимый поток мока).
+
+Запуск: python bench/e2e.py [--users 200] [--devices 2] [--idle-clients 2000] [--out run.json] [--baseline old.json]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import aiohttp
+from aiohttp import web
+
+from stubs import LLMStub, TelegramStub, serve
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "app"))
+
+TELEGRAM_PORT, LLM_PORT, API_PORT, BOT_METRICS_PORT = 8771, 8772, 8773, 8774
+API_URL = f"http://127.0.0.1:{API_PORT}"
+TOKEN = "42:bench"
+VOICE_TEXT = "Утром отправить отчёт руководителю и зайти в аптеку, после обеда позвонить маме и сходить на тренировку"
+STAGES = ("first_reply", "plan_ready", "submit", "ws_delivery", "confirm", "end_to_end")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200, help="Пользователи бота, каждый составляет планы")
+    parser.add_argument("--rounds", type=int, default=1, help="Планов на пользователя, последовательно")
+    parser.add_argument("--ramp", type=float, default=5.0, help="Секунд, за которые стартуют все пользователи")
+    parser.add_argument("--voice-share", type=float, default=0.5, help="Доля планов голосовыми")
+    parser.add_argument("--model", choices=("gpt", "cloud"), default="gpt")
+    parser.add_argument("--devices", type=int, default=2, help="Устройств Obsidian на пользователя бота")
+    parser.add_argument("--idle-clients", type=int, default=2000, help="WebSocket-клиентов без сообщений")
+    parser.add_argument("--protocol", type=int, choices=(1, 2), default=1, help="Протокол WebSocket клиентов")
+    parser.add_argument("--llm-first-token", type=float, default=0.5)
+    parser.add_argument("--llm-token-delay", type=float, default=0.02)
+    parser.add_argument("--transcribe-seconds", type=float, default=1.0, help="Задержка заглушки транскрибации")
+    parser.add_argument("--transcribe-workers", type=int, default=4)
+    parser.add_argument("--whisper", metavar="MODEL", help="Настоящий faster-whisper (например, tiny)")
+    parser.add_argument("--voice-file", help="ogg для --whisper")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--out", help="Сохранить отчёт в файл")
+    parser.add_argument("--baseline", help="Отчёт прошлого прогона для сравнения")
+    return parser.parse_args()
+
+
+def configure(args: argparse.Namespace) -> str:
+    """Окружение приложения указывает на заглушки; модули app импортируются только после этого."""
+    directory = tempfile.mkdtemp(prefix="e2e_")
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": TOKEN,
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{TELEGRAM_PORT}",
+        "FASTAPI_URL": API_URL,
+        "OPENAI_API_URL": f"http://127.0.0.1:{LLM_PORT}/v1",
+        "OPENAI_API_KEY": "bench",
+        "ANTHROPIC_API_URL": f"http://127.0.0.1:{LLM_PORT}",
+        "ANTHROPIC_API_KEY": "bench",
+        "METRICS_PORT": str(BOT_METRICS_PORT),
+        "FSM_STORAGE_PATH": os.path.join(directory, "fsm.db"),
+        "TRANSCRIPTION_CACHE_PATH": os.path.join(directory, "transcriptions.db"),
+    })
+    if args.whisper:
+        os.environ.update({
+            "WHISPER_MODEL_SIZE": args.whisper,
+            "TRANSCRIBE_WORKERS": str(args.transcribe_workers),
+            "TRANSCRIPTION_CACHE_MAX_BYTES": "0",  # Одно и то же голосовое не должно браться из кэша
+        })
+    return directory
+
+
+@dataclass
+class Journey:
+    """Один план одного пользователя: моменты этапов по perf_counter."""
+    user_id: int
+    voice: bool
+    sent: float
+    tapped: float | None = None
+    marks: dict[str, float] = field(default_factory=dict)
+    done: asyncio.Event = field(default_factory=asyncio.Event)
+
+    def mark(self, name: str):
+        self.marks.setdefault(name, time.perf_counter())
+
+    def stages(self) -> dict[str, float]:
+        marks, result = self.marks, {}
+        spans = {
+            "first_reply": (self.sent, marks.get("first_reply")),
+            "plan_ready": (self.sent, marks.get("plan_ready")),
+            "submit": (self.tapped, marks.get("submitted")),
+            "ws_delivery": (self.tapped, marks.get("delivered")),
+            "confirm": (marks.get("delivered"), marks.get("confirmed")),
+            "end_to_end": (self.sent, marks.get("confirmed")),
+        }
+        for stage, (start, end) in spans.items():
+            if start is not None and end is not None:
+                result[stage] = end - start
+        return result
+
+
+class Harness:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.telegram = TelegramStub(self.on_telegram_call)
+        self.llm = LLMStub(args.llm_first_token, args.llm_token_delay)
+        self.journeys: dict[int, Journey] = {}  # Текущий план пользователя
+        self.finished: list[Journey] = []
+        self.setup_done: dict[int, asyncio.Event] = {}
+        self.events = {"queued_notices": 0, "failures": 0, "ws_frames": 0, "ws_confirms": 0, "idle_messages": 0}
+
+    # Вызовы бота и API к заглушке Telegram
+    def on_telegram_call(self, method: str, params: dict, message: dict | None):
+        if message is None:
+            return
+        chat_id = message["chat"]["id"]
+        text = message["text"]
+        if chat_id in self.setup_done and text.startswith("✅ Модель обработки"):
+            self.setup_done[chat_id].set()
+            return
+        journey = self.journeys.get(chat_id)
+        if journey is None:
+            return
+        if method == "sendMessage":
+            journey.mark("first_reply")
+        if text.startswith("⏳ Сейчас много запросов"):
+            self.events["queued_notices"] += 1
+        elif text.startswith("❌") or text.startswith("⏳ Сейчас слишком много"):
+            self.events["failures"] += 1
+            journey.marks["failed"] = time.perf_counter()
+            journey.done.set()
+        elif "send_obsidian" in json.dumps(message.get("reply_markup") or {}) and journey.tapped is None:
+            journey.mark("plan_ready")
+            journey.tapped = time.perf_counter()  # Пользователь сразу нажимает «Отправить в Obsidian»
+            self.telegram.push_callback(chat_id, message["message_id"], "send_obsidian")
+        elif text.startswith("✅ План успешно отправлен"):
+            journey.mark("submitted")
+        elif text.startswith("🚀"):
+            journey.mark("confirmed")
+            journey.done.set()
+
+    # Клиенты Obsidian
+    async def device(self, session: aiohttp.ClientSession, user_id: str, device_id: str, ready: asyncio.Semaphore):
+        async with ready:
+            ws = await session.ws_connect(f"{API_URL}/ws/{user_id}?device_id={device_id}&protocol={self.args.protocol}",
+                                          heartbeat=None, max_msg_size=0)
+        async for frame in ws:
+            if frame.type != aiohttp.WSMsgType.TEXT:
+                break
+            data = json.loads(frame.data)
+            if data.get("type") == "ping":
+                await ws.send_json({"type": "pong"})
+                continue
+            messages = data["messages"] if data.get("type") == "messages" else [data]
+            messages = [message for message in messages if message.get("type", "new_message") == "new_message"]
+            if not messages:
+                continue
+            self.events["ws_frames"] += 1
+            for message in messages:
+                journey = self.journeys.get(int(message["chat_id"])) if message.get("chat_id") else None
+                if journey is not None:
+                    journey.mark("delivered")
+                else:
+                    self.events["idle_messages"] += 1
+            if self.args.protocol == 2:
+                await ws.send_json({"type": "confirm", "up_to": max(message["db_message_id"] for message in messages)})
+            else:
+                for message in messages:
+                    await ws.send_json({"type": "confirm", "db_message_id": message["db_message_id"],
+                                        "chat_id": message["chat_id"],
+                                        "progress_message_id": message["progress_message_id"]})
+            self.events["ws_confirms"] += len(messages)
+
+    # Пользователи бота
+    async def user(self, user_id: int, index: int):
+        await asyncio.sleep(self.args.ramp * index / max(self.args.users, 1))
+        self.setup_done[user_id] = asyncio.Event()
+        self.telegram.push_text(user_id, f"/{self.args.model}")
+        await self.setup_done[user_id].wait()
+        del self.setup_done[user_id]
+
+        for round_index in range(self.args.rounds):
+            number = index * self.args.rounds + round_index  # Голосовые равномерно вперемешку с текстом
+            voice = int((number + 1) * self.args.voice_share) > int(number * self.args.voice_share)
+            journey = Journey(user_id, voice, time.perf_counter())
+            self.journeys[user_id] = journey
+            if voice:
+                self.telegram.push_voice(user_id)
+            else:
+                self.telegram.push_text(user_id, VOICE_TEXT)
+            await journey.done.wait()
+            self.finished.append(journey)
+            del self.journeys[user_id]
+
+
+def percentiles(values: list[float]) -> dict:
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+
+    def at(q: float) -> float:
+        return round(values[min(len(values) - 1, int(len(values) * q))] * 1000, 1)
+
+    return {"count": len(values), "p50_ms": at(0.5), "p95_ms": at(0.95), "p99_ms": at(0.99),
+            "max_ms": round(values[-1] * 1000, 1)}
+
+
+def histogram_quantile(histogram, q: float) -> float | None:
+    """Верхняя граница корзины, в которую попадает квантиль (как histogram_quantile без интерполяции)."""
+    if not histogram.count:
+        return None
+    cumulative = 0
+    for bound, count in zip([*histogram.buckets, float("inf")], histogram.counts):
+        cumulative += count
+        if cumulative >= q * histogram.count:
+            return bound
+    return None
+
+
+def server_histograms(registry) -> dict:
+    result = {}
+    for name, kind, _, labels, value in registry.samples():
+        if kind != "histogram" or not value.count:
+            continue
+        key = name + "".join(f"[{label}={label_value}]" for label, label_value in labels.items())
+        if name.endswith("_seconds"):  # Задержки — в мс, границы корзин в секундах
+            result[key] = {"count": value.count, "avg_ms": round(value.sum / value.count * 1000, 2),
+                           **{f"p{q}_le_s": histogram_quantile(value, q / 100) for q in (50, 95, 99)}}
+        else:  # Токены и прочие величины — в своих единицах
+            result[key] = {"count": value.count, "avg": round(value.sum / value.count, 2),
+                           **{f"p{q}_le": histogram_quantile(value, q / 100) for q in (50, 95, 99)}}
+    return result
+
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return round(int(line.split()[1]) / 1024, 1)
+    return 0.0
+
+
+def git_commit() -> str | None:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                               capture_output=True, text=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report: dict, baseline: dict) -> dict:
+    """Отношение к прошлому прогону: < 1 — быстрее (для задержек) или меньше (для памяти)."""
+    result = {"baseline_commit": baseline.get("commit")}
+    for stage in STAGES:
+        current, previous = report["stages"].get(stage, {}), baseline.get("stages", {}).get(stage, {})
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            if current.get(key) and previous.get(key):
+                result[f"{stage}.{key}"] = round(current[key] / previous[key], 3)
+    for key in ("plans_per_s",):
+        if report["throughput"].get(key) and baseline.get("throughput", {}).get(key):
+            result[f"throughput.{key}"] = round(report["throughput"][key] / baseline["throughput"][key], 3)
+    if baseline.get("memory", {}).get("max_rss_mb"):
+        result["memory.max_rss_mb"] = round(report["memory"]["max_rss_mb"] / baseline["memory"]["max_rss_mb"], 3)
+    return result
+
+
+async def run(args: argparse.Namespace) -> dict:
+    configure(args)
+    import uvicorn
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+
+    import api
+    import bot as bot_module
+    import database
+    import transcriber
+    from metrics import registry
+
+    harness = Harness(args)
+    if args.whisper:
+        if not args.voice_file:
+            raise SystemExit("--whisper требует --voice-file")
+        audio = Path(args.voice_file).read_bytes()
+        harness.telegram.voice_bytes = len(audio)
+
+        async def download(request):
+            return web.Response(body=audio)
+
+        harness.telegram.download = download
+    else:
+        slots = asyncio.Semaphore(args.transcribe_workers)
+
+        async def transcribe(audio, user_id=None, on_segment=None):
+            queued = time.perf_counter()
+            async with slots:
+                started = time.perf_counter()
+                await asyncio.sleep(args.transcribe_seconds)
+            if on_segment is not None:
+                on_segment(transcriber.TranscriptSegment(VOICE_TEXT, 20.0, 20.0, -0.1))
+            return transcriber.Transcription(VOICE_TEXT, 0.0, time.perf_counter() - started, started - queued)
+
+        async def nothing():
+            pass
+
+        transcriber.service.transcribe = transcribe
+        transcriber.service.warm_up = nothing
+        transcriber.service.stop = nothing
+
+    runners = [await serve(harness.telegram.app(), TELEGRAM_PORT), await serve(harness.llm.app(), LLM_PORT)]
+    database.DATABASE_PATH = os.path.join(os.path.dirname(os.environ["FSM_STORAGE_PATH"]), "messages.db")
+    await database.init_db()
+    server = uvicorn.Server(uvicorn.Config(api.app, host="127.0.0.1", port=API_PORT, log_level="warning",
+                                           backlog=4096))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    bot_module.bot = Bot(TOKEN, session=AiohttpSession(
+        api=TelegramAPIServer.from_base(f"http://127.0.0.1:{TELEGRAM_PORT}")))
+    polling = asyncio.create_task(bot_module.dp.start_polling(bot_module.bot, handle_signals=False,
+                                                              polling_timeout=1))
+
+    memory = {"rss_start_mb": rss_mb()}
+    session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0))
+    ready = asyncio.Semaphore(200)
+    user_ids = [100_000 + index for index in range(args.users)]
+    devices = [asyncio.create_task(harness.device(session, str(user_id), f"d{index}", ready))
+               for user_id in user_ids for index in range(args.devices)]
+    devices += [asyncio.create_task(harness.device(session, f"idle-{index}", "d0", ready))
+                for index in range(args.idle_clients)]
+    connect_started = time.perf_counter()
+    while sum(len(connections) for connections in api.active_connections.values()) < len(devices):
+        await asyncio.sleep(0.05)
+        if time.perf_counter() - connect_started > args.timeout:
+            raise TimeoutError("WebSocket-клиенты не подключились")
+    connect_s = time.perf_counter() - connect_started
+    memory["rss_connected_mb"] = rss_mb()
+
+    started = time.perf_counter()
+    users = [asyncio.create_task(harness.user(user_id, index)) for index, user_id in enumerate(user_ids)]
+    done, pending = await asyncio.wait(users, timeout=args.timeout)
+    elapsed = time.perf_counter() - started
+    memory["rss_end_mb"] = rss_mb()
+    memory["max_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+    report = build_report(args, harness, registry, elapsed, connect_s, len(devices), memory, len(pending))
+
+    for task in [*pending, *devices]:
+        task.cancel()
+    await session.close()
+    await bot_module.dp.stop_polling()
+    await asyncio.gather(polling, return_exceptions=True)
+    server.should_exit = True
+    await server_task
+    for runner in runners:
+        await runner.cleanup()
+    return report
+
+
+def build_report(args, harness: Harness, registry, elapsed: float, connect_s: float, clients: int,
+                 memory: dict, unfinished_users: int) -> dict:
+    journeys = harness.finished + list(harness.journeys.values())
+    completed = [journey for journey in journeys if "confirmed" in journey.marks]
+    stages: dict[str, list[float]] = {stage: [] for stage in STAGES}
+    by_kind: dict[str, list[float]] = {"text": [], "voice": []}
+    for journey in completed:
+        for stage, value in journey.stages().items():
+            stages[stage].append(value)
+        by_kind["voice" if journey.voice else "text"].append(journey.stages()["end_to_end"])
+
+    return {
+        "commit": git_commit(),
+        "params": {key: value for key, value in vars(args).items() if key not in ("out", "baseline")},
+        "plans": {"started": len(journeys), "confirmed": len(completed),
+                  "failed": sum(1 for journey in journeys if "failed" in journey.marks),
+                  "unfinished_users": unfinished_users},
+        "throughput": {"elapsed_s": round(elapsed, 2), "plans_per_s": round(len(completed) / elapsed, 2),
+                       "ws_clients": clients, "ws_connect_s": round(connect_s, 2),
+                       "ws_connects_per_s": round(clients / connect_s, 1) if connect_s else None,
+                       "telegram_calls": dict(sorted(harness.telegram.calls.items())),
+                       "llm_requests": harness.llm.requests, **harness.events},
+        "stages": {stage: percentiles(values) for stage, values in stages.items()},
+        "end_to_end_by_kind": {kind: percentiles(values) for kind, values in by_kind.items()},
+        "memory": memory,
+        "server_histograms": server_histograms(registry),
+    }
+
+
+def main():
+    args = parse_args()
+    logging.disable(logging.WARNING)
+    report = asyncio.run(run(args))
+    if args.baseline:
+        report["vs_baseline"] = compare(report, json.loads(Path(args.baseline).read_text()))
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.out:
+        Path(args.out).write_text(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Задержка рассылки одного сообщения на много устройств пользователя.
+
+Для каждого числа устройств подключает их к /ws/{user}?device_id=..., публикует
+сообщения через POST /messages/json и меряет время от запроса до получения на каждом устройстве.
+
+Запуск: python bench/fanout.py [devices ...]
+"""
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import aiohttp
+import uvicorn
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+import database  # noqa: E402
+import api  # noqa: E402
+
+logging.disable(logging.WARNING)
+
+PORT = 8766
+URL = f"http://127.0.0.1:{PORT}"
+MESSAGES = 20
+
+
+async def run(devices: int) -> dict:
+    user = f"fanout-{devices}"
+    latencies = []
+    sent_at: dict[int, float] = {}
+    received = asyncio.Event()
+    remaining = devices * MESSAGES
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as session:
+        sockets = [await session.ws_connect(f"{URL}/ws/{user}?device_id=d{i}") for i in range(devices)]
+
+        async def listen(ws):
+            nonlocal remaining
+            async for frame in ws:
+                message = json.loads(frame.data)
+                if message.get("type") != "new_message":
+                    continue
+                latencies.append(time.perf_counter() - sent_at[message["progress_message_id"]])
+                await ws.send_json({"type": "confirm", "db_message_id": message["db_message_id"],
+                                    "chat_id": 0, "progress_message_id": message["progress_message_id"]})
+                remaining -= 1
+                if remaining == 0:
+                    received.set()
+
+        listeners = [asyncio.create_task(listen(ws)) for ws in sockets]
+        await asyncio.sleep(0.2)
+
+        for i in range(MESSAGES):
+            sent_at[i] = time.perf_counter()
+            payload = {"telegram_user_id": user, "text": "план", "model_text": "📅 Дневной план",
+                       "progress_message_id": i, "chat_id": 0, "plan_date": "24 марта 2024 г."}
+            async with session.post(f"{URL}/messages/json", json=payload) as response:
+                await response.read()
+        await asyncio.wait_for(received.wait(), timeout=60)
+
+        for task in listeners:
+            task.cancel()
+        for ws in sockets:
+            await ws.close()
+
+    latencies.sort()
+    return {
+        "devices": devices,
+        "deliveries": len(latencies),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2),
+    }
+
+
+async def main():
+    device_counts = [int(arg) for arg in sys.argv[1:]] or [1, 10, 50, 200]
+
+    database.DATABASE_PATH = os.path.join(tempfile.mkdtemp(), "messages.db")
+    await database.init_db()
+    api.edit_telegram_message = lambda *args: None  # Telegram в бенчмарке не нужен
+
+    server = uvicorn.Server(uvicorn.Config(api.app, host="127.0.0.1", port=PORT, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    try:
+        results = [await run(devices) for devices in device_counts]
+    finally:
+        server.should_exit = True
+        await server_task
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,103 @@
+"""
+Задержки get/set хранилища FSM при множестве одновременных пользователей.
+
+Каждый пользователь проходит путь плана, как в bot.py: get_data -> update_data(original/moderated/plan_date)
+-> set_state(plan_ready) -> get_data при подтверждении -> set_state(None) + set_data({}).
+Сравниваются MemoryStorage (прежнее), SQLiteStorage с кэшем и без кэша (cache_size=0, как для нескольких реплик).
+Затем хранилище закрывается и открывается заново — проверяется, что незавершённые планы пережили перезапуск.
+
+Запуск: python bench/fsm_storage.py [users] [concurrency]
+"""
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+from fsm_storage import SQLiteStorage  # noqa: E402
+
+logging.disable(logging.WARNING)
+
+BOT_ID = 1
+PLAN = "📅 Дневной план\n🕗 Первая половина дня\n\n- [ ] Отправить отчет руководителю\n" * 5
+
+
+def key(user_id: int) -> StorageKey:
+    return StorageKey(bot_id=BOT_ID, chat_id=user_id, user_id=user_id)
+
+
+async def user_flow(storage, user_id: int, latencies: dict, finish: bool):
+    async def timed(name, call):
+        started = time.perf_counter()
+        result = await call
+        latencies.setdefault(name, []).append(time.perf_counter() - started)
+        return result
+
+    await timed("get", storage.get_data(key(user_id)))
+    await timed("set", storage.update_data(key(user_id), {
+        "original_text": "отчет, аптека, тренировка", "moderated_text": PLAN, "plan_date": "2024-03-24"}))
+    await timed("set", storage.set_state(key(user_id), "PlanStates:plan_ready"))
+    await timed("get", storage.get_state(key(user_id)))
+    await timed("get", storage.get_data(key(user_id)))
+    if finish:  # Половина пользователей подтверждает план, у остальных он остаётся незавершённым
+        await timed("set", storage.set_state(key(user_id), None))
+        await timed("set", storage.set_data(key(user_id), {}))
+
+
+def percentiles(samples: list[float]) -> dict:
+    samples.sort()
+    pick = lambda p: round(samples[min(int(len(samples) * p), len(samples) - 1)] * 1000, 3)  # noqa: E731
+    return {"p50_ms": pick(0.5), "p99_ms": pick(0.99)}
+
+
+async def run(name: str, storage, users: int, concurrency: int) -> dict:
+    latencies = {}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(user_id):
+        async with semaphore:
+            await user_flow(storage, user_id, latencies, finish=user_id % 2 == 0)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(user_id) for user_id in range(users)))
+    elapsed = time.perf_counter() - started
+    result = {"storage": name, "users": users, "elapsed_s": round(elapsed, 3),
+              "ops_per_s": round(sum(len(samples) for samples in latencies.values()) / elapsed)}
+    for op, samples in latencies.items():
+        result[op] = percentiles(samples)
+    return result
+
+
+async def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    results = [await run("memory", MemoryStorage(), users, concurrency)]
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, cache_size in (("sqlite_cached", 10000), ("sqlite_uncached", 0)):
+            path = os.path.join(tmp, f"{name}.db")
+            storage = SQLiteStorage(path, cache_size=cache_size)
+            await storage.open()
+            results.append(await run(name, storage, users, concurrency))
+            await storage.close()
+
+            restarted = SQLiteStorage(path, cache_size=cache_size)
+            survived = 0
+            for user_id in range(1, users, 2):
+                data = await restarted.get_data(key(user_id))
+                survived += data.get("moderated_text") == PLAN
+            await restarted.close()
+            results[-1]["pending_after_restart"] = f"{survived}/{users // 2}"
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
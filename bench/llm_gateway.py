@@ -0,0 +1,128 @@
+"""
+200 одновременных планов через LLMGateway против локального мок-сервера OpenAI и Anthropic.
+
+Проверяет, что запросы не занимают потоки исполнителя (раньше Claude шёл через asyncio.to_thread
+и при нагрузке вытеснял транскрибацию), и печатает задержки, гистограммы и пик числа потоков.
+Во время прогона в исполнитель по умолчанию (тот же, что у transcribe_audio) раз в 10 мс отправляется
+пустая задача; её ожидание показывает, свободны ли потоки. Скрипт падает (AssertionError), если у провайдера
+готовы не все планы, пустая задача ждала дольше половины задержки мок-сервера (потоки заняты запросами к LLM)
+или потоков стало больше, чем вмещает исполнитель по умолчанию.
+
+Запуск: python bench/llm_gateway.py [plans] [mock_delay_s]
+"""
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+from aiohttp import web
+
+PORT = 8769
+EXECUTOR_THREADS = min(32, (os.cpu_count() or 1) + 4)  # Размер исполнителя по умолчанию (ThreadPoolExecutor)
+os.environ.update({
+    "OPENAI_API_KEY": "bench", "OPENAI_API_URL": f"http://127.0.0.1:{PORT}/v1",
+    "ANTHROPIC_API_KEY": "bench", "ANTHROPIC_API_URL": f"http://127.0.0.1:{PORT}",
+})
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+import openai_client  # noqa: E402
+from llm_gateway import gateway  # noqa: E402
+
+PLAN = "{{24 марта 2024 г.}}//📅 Дневной план\n🕗 Первая половина дня\n\n- [ ] Отправить отчет руководителю\n"
+
+
+def mock_app(delay: float) -> web.Application:
+    async def chat_completions(request):
+        await asyncio.sleep(delay)
+        return web.json_response({
+            "id": "bench", "object": "chat.completion", "created": 0, "model": "gpt-4o",
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": PLAN}}],
+            "usage": {"prompt_tokens": 1500, "completion_tokens": 120, "total_tokens": 1620,
+                      "prompt_tokens_details": {"cached_tokens": 1280}},
+        })
+
+    async def messages(request):
+        await asyncio.sleep(delay)
+        return web.json_response({
+            "id": "bench", "type": "message", "role": "assistant", "model": "claude",
+            "content": [{"type": "text", "text": PLAN}], "stop_reason": "end_turn",
+            "usage": {"input_tokens": 220, "output_tokens": 120, "cache_read_input_tokens": 1280},
+        })
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    app.router.add_post("/v1/messages", messages)
+    return app
+
+
+async def run(name: str, generate, plans: int) -> dict:
+    threads_before = peak_threads = threading.active_count()
+    executor_waits = []
+    done = 0
+
+    async def watch():
+        nonlocal peak_threads
+        while done < plans:
+            peak_threads = max(peak_threads, threading.active_count())
+            started = time.perf_counter()
+            await asyncio.to_thread(lambda: None)
+            executor_waits.append(time.perf_counter() - started)
+            await asyncio.sleep(0.01)
+
+    async def one(i: int):
+        nonlocal done
+        try:
+            return await generate(f"план {i}")
+        finally:
+            done += 1
+
+    watcher = asyncio.create_task(watch())
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one(i) for i in range(plans)), return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    await watcher
+    return {
+        "provider": name,
+        "plans": plans,
+        "ok": sum(isinstance(result, tuple) for result in results),
+        "elapsed_s": round(elapsed, 3),
+        "threads_before": threads_before,
+        "peak_threads": peak_threads,
+        "executor_wait_max_ms": round(max(executor_waits, default=0) * 1000, 1),
+        "errors": sorted({str(result) for result in results if not isinstance(result, tuple)})[:3],
+    }
+
+
+async def main():
+    plans = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+
+    runner = web.AppRunner(mock_app(delay))
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+    await gateway.warm_up()
+
+    try:
+        results = [
+            await run("openai", openai_client.generate_gpt_response, plans),
+            await run("anthropic", openai_client.generate_claude_response, plans),
+        ]
+    finally:
+        await gateway.close()
+        await runner.cleanup()
+
+    print(json.dumps({"runs": results, "gateway": gateway.metrics(), "usage": openai_client.usage_stats}, indent=2,
+                     ensure_ascii=False))
+
+    for result in results:
+        assert result["ok"] == result["plans"], f"{result['provider']}: готово {result['ok']} из {result['plans']}"
+        assert result["executor_wait_max_ms"] < delay * 1000 / 2, \
+            f"{result['provider']}: задача в исполнителе ждала {result['executor_wait_max_ms']} мс"
+        assert result["peak_threads"] - result["threads_before"] <= EXECUTOR_THREADS, \
+            f"{result['provider']}: потоков {result['threads_before']} → {result['peak_threads']}"
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
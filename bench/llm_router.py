@@ -0,0 +1,124 @@
+"""
+Хвостовые задержки и переключение провайдеров в LLMRouter на симулированных провайдерах.
+
+Сценарии:
+  tail      — основной провайдер обычно быстрый, но 10% запросов «зависают»; без хеджирования и с ним;
+  outage    — основной провайдер недоступен;
+  garbage   — основной провайдер в 30% случаев возвращает неразбираемый ответ;
+  stream    — как tail, но потоковые ответы (moderate_stream): «зависает» первый фрагмент.
+
+Каждый сценарий прогоняется без хеджирования и повторов (max_attempts=1) и с ними. Скрипт падает
+(AssertionError), если с хеджированием доля успешных ответов не выше, чем без него (или не 100%),
+или p99 не ниже. p99 считается по всем запросам: если без хеджирования больше 1% запросов
+не удались, его p99 — отказ, и хеджированный p99 его заведомо лучше.
+
+Запуск: python bench/llm_router.py [requests]
+"""
+import asyncio
+import json
+import logging
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+from llm_router import AllProvidersFailed, LLMRouter, Route  # noqa: E402
+from openai_client import parse_plan, split_partial_plan  # noqa: E402
+
+logging.disable(logging.WARNING)
+
+PLAN = "{{24 марта 2024 г.}}//📅 Дневной план\n- [ ] Отправить отчет руководителю\n"
+CONCURRENCY = 20
+
+
+def provider(latency: float, tail_share: float = 0.0, tail_latency: float = 0.0,
+             error_share: float = 0.0, garbage_share: float = 0.0):
+    async def request(text: str) -> tuple[str, str]:
+        delay = tail_latency if random.random() < tail_share else random.uniform(latency * 0.7, latency * 1.3)
+        await asyncio.sleep(delay)
+        if random.random() < error_share:
+            raise ConnectionError("503 Service Unavailable")
+        raw = "Извините, не могу помочь" if random.random() < garbage_share else PLAN
+        return parse_plan(raw)
+    return request
+
+
+def stream_provider(first_token: float, tail_share: float = 0.0, tail_latency: float = 0.0,
+                    token_delay: float = 0.005):
+    """Потоковый провайдер: задержка до первого фрагмента, затем план по 8 символов."""
+    async def stream(text: str):
+        await asyncio.sleep(tail_latency if random.random() < tail_share
+                            else random.uniform(first_token * 0.7, first_token * 1.3))
+        for end in range(8, len(PLAN) + 8, 8):
+            yield split_partial_plan(PLAN[:end])
+            await asyncio.sleep(token_delay)
+    return stream
+
+
+async def run(name: str, primary, secondary, requests: int, max_attempts: int, streams=None) -> dict:
+    """streams — потоковые варианты (основной, запасной): тогда запросы идут через moderate_stream."""
+    primary_stream, secondary_stream = streams or (None, None)
+    router = LLMRouter([Route("primary", primary, primary_stream), Route("secondary", secondary, secondary_stream)],
+                       max_attempts=max_attempts, hedge_min_delay=0.05, hedge_default_delay=0.3)
+    latencies = []
+    failures = 0
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def one():
+        nonlocal failures
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                if streams:
+                    await router.moderate_stream("план", "primary")
+                else:
+                    await router.moderate("план", "primary")
+                latencies.append(time.perf_counter() - started)
+            except AllProvidersFailed:
+                failures += 1
+
+    await asyncio.gather(*(one() for _ in range(requests)))
+    latencies.sort()
+
+    def percentile(p):
+        return round(latencies[min(int(len(latencies) * p), len(latencies) - 1)], 3) if latencies else None
+
+    return {
+        "scenario": name,
+        "max_attempts": max_attempts,
+        "success_rate": round(len(latencies) / requests, 3),
+        "p50_s": percentile(0.5),
+        "p99_s": percentile(0.99),
+        "hedges": router.counters["hedges"],
+        "backup_wins": router.counters["backup_wins"],
+        "retries": router.counters["retries"],
+    }
+
+
+async def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    random.seed(1)
+    stable = provider(0.15)
+    results = []
+    for max_attempts in (1, 3):  # 1 — без хеджирования и повторов, как раньше
+        results.append(await run("tail", provider(0.1, tail_share=0.1, tail_latency=2.0), stable,
+                                 requests, max_attempts))
+        results.append(await run("outage", provider(0.02, error_share=1.0), stable, requests, max_attempts))
+        results.append(await run("garbage", provider(0.1, garbage_share=0.3), stable, requests, max_attempts))
+        results.append(await run("stream", provider(0.1), stable, requests, max_attempts,
+                                 (stream_provider(0.05, tail_share=0.1, tail_latency=2.0), stream_provider(0.1))))
+    print(json.dumps(results, indent=2))
+
+    for baseline, hedged in zip(results[:len(results) // 2], results[len(results) // 2:]):
+        name = hedged["scenario"]
+        assert hedged["success_rate"] == 1.0, f"{name}: с хеджированием успешно {hedged['success_rate']:.1%}"
+        if baseline["success_rate"] < 1.0:
+            assert hedged["success_rate"] > baseline["success_rate"], name
+        if baseline["success_rate"] >= 0.99:  # Иначе p99 без хеджирования — отказ
+            assert hedged["p99_s"] < baseline["p99_s"], \
+                f"{name}: p99 {hedged['p99_s']}s с хеджированием против {baseline['p99_s']}s без"
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
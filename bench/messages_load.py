@@ -0,0 +1,73 @@
+"""
+Нагрузочный тест POST /messages через групповую запись.
+
+Поднимает приложение в процессе (ASGI-транспорт httpx, вместе с lifespan), шлёт N
+одновременных запросов и печатает пропускную способность и счётчики /stats/db.
+
+Запуск: python bench/messages_load.py [requests] [concurrency]
+"""
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+import database  # noqa: E402
+import api  # noqa: E402
+
+logging.disable(logging.INFO)
+
+
+async def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+    database.DATABASE_PATH = os.path.join(tempfile.mkdtemp(), "messages.db")
+    await database.init_db()
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async with api.app.router.lifespan_context(api.app):
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+
+            async def post(i: int):
+                params = {
+                    "telegram_user_id": str(i % 100),
+                    "text": f"план {i}",
+                    "model_text": f"📅 Дневной план {i}",
+                    "progress_message_id": i,
+                    "chat_id": i,
+                    "plan_date": "24 марта 2024 г.",
+                }
+                async with semaphore:
+                    started = time.perf_counter()
+                    response = await client.post("/messages", params=params)
+                    latencies.append(time.perf_counter() - started)
+                    response.raise_for_status()
+
+            started = time.perf_counter()
+            await asyncio.gather(*(post(i) for i in range(total)))
+            elapsed = time.perf_counter() - started
+            stats = (await client.get("/stats/db")).json()
+
+    latencies.sort()
+    print(json.dumps({
+        "requests": total,
+        "concurrency": concurrency,
+        "requests_per_s": round(total / elapsed, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 2),
+        "db": stats,
+    }, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,87 @@
+"""
+Стоимость инструментирования горячего пути: тот же замер (perf_counter до и после + observe)
+с включёнными метриками, в режиме заглушек (METRICS_ENABLED=0) и без метрик вовсе.
+Плюс время сборки /metrics со всеми коллекторами приложения.
+
+Запуск: python bench/metrics.py [iterations]
+"""
+import importlib
+import json
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "42:bench")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+import metrics  # noqa: E402
+
+logging.disable(logging.WARNING)
+
+
+def bare(iterations: int) -> float:
+    perf_counter = time.perf_counter
+    started = perf_counter()
+    for _ in range(iterations):
+        pass
+    return perf_counter() - started
+
+
+def timed(iterations: int, histogram) -> float:
+    perf_counter = time.perf_counter
+    started = perf_counter()
+    for _ in range(iterations):
+        begin = perf_counter()
+        histogram.observe(perf_counter() - begin)
+    return perf_counter() - started
+
+
+def untimed(iterations: int) -> float:
+    """Тот же цикл без вызова observe — нижняя граница для замера с perf_counter."""
+    perf_counter = time.perf_counter
+    started = perf_counter()
+    for _ in range(iterations):
+        begin = perf_counter()
+        perf_counter() - begin
+    return perf_counter() - started
+
+
+def ns(seconds: float, iterations: int) -> float:
+    return round(seconds / iterations * 1e9, 1)
+
+
+def render_cost() -> dict:
+    """Реестр со всеми модулями приложения, как в работающих API и боте."""
+    # Импорт модулей регистрирует их гистограммы и коллекторы в metrics.registry
+    for module in ("api", "fsm_storage", "llm_router", "transcriber"):
+        importlib.import_module(module)
+
+    for index in range(1000):
+        metrics.registry.histogram("db_insert_seconds", "").observe(index / 1000)
+    started = time.perf_counter()
+    rounds = 200
+    for _ in range(rounds):
+        text = metrics.registry.render()
+    return {"render_ms": round((time.perf_counter() - started) / rounds * 1000, 3),
+            "series": sum(1 for line in text.splitlines() if not line.startswith("#")), "bytes": len(text)}
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    enabled = metrics.Registry(enabled=True).histogram("bench_seconds", "")
+    disabled = metrics.Registry(enabled=False).histogram("bench_seconds", "")
+
+    results = {
+        "iterations": iterations,
+        "empty_loop_ns": ns(bare(iterations), iterations),
+        "perf_counter_only_ns": ns(untimed(iterations), iterations),
+        "noop_observe_ns": ns(timed(iterations, disabled), iterations),
+        "histogram_observe_ns": ns(timed(iterations, enabled), iterations),
+        **render_cost(),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Доставка между воркерами API с HUB_BACKEND=sqlite.
+
+Запускает два процесса uvicorn с приложением api на разных портах и общей messages.db (как два воркера
+uvicorn --workers 2, но с известным адресом каждого), одного клиента WebSocket на первом воркере
+и публикует сообщения по очереди в оба. Клиент подтверждает каждое полученное сообщение.
+Проверяется, что клиент получил каждое сообщение ровно один раз, что все сообщения отмечены
+обработанными и что Telegram получил по одной правке «🚀» на сообщение. Иначе — AssertionError.
+
+Запуск: python bench/multi_worker.py [messages]
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import aiohttp
+
+from stubs import TelegramStub, serve
+
+APP = Path(__file__).resolve().parent.parent / "app"
+sys.path.insert(0, str(APP))
+import database  # noqa: E402
+
+WORKER_PORTS = (8778, 8779)
+TELEGRAM_PORT = 8780
+USER = "multi-worker"
+TIMEOUT = 30
+
+
+def start_worker(port: int, directory: str) -> subprocess.Popen:
+    env = {**os.environ, "HUB_BACKEND": "sqlite", "PYTHONPATH": str(APP), "TELEGRAM_BOT_TOKEN": "42:bench",
+           "TELEGRAM_API_URL": f"http://127.0.0.1:{TELEGRAM_PORT}", "MAINTENANCE_INTERVAL": "3600"}
+    # DATABASE_PATH = "../data/messages.db" — относительно рабочего каталога процесса
+    log = open(os.path.join(directory, f"worker-{port}.log"), "w")
+    return subprocess.Popen([sys.executable, "-m", "uvicorn", "api:app", "--host", "127.0.0.1", "--port", str(port),
+                             "--log-level", "warning"], cwd=os.path.join(directory, "work"), env=env,
+                            stdout=log, stderr=subprocess.STDOUT)
+
+
+async def wait_ready(session: aiohttp.ClientSession, port: int):
+    deadline = time.monotonic() + TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(f"http://127.0.0.1:{port}/stats/db") as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientConnectionError:
+            pass
+        await asyncio.sleep(0.1)
+    raise TimeoutError(f"Воркер на порту {port} не запустился за {TIMEOUT}s")
+
+
+async def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    directory = tempfile.mkdtemp(prefix="multi_worker_")
+    os.makedirs(os.path.join(directory, "work"))
+    database.DATABASE_PATH = os.path.join(directory, "data", "messages.db")
+    await database.init_db()
+
+    rocket_edits: dict[int, int] = {}
+
+    def on_call(method: str, params: dict, message: dict | None):
+        if method == "editMessageText" and message and message["text"].startswith("🚀"):
+            rocket_edits[message["message_id"]] = rocket_edits.get(message["message_id"], 0) + 1
+
+    telegram = await serve(TelegramStub(on_call).app(), TELEGRAM_PORT)
+    workers = [start_worker(port, directory) for port in WORKER_PORTS]
+    received: list[int] = []
+    try:
+        async with aiohttp.ClientSession() as session:
+            for port in WORKER_PORTS:
+                await wait_ready(session, port)
+
+            all_received = asyncio.Event()
+            ws = await session.ws_connect(f"http://127.0.0.1:{WORKER_PORTS[0]}/ws/{USER}?device_id=laptop")
+
+            async def listen():
+                async for frame in ws:
+                    data = json.loads(frame.data)
+                    if data.get("type") == "ping":
+                        await ws.send_json({"type": "pong"})
+                    elif data.get("type") == "new_message":
+                        received.append(data["progress_message_id"])
+                        await ws.send_json({"type": "confirm", "db_message_id": data["db_message_id"]})
+                        if len(set(received)) == messages:
+                            all_received.set()
+
+            listener = asyncio.create_task(listen())
+            await asyncio.sleep(0.3)
+            started = time.perf_counter()
+            for i in range(messages):  # У каждого сообщения свой чат: правки одного чата идут раз в секунду
+                port = WORKER_PORTS[i % len(WORKER_PORTS)]  # По очереди в оба воркера
+                payload = {"telegram_user_id": USER, "text": "план", "model_text": "📅 Дневной план",
+                           "progress_message_id": i, "chat_id": 100 + i, "plan_date": "2024-03-24"}
+                async with session.post(f"http://127.0.0.1:{port}/messages/json", json=payload) as response:
+                    assert response.status == 200, await response.text()
+            await asyncio.wait_for(all_received.wait(), timeout=TIMEOUT)
+            delivered_s = time.perf_counter() - started
+
+            deadline = time.monotonic() + TIMEOUT  # ACK и правки в Telegram идут в фоне
+            while time.monotonic() < deadline and len(rocket_edits) < messages:
+                await asyncio.sleep(0.1)
+            listener.cancel()
+            await ws.close()
+    finally:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.wait(timeout=10)
+        await telegram.cleanup()
+
+    db = sqlite3.connect(database.DATABASE_PATH)
+    unread = db.execute("SELECT COUNT(*) FROM messages WHERE user_id = ? AND processed = 0", (USER,)).fetchone()[0]
+    db.close()
+    print(json.dumps({"workers": len(WORKER_PORTS), "messages": messages, "received": len(received),
+                      "delivered_s": round(delivered_s, 3), "unread_left": unread,
+                      "rocket_edits": sum(rocket_edits.values()), "logs": directory}, indent=2))
+
+    assert sorted(received) == list(range(messages)), f"получены не все или с повторами: {sorted(received)}"
+    assert unread == 0, f"не отмечены обработанными: {unread}"
+    assert rocket_edits == {i: 1 for i in range(messages)}, f"правки «🚀»: {rocket_edits}"
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
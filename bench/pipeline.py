@@ -0,0 +1,159 @@
+"""
+Всплески сообщений от многих пользователей: отдельная обработка каждого сообщения (как раньше)
+против PipelineScheduler (объединение подряд идущих сообщений, отмена устаревших запусков, общий лимит).
+
+Каждый пользователь присылает burst сообщений с паузами 0.1–0.4 с; доля LATE_SHARE пользователей
+через LATE_DELAY присылает ещё одно — когда их план уже составляется или ждёт в очереди. «LLM» — asyncio.sleep(llm_s).
+Считаются запуски LLM, потраченные на них секунды (в том числе отменённые), доставленные планы,
+включает ли последний (сохраняемый в FSM) план все сообщения пользователя
+и время от его последнего сообщения до итогового плана.
+
+Для планировщика скрипт падает (AssertionError), если какое-то сообщение не попало ни в один план или попало
+в несколько, одновременно работало больше concurrency запусков, счётчики не сходятся
+(каждое сообщение — либо завершённый запуск, либо объединено в него; каждый запуск либо завершён, либо
+заменён новым сообщением) или место, сообщённое пользователю за одно ожидание в очереди, повторилось
+или ухудшилось.
+
+Запуск: python bench/pipeline.py [users] [burst] [concurrency]
+"""
+import asyncio
+import json
+import logging
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+from pipeline import PipelineScheduler  # noqa: E402
+
+logging.disable(logging.WARNING)
+
+LLM_S = 0.5
+DEBOUNCE = 0.5
+LATE_SHARE = 0.3
+LATE_DELAY = 1.5
+
+
+class Counters:
+    def __init__(self):
+        self.llm_calls = 0
+        self.llm_busy_s = 0.0
+        self.running = 0
+        self.peak_running = 0
+        self.plans: dict[int, list[tuple[float, list[int]]]] = {}  # user -> [(время, номера сообщений)]
+        self.queue_positions: dict[int, list[int]] = {}  # user -> места, сообщённые за текущее ожидание
+        self.queue_stays: list[list[int]] = []  # Места за каждое завершившееся ожидание
+
+    async def llm(self, user: int, messages: list[int]):
+        self.llm_calls += 1
+        self.running += 1
+        self.peak_running = max(self.peak_running, self.running)
+        started = time.perf_counter()
+        try:
+            await asyncio.sleep(LLM_S)
+        finally:
+            self.running -= 1
+            self.llm_busy_s += time.perf_counter() - started
+        self.plans.setdefault(user, []).append((time.perf_counter(), messages))
+
+
+async def burst(user: int, size: int, send) -> tuple[float, int]:
+    """Отправляет сообщения пользователя и возвращает время последнего и их число."""
+    late = random.random() < LATE_SHARE
+    await asyncio.sleep(random.uniform(0, 0.5))
+    for number in range(size):
+        send(user, number)
+        if number < size - 1:
+            await asyncio.sleep(random.uniform(0.1, 0.4))
+    if late:
+        await asyncio.sleep(LATE_DELAY)
+        send(user, size)
+        size += 1
+    return time.perf_counter(), size
+
+
+def summary(mode: str, counters: Counters, sent: list[tuple[float, int]], elapsed: float) -> dict:
+    # В FSM остаётся только последний план пользователя — он и должен включать все его сообщения
+    covered = sum(1 for user, (_, count) in enumerate(sent)
+                  if user in counters.plans and sorted(counters.plans[user][-1][1]) == list(range(count)))
+    final = sorted(counters.plans[user][-1][0] - sent[user][0] for user in counters.plans)
+    pick = lambda p: round(final[min(int(len(final) * p), len(final) - 1)], 3)  # noqa: E731
+    return {
+        "mode": mode,
+        "messages": sum(count for _, count in sent),
+        "llm_calls": counters.llm_calls,
+        "llm_busy_s": round(counters.llm_busy_s, 1),
+        "plans_delivered": sum(len(plans) for plans in counters.plans.values()),
+        "final_plan_covers_all_messages": f"{covered}/{len(sent)}",
+        "final_plan_after_last_message_p50_s": pick(0.5),
+        "final_plan_after_last_message_p95_s": pick(0.95),
+        "peak_concurrent_llm": counters.peak_running,
+        "max_queue_position": max((max(positions) for positions in counters.queue_stays), default=0),
+        "elapsed_s": round(elapsed, 2),
+    }
+
+
+async def naive(users: int, burst_size: int) -> dict:
+    counters = Counters()
+    tasks = []
+
+    def send(user, number):
+        tasks.append(asyncio.create_task(counters.llm(user, [number])))
+
+    started = time.perf_counter()
+    sent = await asyncio.gather(*(burst(user, burst_size, send) for user in range(users)))
+    await asyncio.gather(*tasks)
+    return summary("per_message", counters, sent, time.perf_counter() - started)
+
+
+async def scheduled(users: int, burst_size: int, concurrency: int) -> dict:
+    counters = Counters()
+
+    async def run(user, items):
+        if user in counters.queue_positions:
+            counters.queue_stays.append(counters.queue_positions.pop(user))
+        await counters.llm(user, items)
+
+    async def on_queued(user, items, position):
+        counters.queue_positions.setdefault(user, []).append(position)
+
+    scheduler = PipelineScheduler(run, on_queued, debounce=DEBOUNCE, concurrency=concurrency)
+    started = time.perf_counter()
+    sent = await asyncio.gather(*(burst(user, burst_size, scheduler.submit) for user in range(users)))
+    while scheduler.metrics()["users"]:
+        await asyncio.sleep(0.05)
+    result = summary("scheduler", counters, sent, time.perf_counter() - started)
+    result["scheduler"] = stats = scheduler.metrics()
+    result["queue_stays"] = len(counters.queue_stays)
+    result["notified_again_in_queue"] = sum(len(positions) > 1 for positions in counters.queue_stays)
+
+    for user, (_, count) in enumerate(sent):
+        processed = sorted(number for _, numbers in counters.plans.get(user, []) for number in numbers)
+        assert processed == list(range(count)), f"пользователь {user}: отправлено {count}, в планах {processed}"
+    assert counters.peak_running <= concurrency, f"одновременно {counters.peak_running} при лимите {concurrency}"
+    assert stats["submitted"] == result["messages"], stats
+    assert stats["failed"] == 0 and stats["completed"] == result["plans_delivered"], stats
+    assert stats["completed"] + stats["merged"] == stats["submitted"], stats
+    assert stats["completed"] + stats["superseded"] == stats["submitted"], stats
+    assert stats["runs"] == counters.llm_calls, stats
+    assert stats["running"] == stats["waiting"] == 0, stats
+    assert not counters.queue_positions, counters.queue_positions  # Каждое ожидание закончилось запуском
+    for positions in counters.queue_stays:
+        assert all(a > b for a, b in zip(positions, positions[1:])), f"места за одно ожидание: {positions}"
+    return result
+
+
+async def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    burst_size = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    concurrency = int(sys.argv[3]) if len(sys.argv) > 3 else 16
+    random.seed(1)
+    results = [await naive(users, burst_size)]
+    random.seed(1)
+    results.append(await scheduled(users, burst_size, concurrency))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
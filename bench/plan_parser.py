@@ -0,0 +1,88 @@
+"""
+Доля разобранных ответов модели и скорость разбора: прежний parse_plan (split по «//») против plan_parser.
+
+Корпус — bench/plan_corpus.jsonl: записанные ответы OpenAI и Anthropic с типичными отклонениями
+от шаблона (ссылки и «//» в задачах, обёртка ```, вступление и заключение, нет заголовка с датой,
+разные записи даты) и ожидаемой ISO-датой; plan_date = null — ответ, который должен быть отклонён.
+
+Запуск: python bench/plan_parser.py [--corpus PATH] [--iterations N]
+"""
+import argparse
+import datetime
+import json
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "app"))
+from plan_parser import PLAN_MARKER, PlanParseError, parse_date, parse_plan_response  # noqa: E402
+
+TODAY = datetime.date(2024, 3, 23)  # «Сегодня» для относительных дат в корпусе
+
+
+def legacy_parse(result: str) -> tuple[str, str]:
+    """Как было в openai_client до plan_parser."""
+    date, result = result.split('//')
+    date = date.replace('{{', '').replace('}}', '')
+    idx = result.find(PLAN_MARKER)
+    if idx != -1:
+        result = result[idx:]
+    return date, result
+
+
+def legacy_result(raw: str) -> str | None:
+    """ISO-дата, которую получил бы потребитель из прежнего разбора, или None, если разбор упал."""
+    try:
+        date, body = legacy_parse(raw)
+    except ValueError:
+        return None
+    parsed = parse_date(date, TODAY)
+    return parsed.isoformat() if parsed and body.startswith(PLAN_MARKER) else None
+
+
+def new_result(raw: str) -> str | None:
+    try:
+        return parse_plan_response(raw, TODAY).plan_date
+    except PlanParseError:
+        return None
+
+
+def evaluate(corpus: list[dict], parse) -> dict:
+    correct = [entry["name"] for entry in corpus if parse(entry["raw"]) == entry["plan_date"]]
+    return {"correct": len(correct), "total": len(corpus), "success_rate": round(len(correct) / len(corpus), 3),
+            "failed": [entry["name"] for entry in corpus if entry["name"] not in correct]}
+
+
+def speed(corpus: list[dict], parse, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        for entry in corpus:
+            parse(entry["raw"])
+    return round((time.perf_counter() - started) / (iterations * len(corpus)) * 1e6, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", default=str(ROOT / "bench" / "plan_corpus.jsonl"))
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    with open(args.corpus, encoding="utf-8") as file:
+        corpus = [json.loads(line) for line in file if line.strip()]
+
+    results = {}
+    for name, parse in (("legacy", legacy_result), ("plan_parser", new_result)):
+        results[name] = {**evaluate(corpus, parse), "us_per_parse": speed(corpus, parse, args.iterations)}
+    results["repairs"] = {}
+    for entry in corpus:
+        try:
+            for repair in parse_plan_response(entry["raw"], TODAY).repairs:
+                results["repairs"][repair] = results["repairs"].get(repair, 0) + 1
+        except PlanParseError:
+            pass
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
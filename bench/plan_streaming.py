@@ -0,0 +1,155 @@
+"""
+Время до первого видимого текста плана: обычный запрос против потокового.
+
+Локальный мок OpenAI и Anthropic отдаёт план фрагментами с задержкой между ними
+(как настоящая генерация). Обычный путь показывает план только после последнего фрагмента,
+потоковый — как только пришёл заголовок {{дата}}// и первая строка плана.
+
+Запуск: python bench/plan_streaming.py [requests] [token_delay_ms]
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+from aiohttp import web
+
+PORT = 8770
+os.environ.update({
+    "OPENAI_API_KEY": "bench", "OPENAI_API_URL": f"http://127.0.0.1:{PORT}/v1",
+    "ANTHROPIC_API_KEY": "bench", "ANTHROPIC_API_URL": f"http://127.0.0.1:{PORT}",
+})
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+import openai_client  # noqa: E402
+from llm_gateway import gateway  # noqa: E402
+
+PLAN = (
+    "{{24 марта 2024 г.}}//📅 Дневной план\n🕗 Первая половина дня\n\n- [ ] Отправить отчет руководителю\n"
+    "- [ ] Зайти в аптеку\n🕑 Вторая половина дня\n\n- [ ] Позвонить маме\n- [ ] Тренировка\n"
+    "🕗 Третья половина дня\n\n- [ ] Прочитать главу книги\n🔄 Итоги дня\n"
+)
+FIRST_TOKEN_DELAY = 0.3  # Время модели «на подумать» до первого токена
+
+
+def fragments(size: int = 6) -> list[str]:
+    return [PLAN[i:i + size] for i in range(0, len(PLAN), size)]
+
+
+def sse(data: dict, event: str | None = None) -> bytes:
+    head = f"event: {event}\n" if event else ""
+    return f"{head}data: {json.dumps(data, ensure_ascii=False)}\n\n".encode()
+
+
+def mock_app(token_delay: float) -> web.Application:
+    async def chat_completions(request):
+        body = await request.json()
+        await asyncio.sleep(FIRST_TOKEN_DELAY)
+        if not body.get("stream"):
+            await asyncio.sleep(token_delay * len(fragments()))
+            return web.json_response({
+                "id": "bench", "object": "chat.completion", "created": 0, "model": "gpt-4o",
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": PLAN}}],
+                "usage": {"prompt_tokens": 1500, "completion_tokens": 120, "total_tokens": 1620},
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for fragment in fragments():
+            await response.write(sse({"id": "bench", "object": "chat.completion.chunk", "created": 0, "model": "gpt-4o",
+                                      "choices": [{"index": 0, "delta": {"content": fragment}, "finish_reason": None}]}))
+            await asyncio.sleep(token_delay)
+        await response.write(sse({"id": "bench", "object": "chat.completion.chunk", "created": 0, "model": "gpt-4o",
+                                  "choices": [], "usage": {"prompt_tokens": 1500, "completion_tokens": 120,
+                                                           "total_tokens": 1620}}))
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    async def messages(request):
+        body = await request.json()
+        await asyncio.sleep(FIRST_TOKEN_DELAY)
+        usage = {"input_tokens": 220, "output_tokens": 1}
+        if not body.get("stream"):
+            await asyncio.sleep(token_delay * len(fragments()))
+            return web.json_response({
+                "id": "bench", "type": "message", "role": "assistant", "model": "claude",
+                "content": [{"type": "text", "text": PLAN}], "stop_reason": "end_turn", "usage": usage,
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await response.write(sse({"type": "message_start", "message": {
+            "id": "bench", "type": "message", "role": "assistant", "model": "claude", "content": [],
+            "stop_reason": None, "stop_sequence": None, "usage": usage}}, "message_start"))
+        await response.write(sse({"type": "content_block_start", "index": 0,
+                                  "content_block": {"type": "text", "text": ""}}, "content_block_start"))
+        for fragment in fragments():
+            await response.write(sse({"type": "content_block_delta", "index": 0,
+                                      "delta": {"type": "text_delta", "text": fragment}}, "content_block_delta"))
+            await asyncio.sleep(token_delay)
+        await response.write(sse({"type": "content_block_stop", "index": 0}, "content_block_stop"))
+        await response.write(sse({"type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                  "usage": {"output_tokens": 120}}, "message_delta"))
+        await response.write(sse({"type": "message_stop"}, "message_stop"))
+        return response
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    app.router.add_post("/v1/messages", messages)
+    return app
+
+
+async def blocking(generate) -> tuple[float, float]:
+    started = time.perf_counter()
+    await generate("план")
+    elapsed = time.perf_counter() - started
+    return elapsed, elapsed
+
+
+async def streaming(stream) -> tuple[float, float]:
+    started = time.perf_counter()
+    first_visible = None
+    async for chunk in stream("план"):
+        if chunk.body and first_visible is None:
+            first_visible = time.perf_counter() - started
+    return first_visible, time.perf_counter() - started
+
+
+async def measure(name: str, mode: str, run, requests: int) -> dict:
+    samples = [await run() for _ in range(requests)]
+    first = sorted(sample[0] for sample in samples)
+    total = sorted(sample[1] for sample in samples)
+    return {
+        "provider": name,
+        "mode": mode,
+        "first_visible_p50_s": round(first[len(first) // 2], 3),
+        "complete_p50_s": round(total[len(total) // 2], 3),
+    }
+
+
+async def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    token_delay = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.03
+
+    runner = web.AppRunner(mock_app(token_delay))
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+    await gateway.warm_up()
+
+    try:
+        results = [
+            await measure("openai", "blocking", lambda: blocking(openai_client.generate_gpt_response), requests),
+            await measure("openai", "streaming", lambda: streaming(openai_client.stream_gpt_response), requests),
+            await measure("anthropic", "blocking", lambda: blocking(openai_client.generate_claude_response), requests),
+            await measure("anthropic", "streaming", lambda: streaming(openai_client.stream_claude_response), requests),
+        ]
+    finally:
+        await gateway.close()
+        await runner.cleanup()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,77 @@
+"""
+Подготовка системного промта на один запрос: раньше (чтение файла, даты на неделю, склейка строки)
+и через PromptManager (mtime-проверка и кэш блока дат на сутки).
+
+С --live N дополнительно отправляет N запросов к каждому провайдеру (нужны ключи в .env)
+и печатает расход токенов, включая прочитанные из кэша промта.
+
+Запуск: python bench/prompt_prep.py [--iterations N] [--live N]
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+os.environ.setdefault("PROMT_PATH", str(ROOT / "data" / "prompt.txt"))
+sys.path.insert(0, str(ROOT / "app"))
+import prompts  # noqa: E402
+
+TEXT = "На завтра: отправить отчет руководителю, зайти в аптеку, позвонить маме"
+
+
+def legacy_prep(text: str) -> list[dict]:
+    """Как было в openai_client до PromptManager."""
+    with open(prompts.PROMT_PATH, "r", encoding="utf-8") as file:
+        prompt = file.read()
+    now_moscow = datetime.datetime.now(prompts.MOSCOW)
+    formatted_date = now_moscow.strftime("%A, %d-%ое %B %Y, %H:%M по Москве")
+    week_dates = prompts.generate_week_dates()
+    return [
+        {"role": "system", "content": f"Сегодня {formatted_date}\nДаты на неделю: {week_dates}\n{prompt}"},
+        {"role": "user", "content": text},
+    ]
+
+
+def time_per_call(func, iterations: int) -> float:
+    func(TEXT)  # Первый вызов заполняет кэши
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func(TEXT)
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+async def live(requests: int) -> dict:
+    import openai_client
+    for _ in range(requests):
+        await openai_client.generate_gpt_response(TEXT)
+        await openai_client.generate_claude_response(TEXT)
+    return openai_client.usage_stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=10_000)
+    parser.add_argument("--live", type=int, default=0)
+    args = parser.parse_args()
+
+    manager = prompts.PromptManager(prompts.PROMT_PATH)
+    result = {
+        "legacy_us_per_request": round(time_per_call(legacy_prep, args.iterations), 2),
+        "manager_openai_us_per_request": round(time_per_call(manager.openai_messages, args.iterations), 2),
+        "manager_anthropic_us_per_request": round(
+            time_per_call(lambda text: manager.anthropic_system(), args.iterations), 2),
+        "prompt_reloads": manager.reloads,
+    }
+    if args.live:
+        result["usage"] = asyncio.run(live(args.live))
+
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Досылка большого бэклога не должна тормозить остальные соединения.
+
+Поднимает API, подключает clients (по умолчанию 200) клиентов, которые отвечают pong на ping (PING_INTERVAL уменьшен до 0.1 с),
+и меряет опоздание ping — насколько промежуток между соседними ping больше PING_INTERVAL. Это задержка,
+которую цикл событий добавляет всем клиентам. Сначала замер без нагрузки, затем — пока переподключившийся
+клиент получает и подтверждает бэклог из backlog (5000) непрочитанных сообщений. Если p99 опоздания во время
+досылки вырос больше чем на BUDGET_MS (как было с time.sleep между сообщениями), скрипт падает.
+
+Запуск: python bench/replay_latency.py [backlog] [clients]
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import aiohttp
+import uvicorn
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+import database  # noqa: E402
+import api  # noqa: E402
+
+logging.disable(logging.WARNING)
+
+PORT = 8776
+URL = f"http://127.0.0.1:{PORT}"
+PING_INTERVAL = 0.1
+BASELINE_SECONDS = 3
+BUDGET_MS = 50
+
+
+def seed(user: str, messages: int):
+    db = sqlite3.connect(database.DATABASE_PATH)
+    db.executemany(
+        "INSERT INTO messages (user_id, text, model_text, chat_id, progress_message_id, plan_date) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        ((user, "план", "📅 Дневной план\n- [ ] Задача", 1, i, "2024-03-24") for i in range(messages))
+    )
+    db.commit()
+    db.close()
+
+
+def percentiles(values: list[float]) -> dict:
+    values = sorted(values)
+    return {"samples": len(values),
+            "p50_ms": round(values[len(values) // 2] * 1000, 2),
+            "p99_ms": round(values[int(len(values) * 0.99)] * 1000, 2),
+            "max_ms": round(values[-1] * 1000, 2)}
+
+
+class PingClients:
+    """Клиенты, которые только отвечают на ping; опоздания пишутся в текущую фазу."""
+
+    def __init__(self):
+        self.phase: list[float] | None = None
+
+    async def run(self, session: aiohttp.ClientSession, index: int):
+        last = None
+        async with session.ws_connect(f"{URL}/ws/ping-{index}") as ws:
+            async for frame in ws:
+                if json.loads(frame.data).get("type") != "ping":
+                    continue
+                now = time.perf_counter()
+                if last is not None and self.phase is not None:
+                    self.phase.append(max(0.0, now - last - PING_INTERVAL))
+                last = now
+                await ws.send_json({"type": "pong"})
+
+
+async def replay(session: aiohttp.ClientSession, user: str, messages: int) -> float:
+    """Новое устройство получает весь бэклог по одному сообщению и подтверждает каждое."""
+    received = 0
+    started = time.perf_counter()
+    async with session.ws_connect(f"{URL}/ws/{user}?device_id=laptop") as ws:
+        async for frame in ws:
+            data = json.loads(frame.data)
+            if data.get("type") == "new_message":
+                received += 1
+                await ws.send_json({"type": "confirm", "db_message_id": data["db_message_id"]})
+            elif data.get("type") == "ping":
+                await ws.send_json({"type": "pong"})
+            if received >= messages:
+                break
+    return time.perf_counter() - started
+
+
+async def main():
+    backlog = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    database.DATABASE_PATH = os.path.join(tempfile.mkdtemp(), "messages.db")
+    await database.init_db()
+    seed("backlog", backlog)
+    api.PING_INTERVAL = PING_INTERVAL
+    api.edit_telegram_message = lambda *args: None  # Telegram в бенчмарке не нужен
+
+    server = uvicorn.Server(uvicorn.Config(api.app, host="127.0.0.1", port=PORT, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    pingers = PingClients()
+    try:
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as session:
+            listeners = [asyncio.create_task(pingers.run(session, i)) for i in range(clients)]
+            await asyncio.sleep(1)  # Все подключились, ping идут по расписанию
+
+            idle: list[float] = []
+            pingers.phase = idle
+            await asyncio.sleep(BASELINE_SECONDS)
+
+            during: list[float] = []
+            pingers.phase = during
+            replay_s = await replay(session, "backlog", backlog)
+            pingers.phase = None
+
+            for task in listeners:
+                task.cancel()
+            await asyncio.gather(*listeners, return_exceptions=True)
+    finally:
+        server.should_exit = True
+        await server_task
+
+    report = {"backlog": backlog, "clients": clients, "replay_s": round(replay_s, 2),
+              "replay_msgs_per_s": round(backlog / replay_s), "ping_lateness": {
+                  "idle": percentiles(idle), "during_replay": percentiles(during)}}
+    print(json.dumps(report, indent=2))
+
+    growth = report["ping_lateness"]["during_replay"]["p99_ms"] - report["ping_lateness"]["idle"]["p99_ms"]
+    assert growth <= BUDGET_MS, f"p99 опоздания ping вырос на {growth:.1f} мс во время досылки (бюджет {BUDGET_MS})"
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,95 @@
+"""
+Время импорта модулей бота и API при старте контейнера (python -X importtime).
+
+Для каждой цели запускает отдельный интерпретатор, разбирает вывод -X importtime и печатает
+суммарное время импорта, время до готовности модуля и самые дорогие зависимости.
+С --baseline сравнивает с сохранённым результатом, с --save сохраняет текущий.
+
+Запуск: python bench/startup.py [--runs N] [--baseline FILE] [--save FILE]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+APP_DIR = Path(__file__).resolve().parent.parent / "app"
+TARGETS = ["bot", "api", "transcriber", "openai_client"]
+TOP = 10
+
+# Заглушки переменных окружения: bot.py проверяет формат токена при импорте
+ENV = {
+    "TELEGRAM_BOT_TOKEN": "123456:bench",
+    "OPENAI_API_KEY": "bench",
+    "ANTHROPIC_API_KEY": "bench",
+}
+
+
+def import_once(module: str) -> tuple[float, dict[str, int]]:
+    """Возвращает время работы интерпретатора и накопленное время импорта (мкс) цели и её прямых зависимостей."""
+    started = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=APP_DIR, env={**os.environ, **ENV}, capture_output=True, text=True, check=True,
+    )
+    elapsed = time.perf_counter() - started
+
+    cumulative = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        name = name[1:]
+        level = (len(name) - len(name.lstrip())) // 2  # Вложенность отмечена отступом по два пробела
+        if level <= 1:
+            cumulative[name.strip()] = int(cumulative_us)
+    return elapsed, cumulative
+
+
+def measure(module: str, runs: int) -> dict:
+    walls, totals = [], []
+    last: dict[str, int] = {}
+    for _ in range(runs):
+        wall, cumulative = import_once(module)
+        walls.append(wall)
+        totals.append(cumulative.get(module, 0))
+        last = cumulative
+
+    heaviest = sorted(((name, us) for name, us in last.items() if name != module),
+                      key=lambda item: item[1], reverse=True)[:TOP]
+    return {
+        "module": module,
+        "wall_s": round(statistics.median(walls), 3),
+        "import_ms": round(statistics.median(totals) / 1000, 1),
+        "heaviest_ms": {name: round(us / 1000, 1) for name, us in heaviest},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--baseline")
+    parser.add_argument("--save")
+    args = parser.parse_args()
+
+    results = [measure(module, args.runs) for module in TARGETS]
+
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = {item["module"]: item for item in json.load(file)}
+        for item in results:
+            if item["module"] in baseline:
+                item["import_ms_delta"] = round(item["import_ms"] - baseline[item["module"]]["import_ms"], 1)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Время до первой обратной связи и полная задержка «голосовое → план»
+для обычной и потоковой транскрибации.
+
+Обычный путь: ответ модели целиком, затем LLM. Потоковый: первый сегмент показывается сразу,
+а LLM стартует, как только уверенный сегмент дошёл почти до конца записи (как в TranscriptionProgress).
+LLM заменена задержкой LLM_DELAY секунд.
+
+Запуск: WHISPER_MODEL_SIZE=tiny python bench/streaming_transcription.py [files] [llm_delay_s]
+"""
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from transcriber import TranscriptionService  # noqa: E402
+from transcription import make_audio  # noqa: E402
+
+# Те же пороги, что у бота (bot.py импортировать нельзя — он создаёт Bot с токеном)
+SPECULATIVE_TAIL = float(os.getenv("SPECULATIVE_TAIL", "1.0"))
+SPECULATIVE_MIN_LOGPROB = float(os.getenv("SPECULATIVE_MIN_LOGPROB", "-0.5"))
+
+
+async def run_one(service: TranscriptionService, path: str, stream: bool, llm_delay: float) -> dict:
+    started = time.perf_counter()
+    segments: list[str] = []
+    first_segment_s = None
+    speculative: tuple[str, float] | None = None  # (текст, момент старта LLM)
+
+    def on_segment(segment):
+        nonlocal first_segment_s, speculative
+        segments.append(segment.text)
+        now = time.perf_counter() - started
+        if first_segment_s is None:
+            first_segment_s = now
+        if (speculative is None and segment.end >= segment.duration - SPECULATIVE_TAIL
+                and segment.avg_logprob >= SPECULATIVE_MIN_LOGPROB):
+            speculative = (" ".join(segments).strip(), now)
+
+    result = await service.transcribe(path, on_segment=on_segment if stream else None)
+    transcribed_s = time.perf_counter() - started
+
+    if speculative is not None and speculative[0] == result.text:
+        end_to_end_s = max(transcribed_s, speculative[1] + llm_delay)
+    else:
+        end_to_end_s = transcribed_s + llm_delay
+    return {
+        "first_feedback_s": first_segment_s if first_segment_s is not None else transcribed_s,
+        "end_to_end_s": end_to_end_s,
+        "speculative_hit": speculative is not None and speculative[0] == result.text,
+    }
+
+
+def summarize(mode: str, runs: list[dict]) -> dict:
+    def p50(key):
+        return round(sorted(run[key] for run in runs)[len(runs) // 2], 3)
+    return {
+        "mode": mode,
+        "first_feedback_p50_s": p50("first_feedback_s"),
+        "end_to_end_p50_s": p50("end_to_end_s"),
+        "speculative_hits": sum(run["speculative_hit"] for run in runs),
+    }
+
+
+async def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    llm_delay = float(sys.argv[2]) if len(sys.argv) > 2 else 2.0
+
+    directory = tempfile.mkdtemp()
+    files = []
+    for i in range(count):
+        path = os.path.join(directory, f"voice_{i}.wav")
+        make_audio(path, seconds=random.uniform(10, 30))
+        files.append(path)
+
+    service = TranscriptionService(workers=1)
+    await service.start()
+    await service.transcribe(files[0])  # Прогрев модели
+
+    results = []
+    for mode, stream in (("batch", False), ("streaming", True)):
+        runs = [await run_one(service, path, stream, llm_delay) for path in files]
+        results.append(summarize(mode, runs))
+    await service.stop()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,209 @@
+"""
+Локальные заменители внешних сервисов для bench/e2e.py: Telegram Bot API и OpenAI/Anthropic.
+
+TelegramStub отдаёт боту обновления через getUpdates, принимает sendMessage/editMessageText/getFile
+и скачивание файлов и сообщает о каждом вызове слушателю on_call(method, params, message).
+LLMStub отвечает планом фрагментами с заданной задержкой до первого токена и между токенами.
+"""
+import asyncio
+import itertools
+import json
+import os
+import time
+from typing import Callable
+
+from aiohttp import web
+
+PLAN = (
+    "{{24 марта 2024 г.}}//📅 Дневной план 24-ое марта 2024 года\n🕗 Первая половина дня\n\n"
+    "- [ ] Отправить отчет руководителю\n- [ ] Зайти в аптеку\n\n🕑 Вторая половина дня\n\n"
+    "- [ ] Позвонить маме\n- [ ] Тренировка\n\n🌙 Третья половина дня\n\n- [ ] Прочитать главу книги\n\n"
+    "🔄 Итоги дня"
+)
+BOT_USER = {"id": 42, "is_bot": True, "first_name": "Planner", "username": "planner_bench_bot"}
+
+
+async def serve(app: web.Application, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+def user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+
+def chat(chat_id: int) -> dict:
+    return {"id": chat_id, "type": "private"}
+
+
+class TelegramStub:
+    """Минимальный Bot API: очередь обновлений и запись всех вызовов бота."""
+
+    def __init__(self, on_call: Callable[[str, dict, dict | None], None] | None = None,
+                 voice_bytes: int = 32 * 1024):
+        self.on_call = on_call
+        self.voice_bytes = voice_bytes
+        self.calls: dict[str, int] = {}
+        self._updates: list[dict] = []
+        self._new_updates = asyncio.Event()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1000)
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        app.router.add_get("/file/bot{token}/{path:.*}", self.download)
+        return app
+
+    # Обновления, которые получит бот
+    def push(self, **update) -> int:
+        update_id = next(self._update_ids)
+        self._updates.append({"update_id": update_id, **update})
+        self._new_updates.set()
+        return update_id
+
+    def push_text(self, user_id: int, text: str) -> int:
+        return self.push(message={"message_id": next(self._message_ids), "date": int(time.time()),
+                                  "chat": chat(user_id), "from": user(user_id), "text": text})
+
+    def push_voice(self, user_id: int, duration: int = 20) -> int:
+        unique_id = f"voice-{user_id}-{next(self._message_ids)}"
+        return self.push(message={
+            "message_id": next(self._message_ids), "date": int(time.time()), "chat": chat(user_id),
+            "from": user(user_id),
+            "voice": {"file_id": unique_id, "file_unique_id": unique_id, "duration": duration,
+                      "mime_type": "audio/ogg", "file_size": self.voice_bytes},
+        })
+
+    def push_callback(self, user_id: int, message_id: int, data: str) -> int:
+        return self.push(callback_query={
+            "id": str(next(self._message_ids)), "from": user(user_id), "chat_instance": str(user_id), "data": data,
+            "message": {"message_id": message_id, "date": int(time.time()), "chat": chat(user_id), "text": "план"},
+        })
+
+    async def _params(self, request: web.Request) -> dict:
+        if request.content_type == "application/json":
+            return await request.json()
+        params = dict(await request.post())
+        for key in ("reply_markup",):
+            if isinstance(params.get(key), str):
+                params[key] = json.loads(params[key])
+        return params
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = await self._params(request)
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if method == "getUpdates":
+            return web.json_response({"ok": True, "result": await self._get_updates(params)})
+
+        result, message = True, None
+        if method == "getMe":
+            result = BOT_USER
+        elif method in ("sendMessage", "editMessageText"):
+            chat_id = int(params["chat_id"])
+            message_id = int(params["message_id"]) if "message_id" in params else next(self._message_ids)
+            message = {"message_id": message_id, "date": int(time.time()), "chat": chat(chat_id),
+                       "from": BOT_USER, "text": params.get("text", "")}
+            if params.get("reply_markup"):
+                message["reply_markup"] = params["reply_markup"]
+            result = message
+        elif method == "getFile":
+            file_id = params["file_id"]
+            result = {"file_id": file_id, "file_unique_id": file_id, "file_size": self.voice_bytes,
+                      "file_path": f"voice/{file_id}.ogg"}
+        if self.on_call is not None:
+            self.on_call(method, params, message)
+        return web.json_response({"ok": True, "result": result})
+
+    async def _get_updates(self, params: dict) -> list[dict]:
+        offset = int(params.get("offset") or 0)
+        self._updates = [update for update in self._updates if update["update_id"] >= offset]
+        if not self._updates:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout=float(params.get("timeout") or 0))
+            except TimeoutError:
+                pass
+        return self._updates[:100]
+
+    async def download(self, request: web.Request) -> web.Response:
+        return web.Response(body=os.urandom(self.voice_bytes))  # Уникальное содержимое — мимо кэша по хэшу
+
+
+class LLMStub:
+    """OpenAI chat.completions и Anthropic messages (обычные и потоковые) с настраиваемой задержкой."""
+
+    def __init__(self, first_token: float = 0.5, token_delay: float = 0.02, fragment: int = 16, plan: str = PLAN):
+        self.first_token = first_token
+        self.token_delay = token_delay
+        self.fragments = [plan[i:i + fragment] for i in range(0, len(plan), fragment)]
+        self.plan = plan
+        self.requests = 0
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_post("/v1/messages", self.messages)
+        return app
+
+    @staticmethod
+    def sse(data: dict, event: str | None = None) -> bytes:
+        head = f"event: {event}\n" if event else ""
+        return f"{head}data: {json.dumps(data, ensure_ascii=False)}\n\n".encode()
+
+    async def chat_completions(self, request: web.Request):
+        body = await request.json()
+        self.requests += 1
+        await asyncio.sleep(self.first_token)
+        usage = {"prompt_tokens": 1500, "completion_tokens": 120, "total_tokens": 1620}
+        if not body.get("stream"):
+            await asyncio.sleep(self.token_delay * len(self.fragments))
+            return web.json_response({
+                "id": "stub", "object": "chat.completion", "created": 0, "model": body["model"], "usage": usage,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": self.plan}}],
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        chunk = {"id": "stub", "object": "chat.completion.chunk", "created": 0, "model": body["model"]}
+        for fragment in self.fragments:
+            await response.write(self.sse({**chunk, "choices": [
+                {"index": 0, "delta": {"content": fragment}, "finish_reason": None}]}))
+            await asyncio.sleep(self.token_delay)
+        await response.write(self.sse({**chunk, "choices": [], "usage": usage}))
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    async def messages(self, request: web.Request):
+        body = await request.json()
+        self.requests += 1
+        await asyncio.sleep(self.first_token)
+        usage = {"input_tokens": 220, "output_tokens": 1}
+        if not body.get("stream"):
+            await asyncio.sleep(self.token_delay * len(self.fragments))
+            return web.json_response({
+                "id": "stub", "type": "message", "role": "assistant", "model": body["model"],
+                "content": [{"type": "text", "text": self.plan}], "stop_reason": "end_turn", "usage": usage,
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await response.write(self.sse({"type": "message_start", "message": {
+            "id": "stub", "type": "message", "role": "assistant", "model": body["model"], "content": [],
+            "stop_reason": None, "stop_sequence": None, "usage": usage}}, "message_start"))
+        await response.write(self.sse({"type": "content_block_start", "index": 0,
+                                       "content_block": {"type": "text", "text": ""}}, "content_block_start"))
+        for fragment in self.fragments:
+            await response.write(self.sse({"type": "content_block_delta", "index": 0,
+                                           "delta": {"type": "text_delta", "text": fragment}}, "content_block_delta"))
+            await asyncio.sleep(self.token_delay)
+        await response.write(self.sse({"type": "content_block_stop", "index": 0}, "content_block_stop"))
+        await response.write(self.sse({"type": "message_delta", "usage": {"output_tokens": 120},
+                                       "delta": {"stop_reason": "end_turn", "stop_sequence": None}},
+                                      "message_delta"))
+        await response.write(self.sse({"type": "message_stop"}, "message_stop"))
+        return response
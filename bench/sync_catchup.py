@@ -0,0 +1,166 @@
+"""
+Догоняющая синхронизация клиента Obsidian, отставшего на N сообщений (по умолчанию 10k).
+
+"ws_v1"         — переподключение WebSocket: досылка непрочитанных по одному, ACK на каждое (окно REPLAY_WINDOW);
+"ws_v2"         — то же с ?protocol=2: пачки и накопительный ACK;
+"http_gzip"     — GET /messages/sync страницами по id + POST /messages/ack на страницу, ответы в gzip;
+"http_identity" — то же без сжатия.
+Для HTTP считаются байты на проводе. Затем — опрос «хвоста» с If-None-Match (ответ 304 без тела).
+У каждого режима свой пользователь с N непрочитанными сообщениями.
+
+Запуск: python bench/sync_catchup.py [messages] [page_size]
+"""
+import asyncio
+import gzip
+import json
+import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import aiohttp
+import uvicorn
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+import database  # noqa: E402
+import api  # noqa: E402
+
+logging.disable(logging.WARNING)
+
+PORT = 8775
+URL = f"http://127.0.0.1:{PORT}"
+MODES = ("ws_v1", "ws_v2", "http_gzip", "http_identity")
+TASKS = ("Отправить отчёт руководителю", "Зайти в аптеку", "Позвонить маме", "Тренировка в зале",
+         "Прочитать главу книги", "Оплатить счета", "Созвон с командой", "Купить продукты", "Разобрать почту",
+         "Записаться к врачу", "Погулять с собакой", "Подготовить презентацию")
+POLLS = 500
+
+
+def plan(rng: random.Random) -> tuple[str, str]:
+    tasks = rng.sample(TASKS, rng.randint(4, 9))
+    text = ", ".join(task.lower() for task in tasks) + f", в {rng.randint(8, 21)}:{rng.choice(('00', '30'))} встреча"
+    model_text = f"📅 Дневной план {rng.randint(1, 28)}-ое марта 2024 года\n" + "".join(
+        f"- [ ] {task} ({rng.randint(8, 21)}:{rng.randint(0, 59):02d})\n" for task in tasks)
+    return text, model_text
+
+
+def seed(messages: int):
+    rng = random.Random(1)
+    db = sqlite3.connect(database.DATABASE_PATH)
+    db.executemany(
+        "INSERT INTO messages (user_id, text, model_text, chat_id, progress_message_id, plan_date, trace_id) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        ((mode, *plan(rng), 1, i, "2024-03-24", f"{rng.getrandbits(64):016x}")
+         for mode in MODES for i in range(messages))
+    )
+    db.commit()
+    db.close()
+
+
+async def unread(user: str) -> int:
+    async with database.acquire() as db:
+        async with db.execute("SELECT COUNT(*) FROM messages WHERE user_id = ? AND processed = 0", (user,)) as cursor:
+            return (await cursor.fetchone())[0]
+
+
+async def ws_catchup(session: aiohttp.ClientSession, user: str, protocol: int, messages: int) -> dict:
+    received = 0
+    started = time.perf_counter()
+    async with session.ws_connect(f"{URL}/ws/{user}?device_id=laptop&protocol={protocol}") as ws:
+        async for frame in ws:
+            data = json.loads(frame.data)
+            if data.get("type") == "messages":
+                received += len(data["messages"])
+                await ws.send_json({"type": "confirm", "up_to": data["messages"][-1]["db_message_id"]})
+            elif data.get("type") == "new_message":
+                received += 1
+                await ws.send_json({"type": "confirm", "db_message_id": data["db_message_id"]})
+            if received >= messages:
+                break
+        elapsed = time.perf_counter() - started
+        while await unread(user):  # ACK записываются в фоне
+            await asyncio.sleep(0.01)
+    return {"received": received, "seconds": round(elapsed, 3),
+            "until_all_processed_s": round(time.perf_counter() - started, 3)}
+
+
+async def http_catchup(session: aiohttp.ClientSession, user: str, page_size: int, compressed: bool) -> dict:
+    headers = {"Accept-Encoding": "gzip" if compressed else "identity"}
+    received, requests, wire_bytes, body_bytes, since = 0, 0, 0, 0, 0
+    started = time.perf_counter()
+    while True:
+        async with session.get(f"{URL}/messages/sync", headers=headers,
+                               params={"telegram_user_id": user, "since": since, "limit": page_size}) as response:
+            raw = await response.read()
+            encoding = response.headers.get("Content-Encoding")
+            etag = response.headers.get("ETag")
+        body = gzip.decompress(raw) if encoding == "gzip" else raw
+        page = json.loads(body)
+        requests += 1
+        wire_bytes += len(raw)
+        body_bytes += len(body)
+        ids = [message["db_message_id"] for message in page["messages"]]
+        received += len(ids)
+        if ids:
+            async with session.post(f"{URL}/messages/ack", json={"telegram_user_id": user, "device_id": "laptop",
+                                                                  "ids": ids}) as response:
+                await response.read()
+            requests += 1
+        since = page["next_since"]
+        if not page["has_more"]:
+            break
+    elapsed = time.perf_counter() - started
+
+    # Клиент догнал и опрашивает хвост: тот же запрос с If-None-Match
+    latencies, not_modified = [], 0
+    for _ in range(POLLS):
+        poll_started = time.perf_counter()
+        async with session.get(f"{URL}/messages/sync", headers={**headers, "If-None-Match": etag or ""},
+                               params={"telegram_user_id": user, "since": since, "limit": page_size}) as response:
+            await response.read()
+            not_modified += response.status == 304
+            etag = response.headers.get("ETag", etag)
+        latencies.append(time.perf_counter() - poll_started)
+    latencies.sort()
+    return {"received": received, "seconds": round(elapsed, 3), "requests": requests,
+            "wire_kb": round(wire_bytes / 1024, 1), "json_kb": round(body_bytes / 1024, 1),
+            "unread_left": await unread(user),
+            "tail_poll": {"not_modified": not_modified, "polls": POLLS,
+                          "p50_ms": round(latencies[len(latencies) // 2] * 1000, 3),
+                          "p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 3)}}
+
+
+async def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    page_size = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+
+    database.DATABASE_PATH = os.path.join(tempfile.mkdtemp(), "messages.db")
+    await database.init_db()
+    seed(messages)
+    api.edit_telegram_message = lambda *args: None  # Telegram в бенчмарке не нужен
+
+    server = uvicorn.Server(uvicorn.Config(api.app, host="127.0.0.1", port=PORT, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    results = {"messages": messages, "page_size": page_size}
+    try:
+        async with aiohttp.ClientSession(auto_decompress=False) as session:
+            results["ws_v1"] = await ws_catchup(session, "ws_v1", 1, messages)
+            results["ws_v2"] = await ws_catchup(session, "ws_v2", 2, messages)
+            results["http_gzip"] = await http_catchup(session, "http_gzip", page_size, True)
+            results["http_identity"] = await http_catchup(session, "http_identity", page_size, False)
+    finally:
+        server.should_exit = True
+        await server_task
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,120 @@
+"""
+Проверка TelegramClient против локальной заглушки Bot API (aiohttp):
+  retry_429 — на 429 с retry_after клиент ждёт указанное время и повторяет, вызывающий получает успешный ответ;
+  coalesce  — пачка правок одного (chat_id, message_id) уходит одним запросом с последним текстом,
+              правки, пришедшие пока запрос ждёт слот чата, — ещё одним;
+  spacing   — правки разных сообщений одного чата идут не чаще per_chat_interval,
+              разных чатов — ограничены только global_interval (в среднем по пачке).
+Интервалы уменьшены, чтобы прогон занимал секунды. Любое нарушение — AssertionError.
+
+Запуск: python bench/telegram_client.py
+"""
+import asyncio
+import json
+import logging
+import sys
+import time
+from pathlib import Path
+
+from aiohttp import web
+
+from stubs import serve
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+from telegram_client import TelegramClient  # noqa: E402
+
+logging.disable(logging.WARNING)
+
+PORT = 8777
+PER_CHAT_INTERVAL = 0.2
+GLOBAL_INTERVAL = 0.01
+RETRY_AFTER = 1
+
+
+class BotAPIStub:
+    """Записывает правки (время, chat_id, message_id, текст); первые throttle_first запросов получают 429."""
+
+    def __init__(self):
+        self.edits: list[tuple[float, int, int, str]] = []
+        self.requests = 0
+        self.throttle_first = 0
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        params = await request.json()
+        self.requests += 1
+        if self.throttle_first > 0:
+            self.throttle_first -= 1
+            return web.json_response({"ok": False, "error_code": 429, "description": "Too Many Requests",
+                                      "parameters": {"retry_after": RETRY_AFTER}}, status=429)
+        self.edits.append((time.perf_counter(), params["chat_id"], params["message_id"], params["text"]))
+        return web.json_response({"ok": True, "result": True})
+
+
+async def retry_429(stub: BotAPIStub, client: TelegramClient) -> dict:
+    stub.requests, stub.throttle_first = 0, 2
+    started = time.perf_counter()
+    ok = await client.edit_message_text(1, 1, "после 429")
+    elapsed = time.perf_counter() - started
+    assert ok, "правка после 429 не удалась"
+    assert stub.requests == 3, stub.requests  # Два 429 и успешный повтор
+    assert elapsed >= 2 * RETRY_AFTER, f"повтор раньше retry_after: {elapsed:.2f}s"
+    return {"requests": stub.requests, "elapsed_s": round(elapsed, 2)}
+
+
+async def coalesce(stub: BotAPIStub, client: TelegramClient) -> dict:
+    await asyncio.sleep(PER_CHAT_INTERVAL)  # Слот чата свободен
+    stub.edits.clear()
+    first = [client.edit_message_text(2, 7, f"правка {i}") for i in range(10)]
+    await asyncio.sleep(0.05)  # Первая пачка ушла, следующая ждёт слот чата
+    second = [client.edit_message_text(2, 7, f"вторая {i}") for i in range(10)]
+    results = await asyncio.gather(*first, *second)
+    assert all(results), results
+    texts = [text for _, _, _, text in stub.edits]
+    assert texts == ["правка 9", "вторая 9"], texts
+    gap = stub.edits[1][0] - stub.edits[0][0]
+    assert gap >= PER_CHAT_INTERVAL * 0.9, f"правки одного чата через {gap:.3f}s"
+    return {"edits_queued": 20, "requests": len(texts), "gap_s": round(gap, 3)}
+
+
+async def spacing(stub: BotAPIStub, client: TelegramClient) -> dict:
+    await asyncio.sleep(PER_CHAT_INTERVAL)
+    stub.edits.clear()
+    await asyncio.gather(*(client.edit_message_text(3, message_id, "план") for message_id in range(5)))
+    same_chat = [b[0] - a[0] for a, b in zip(stub.edits, stub.edits[1:])]
+    assert min(same_chat) >= PER_CHAT_INTERVAL * 0.9, same_chat
+
+    stub.edits.clear()
+    started = time.perf_counter()
+    await asyncio.gather(*(client.edit_message_text(100 + chat_id, 1, "план") for chat_id in range(20)))
+    many_chats = time.perf_counter() - started
+    # Отдельные промежутки на заглушке дрожат на время запроса, поэтому общий лимит проверяем по всей пачке
+    span = stub.edits[-1][0] - stub.edits[0][0]
+    assert span >= (len(stub.edits) - 1) * GLOBAL_INTERVAL * 0.9, f"20 чатов за {span:.3f}s — общий лимит нарушен"
+    assert many_chats < PER_CHAT_INTERVAL * 2, f"разные чаты ждали лимит чата: {many_chats:.2f}s"
+    return {"same_chat_min_gap_s": round(min(same_chat), 3), "chats": 20, "many_chats_s": round(many_chats, 3),
+            "many_chats_span_s": round(span, 3)}
+
+
+async def main():
+    stub = BotAPIStub()
+    runner = await serve(stub.app(), PORT)
+    client = TelegramClient("42:bench", f"http://127.0.0.1:{PORT}", PER_CHAT_INTERVAL, GLOBAL_INTERVAL)
+    try:
+        results = {
+            "retry_429": await retry_429(stub, client),
+            "coalesce": await coalesce(stub, client),
+            "spacing": await spacing(stub, client),
+        }
+    finally:
+        await client.close()
+        await runner.cleanup()
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,91 @@
+"""
+Пропускная способность и p95 задержки транскрибации при разном делении ядер
+между процессами-воркерами и потоками.
+
+Генерирует N синтетических WAV-файлов и для каждой конфигурации «воркеры x потоки»
+отправляет их одновременно от нескольких пользователей.
+
+Запуск: WHISPER_MODEL_SIZE=tiny python bench/transcription.py [files] [1x8 2x4 4x2 ...]
+"""
+import asyncio
+import json
+import math
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+import wave
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+from transcriber import TranscriptionService  # noqa: E402
+
+SAMPLE_RATE = 16000
+USERS = 4
+
+
+def make_audio(path: str, seconds: float):
+    """Тон с шумом и паузами — достаточно, чтобы модель прошла весь декодер."""
+    frames = bytearray()
+    for i in range(int(seconds * SAMPLE_RATE)):
+        t = i / SAMPLE_RATE
+        voiced = (t % 1.0) < 0.7
+        sample = (0.3 * math.sin(2 * math.pi * 220 * t) if voiced else 0) + random.uniform(-0.05, 0.05)
+        frames += struct.pack("<h", int(sample * 32767))
+    with wave.open(path, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(bytes(frames))
+
+
+async def run(files: list[str], workers: int, threads: int) -> dict:
+    service = TranscriptionService(workers=workers, threads=threads, queue_size=len(files))
+    await service.start()
+    # Первый прогон только прогревает модели всех воркеров
+    await asyncio.gather(*(service.transcribe(files[0]) for _ in range(workers)))
+
+    latencies = []
+
+    async def one(i: int, path: str):
+        started = time.perf_counter()
+        await service.transcribe(path, user_id=str(i % USERS))
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i, path) for i, path in enumerate(files)))
+    elapsed = time.perf_counter() - started
+    metrics = service.metrics()
+    await service.stop()
+
+    latencies.sort()
+    return {
+        "workers": workers,
+        "threads": threads,
+        "files_per_min": round(len(files) / elapsed * 60, 2),
+        "p50_s": round(latencies[len(latencies) // 2], 2),
+        "p95_s": round(latencies[int(len(latencies) * 0.95)], 2),
+        "avg_wait_s": metrics["avg_wait_s"],
+        "max_wait_s": round(metrics["max_wait_s"], 2),
+    }
+
+
+async def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    splits = [tuple(map(int, split.split("x"))) for split in sys.argv[2:]] or [(1, 8), (2, 4), (4, 2)]
+
+    directory = tempfile.mkdtemp()
+    files = []
+    for i in range(count):
+        path = os.path.join(directory, f"voice_{i}.wav")
+        make_audio(path, seconds=random.uniform(5, 20))
+        files.append(path)
+
+    results = [await run(files, workers, threads) for workers, threads in splits]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,145 @@
+"""
+Кадры и байты на 1000 сообщений для протоколов WebSocket v1 и v2, со сжатием и без.
+
+Клиент подключается через TCP-прокси, который считает байты на проводе в обе стороны.
+Бэклог из N сообщений досылается при подключении: v1 подтверждает каждое сообщение,
+v2 — каждую пачку одним {"type": "confirm", "up_to": N}.
+Отдельно проверяется, что некорректные ACK (без id, с up_to не числом) пропускаются, а соединение
+остаётся открытым: после них обычный ACK отмечает сообщения обработанными. Иначе — AssertionError.
+
+Запуск: python bench/ws_protocol.py [messages]
+"""
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import aiohttp
+import uvicorn
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+import database  # noqa: E402
+import api  # noqa: E402
+
+logging.disable(logging.WARNING)
+
+SERVER_PORT = 8767
+PROXY_PORT = 8768
+PLAN = "📅 Дневной план\n🕗 Первая половина дня\n\n- [ ] Отправить отчет руководителю\n- [ ] Зайти в аптеку\n"
+
+traffic = {"down": 0, "up": 0}
+
+
+async def pipe(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, direction: str):
+    try:
+        while data := await reader.read(65536):
+            traffic[direction] += len(data)
+            writer.write(data)
+            await writer.drain()
+    finally:
+        writer.close()
+
+
+async def handle_proxy(client_reader, client_writer):
+    server_reader, server_writer = await asyncio.open_connection("127.0.0.1", SERVER_PORT)
+    await asyncio.gather(
+        pipe(client_reader, server_writer, "up"),
+        pipe(server_reader, client_writer, "down"),
+        return_exceptions=True,
+    )
+
+
+async def run(protocol: int, compress: bool, total: int) -> dict:
+    user = f"proto-{protocol}-{int(compress)}"
+    for i in range(total):
+        await database.insert_message(user, f"план {i}", PLAN, 1, i, "24 марта 2024 г.")
+
+    traffic.update(down=0, up=0)
+    frames_down = frames_up = received = 0
+    started = time.perf_counter()
+    url = f"http://127.0.0.1:{PROXY_PORT}/ws/{user}?protocol={protocol}"
+
+    async with aiohttp.ClientSession() as session:
+        async with session.ws_connect(url, compress=15 if compress else 0) as ws:
+            async for frame in ws:
+                frames_down += 1
+                data = json.loads(frame.data)
+                if data["type"] == "new_message":
+                    received += 1
+                    await ws.send_json({"type": "confirm", "db_message_id": data["db_message_id"],
+                                        "chat_id": data["chat_id"], "progress_message_id": data["progress_message_id"]})
+                    frames_up += 1
+                elif data["type"] == "messages":
+                    received += len(data["messages"])
+                    await ws.send_json({"type": "confirm", "up_to": data["messages"][-1]["db_message_id"]})
+                    frames_up += 1
+                if received >= total:
+                    break
+            elapsed = time.perf_counter() - started
+            await asyncio.sleep(0.1)  # Даём дойти последним ACK
+
+    scale = 1000 / total
+    return {
+        "protocol": protocol,
+        "compress": compress,
+        "frames_down_per_1k": round(frames_down * scale, 1),
+        "frames_up_per_1k": round(frames_up * scale, 1),
+        "bytes_down_per_1k": round(traffic["down"] * scale),
+        "bytes_up_per_1k": round(traffic["up"] * scale),
+        "replay_s": round(elapsed, 3),
+    }
+
+
+async def malformed_acks() -> dict:
+    user = "proto-malformed"
+    for i in range(3):
+        await database.insert_message(user, f"план {i}", PLAN, 1, i, "24 марта 2024 г.")
+    bad = [{"type": "confirm"}, {"type": "confirm", "up_to": "много"}, {"type": "confirm", "up_to": None},
+           {"type": "confirm", "up_to": [1]}, {"type": "confirm", "db_message_id": {"id": 1}}]
+
+    async with aiohttp.ClientSession() as session:
+        async with session.ws_connect(f"http://127.0.0.1:{SERVER_PORT}/ws/{user}?protocol=2") as ws:
+            data = await ws.receive_json()
+            assert data["type"] == "messages", data
+            for frame in bad:
+                await ws.send_json(frame)
+            await ws.send_json({"type": "confirm", "up_to": data["messages"][-1]["db_message_id"]})
+            await asyncio.sleep(0.5)  # ACK пишутся в БД в фоне
+            assert not ws.closed, "соединение закрыто после некорректного ACK"
+
+    unread = len(await database.fetch_unread_messages(user))
+    assert unread == 0, f"после некорректных ACK не подтверждено: {unread}"
+    return {"malformed_acks": len(bad), "connection_open": True, "unread_left": unread}
+
+
+async def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+    database.DATABASE_PATH = os.path.join(tempfile.mkdtemp(), "messages.db")
+    await database.init_db()
+    api.edit_telegram_message = lambda *args: None  # Telegram в бенчмарке не нужен
+
+    server = uvicorn.Server(uvicorn.Config(api.app, host="127.0.0.1", port=SERVER_PORT, log_level="warning",
+                                           ws_per_message_deflate=True))
+    server_task = asyncio.create_task(server.serve())
+    proxy = await asyncio.start_server(handle_proxy, "127.0.0.1", PROXY_PORT)
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    try:
+        results = [await run(protocol, compress, total) for protocol in (1, 2) for compress in (False, True)]
+        results.append(await malformed_acks())
+    finally:
+        proxy.close()
+        server.should_exit = True
+        await server_task
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())